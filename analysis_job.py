@@ -0,0 +1,250 @@
+import threading
+from datetime import datetime
+
+from data_processor import analyze_trades_from_data, DEFAULT_MATCHING_POLICY
+from perf_trace import trace_stage
+from api_client import DEFAULT_PAGE_CAP, extract_trade_list
+from stream_pipeline import analyze_trades_streaming, check_completeness
+from partitioned_pipeline import analyze_trades_partitioned
+from rollup_cube import RollupCube
+from details_store import DetailsWriter
+
+# 低内存模式未指定时间窗口时，按此天数分批获取
+DEFAULT_PARTITION_WINDOW_DAYS = 7
+
+# 各阶段在总进度中所占的区间 (起始百分比, 结束百分比)
+STAGE_PROGRESS = {
+    'fetch_history': ('获取交易数据', 0, 30),
+    'fetch_names': ('获取股票名称', 0, 5),
+    'stream': ('分段获取并匹配', 5, 95),
+    'partition_fetch': ('分批获取并溢写到磁盘', 0, 45),
+    'fetch_positions': ('获取股票名称', 30, 40),
+    'preprocess': ('预处理交易数据', 40, 45),
+    'match': ('交易匹配', 45, 95),
+    'build_frames': ('生成汇总结果', 95, 100),
+}
+
+
+class JobCancelled(Exception):
+    """分析任务在检查点被取消"""
+    pass
+
+
+class AnalysisJob:
+    """
+    分析任务，封装"获取数据 + 分析"的完整流程。
+    支持按阶段上报进度，并在检查点响应取消请求。
+    """
+
+    def __init__(self, progress_callback=None, tracer=None, cancel_event=None,
+                 matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None, cache=None,
+                 window_days=None, page_cap=DEFAULT_PAGE_CAP, spill_details=False, partitioned=False):
+        self.progress_callback = progress_callback
+        self.tracer = tracer
+        # 可选的 AnalysisCache，输入未变化时直接返回缓存结果
+        self.cache = cache
+        # 设置 window_days 时按时间窗口分批获取，边获取边匹配
+        self.window_days = window_days
+        # 服务端单次返回的记录上限，达到上限的时间窗口会被拆分，单日仍达到上限时报告为不完整
+        self.page_cap = page_cap
+        self.matching_policy = matching_policy
+        self.grid_step = grid_step
+        # 为 True 时匹配明细边匹配边写入磁盘，结果中的明细为内存映射的 DetailsStore
+        self.spill_details = spill_details
+        # 为 True 时使用低内存的分区模式 (analyze_trades_partitioned)
+        self.partitioned = partitioned
+        # 获取到的原始交易记录，供参数扫描等后续分析复用
+        self.raw_trades = None
+        # 分析结果的汇总立方体（由 build_result_frames 构建），供界面筛选和透视视图直接查询
+        self.rollup = None
+        # 可以传入 multiprocessing.Event，以便从其他进程取消
+        self._cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self._done_event = threading.Event()
+        self._last_percent = -1
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def running(self):
+        return not self._done_event.is_set()
+
+    def cancel(self):
+        """请求取消，任务会在下一个检查点停止"""
+        self._cancel_event.set()
+
+    def checkpoint(self, stage, done=None, total=None):
+        """上报进度，如果已请求取消则抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled(f"任务已在 [{stage}] 阶段取消")
+        if self.progress_callback is None or stage not in STAGE_PROGRESS:
+            return
+        label, start, end = STAGE_PROGRESS[stage]
+        if done is not None and total:
+            percent = start + (end - start) * min(done / total, 1.0)
+            label = f"{label} ({done}/{total})"
+        else:
+            percent = start
+        # 每个整数百分比最多上报一次，避免逐组回调淹没界面事件队列；
+        # 截断的时间窗口拆分后总批次数会增加，此时不回退已上报的进度
+        if int(percent) <= self._last_percent:
+            return
+        self._last_percent = int(percent)
+        self.progress_callback(label, percent)
+
+    def finish(self):
+        self._done_event.set()
+
+    def run(self, client, log_messages):
+        """
+        执行获取与分析。
+        返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map)。
+        """
+        try:
+            if self.partitioned:
+                return self.run_partitioned(client, log_messages)
+            if self.window_days:
+                return self.run_streaming(client, log_messages)
+            raw_trades = fetch_trades(client, log_messages, self, self.tracer, self.page_cap)
+            self.raw_trades = raw_trades
+            self.checkpoint('fetch_positions')
+            stock_name_map = fetch_stock_names(client, log_messages, self.tracer)
+            self.checkpoint('preprocess')
+            results = self.analyze(raw_trades, log_messages, stock_name_map)
+            self.checkpoint('build_frames', 1, 1)
+            return (*results, stock_name_map)
+        finally:
+            self.finish()
+
+
+    def run_streaming(self, client, log_messages):
+        """
+        分批获取并同步匹配。股票名称先获取，交易记录按时间窗口边到达边处理。
+        流式模式下结果在全部数据到达前就已开始计算，因此不查找分析缓存。
+        """
+        self.checkpoint('fetch_names')
+        stock_name_map = fetch_stock_names(client, log_messages, self.tracer)
+        batches = client.iter_stock_history(self.window_days, self.page_cap)
+        start_date = datetime.strptime(client.start_date, '%Y%m%d').date()
+        end_date = datetime.strptime(client.end_date, '%Y%m%d').date()
+        *frames, log_messages, raw_trades = analyze_trades_streaming(
+            batches, log_messages, start_date, end_date, stock_name_map, tracer=self.tracer, job=self,
+            matching_policy=self.matching_policy, grid_step=self.grid_step, details_writer=self.details_writer())
+        self.raw_trades = raw_trades
+        self.checkpoint('build_frames', 1, 1)
+        return (*frames, log_messages, stock_name_map)
+
+    def run_partitioned(self, client, log_messages):
+        """
+        低内存模式：按时间窗口分批获取，每批预处理后按 (账户, 股票) 溢写到磁盘，再逐个分区匹配。
+        原始交易记录不在内存中保留（参数扫描和盯盘会重新获取），结果也不写入缓存。
+        """
+        stock_name_map = fetch_stock_names(client, log_messages, self.tracer)
+        batches_meta = []
+
+        def record_batches():
+            for batch in client.iter_stock_history(self.window_days or DEFAULT_PARTITION_WINDOW_DAYS, self.page_cap):
+                batches_meta.append((batch.start_date, batch.end_date, batch.capped))
+                done = len(batches_meta)
+                self.checkpoint('partition_fetch', done, done + batch.remaining_windows)
+                yield batch.records
+
+        *frames, log_messages = analyze_trades_partitioned(
+            record_batches(), log_messages, stock_name_map, tracer=self.tracer, job=self,
+            matching_policy=self.matching_policy, grid_step=self.grid_step)
+        start_date = datetime.strptime(client.start_date, '%Y%m%d').date()
+        end_date = datetime.strptime(client.end_date, '%Y%m%d').date()
+        # 原始记录没有保留，这里只检查时间窗口的覆盖和截断
+        check_completeness(batches_meta, start_date, end_date, [], log_messages)
+        self.raw_trades = None
+        self.checkpoint('build_frames', 1, 1)
+        return (*frames, log_messages, stock_name_map)
+
+    def details_writer(self):
+        return DetailsWriter() if self.spill_details else None
+
+    def analyze(self, raw_trades, log_messages, stock_name_map):
+        """
+        分析交易数据，配置了缓存时先按输入内容查找缓存。
+        与获取数据一样，分析出错时直接抛出异常，不返回（也不缓存）不完整的结果。
+        """
+        if self.cache is None or self.spill_details:
+            # 写入磁盘的明细不放入缓存，缓存中的结果都是完整的 DataFrame
+            return analyze_trades_from_data(raw_trades, log_messages, stock_name_map, tracer=self.tracer, job=self,
+                                            matching_policy=self.matching_policy, grid_step=self.grid_step,
+                                            details_writer=self.details_writer(), raise_errors=True)
+
+        with trace_stage(self.tracer, 'cache_lookup', len(raw_trades)):
+            params = {'matching_policy': self.matching_policy, 'grid_step': self.grid_step}
+            cache_key = self.cache.make_key(raw_trades, stock_name_map, params)
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            log_messages.append("交易数据与分析参数未变化，直接使用缓存的分析结果。")
+            *frames, rollup_leaf = cached
+            self.rollup = RollupCube(rollup_leaf) if rollup_leaf is not None else None
+            return (*frames, log_messages)
+
+        # 分析出错时异常直接抛出，执行到这里的结果都是完整的，可以写入缓存
+        *frames, log_messages = analyze_trades_from_data(raw_trades, log_messages, stock_name_map, tracer=self.tracer, job=self,
+                                                         matching_policy=self.matching_policy, grid_step=self.grid_step,
+                                                         raise_errors=True)
+        try:
+            with trace_stage(self.tracer, 'cache_store'):
+                rollup_leaf = self.rollup.leaf if self.rollup is not None else None
+                self.cache.put(cache_key, (*frames, rollup_leaf))
+        except Exception as e:
+            log_messages.append(f"写入分析缓存时出错: {e}")
+        return (*frames, log_messages)
+
+
+def fetch_trades(client, log_messages, job=None, tracer=None, page_cap=None):
+    """
+    通过 API 一次获取整个区间的交易记录列表，失败时抛出异常。
+    返回数量达到 page_cap 时记录警告：结果可能被服务端截断，应改用按时间窗口分段获取。
+    """
+    if job is not None:
+        job.checkpoint('fetch_history')
+    with trace_stage(tracer, 'fetch_history'):
+        trade_response = client.get_stock_history()
+
+    if trade_response.status_code != 200:
+        raise Exception(f"交易数据API请求失败，状态码: {trade_response.status_code}")
+
+    log_messages.append("交易数据API请求成功。")
+    with trace_stage(tracer, 'json_parse') as rec:
+        raw_trades = extract_trade_list(trade_response.json())
+        if not raw_trades:
+            raise Exception("API返回交易数据中未找到交易记录列表。")
+        rec['rows'] = len(raw_trades)
+
+    log_messages.append(f"从API获取到 {len(raw_trades)} 条交易记录。")
+    if page_cap and len(raw_trades) >= page_cap:
+        log_messages.append(f"警告：返回数量达到服务端单次返回上限 ({page_cap} 条)，交易记录可能不完整，"
+                            f"请勾选\"按周分段获取\"后重新分析。")
+    return raw_trades
+
+
+def fetch_stock_names(client, log_messages, tracer=None):
+    """通过持仓接口获取 股票代码 -> 股票名称 映射，失败时只记录日志"""
+    log_messages.append("正在通过API获取股票持仓信息...")
+    with trace_stage(tracer, 'fetch_positions'):
+        position_response = client._get_stock_position()
+    stock_name_map = {}
+    if position_response.status_code == 200:
+        log_messages.append("股票持仓信息API请求成功。")
+        position_data = position_response.json()
+        if position_data.get('error_code') == '0':
+            positions = position_data.get('ex_data', {}).get('position', [])
+            for pos in positions:
+                code = pos.get('code')
+                name = pos.get('name')
+                if code and name:
+                    stock_name_map[code] = name
+            log_messages.append(f"获取到 {len(stock_name_map)} 支股票的名称。")
+        else:
+            error_msg = position_data.get('error_msg', '未知API错误')
+            log_messages.append(f"股票持仓信息API返回错误: {error_msg}")
+    else:
+        log_messages.append(f"股票持仓信息API请求失败，状态码: {position_response.status_code}")
+    return stock_name_map
@@ -0,0 +1,495 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from analysis_job import AnalysisJob, JobCancelled
+from api_client import APIClient, DEFAULT_PAGE_CAP
+from data_processor import DEFAULT_MATCHING_POLICY, MATCHING_POLICIES
+from result_cache import AnalysisCache, DEFAULT_CACHE_DIR
+from rollup_cube import RollupCube
+
+# 界面作为瘦客户端时连接的服务地址，可通过环境变量 GRID_SERVICE_URL 预设
+DEFAULT_SERVICE_URL = os.environ.get('GRID_SERVICE_URL', '')
+DEFAULT_SERVICE_PORT = 8766
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 8
+# 已完成的结果保留的秒数，期间相同的请求直接返回该结果
+DEFAULT_RESULT_TTL = 600
+
+# 参与请求合并的参数。cookie 以哈希形式计入键：服务不校验 cookie，
+# 只有凭据相同的请求才能加入进行中的任务或复用已完成的结果，其他请求必须用自己的 cookie 获取数据
+REQUIRED_FIELDS = ('user_id', 'fund_key', 'cookie', 'start_date', 'end_date')
+KEY_FIELDS = ('user_id', 'fund_key', 'start_date', 'end_date', 'matching_policy', 'grid_step', 'window_days', 'page_cap')
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+def request_key(params):
+    """同一账户、同一凭据、同一区间、同一分析参数的请求得到相同的键"""
+    key_params = {field: params.get(field) for field in KEY_FIELDS}
+    key_params['cookie_hash'] = hashlib.sha256(str(params.get('cookie')).encode('utf-8')).hexdigest()
+    return hashlib.sha256(json.dumps(key_params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def encode_frame(df, encoding):
+    """
+    把一个结果 DataFrame 编码为可放入 JSON 响应的对象。
+    'arrow' 为 base64 的 Arrow IPC 流；'json' 按列保存取值和类型，时间列保存为 int64 纳秒。
+    结果来自网络，两种编码都只包含数据，解码时不会执行任何代码。
+    """
+    if df is None:
+        return None
+    if encoding == 'arrow':
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+    data = {}
+    for col in df.columns:
+        if pd.api.types.is_datetime64_dtype(df[col]):
+            data[col] = df[col].astype('datetime64[ns]').astype('int64').tolist()
+        else:
+            data[col] = df[col].tolist()
+    return {'columns': list(df.columns), 'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()}, 'data': data}
+
+
+def decode_frame(payload, encoding):
+    if payload is None:
+        return None
+    if encoding == 'arrow':
+        return pa.ipc.open_stream(pa.py_buffer(base64.b64decode(payload))).read_all().to_pandas()
+    if encoding == 'json':
+        data = {}
+        for col in payload['columns']:
+            dtype = payload['dtypes'][col]
+            if dtype.startswith('datetime64'):
+                data[col] = pd.Series(pd.to_datetime(payload['data'][col], unit='ns'))
+            else:
+                data[col] = pd.Series(payload['data'][col], dtype=dtype)
+        return pd.DataFrame(data, columns=payload['columns'])
+    raise Exception(f"不支持的结果编码: {encoding}")
+
+
+class ServiceJob:
+    """服务中的一个分析任务，合并后的多个请求共享同一个实例"""
+
+    def __init__(self, key, params):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.status = 'queued'
+        self.label = '排队中'
+        self.percent = 0
+        self.error = None
+        self.subscribers = 1
+        self.finished_at = None
+        self.analysis = None
+        self.result = None
+        # 按编码方式缓存序列化后的结果，多个客户端取结果时只编码一次
+        self.encoded = {}
+
+    def to_dict(self):
+        return {'job_id': self.id, 'status': self.status, 'label': self.label,
+                'percent': self.percent, 'error': self.error, 'subscribers': self.subscribers}
+
+
+class AnalysisService:
+    """
+    本地多用户分析服务。把 APIClient 和 AnalysisJob 包装为 提交 / 状态 / 结果 三个接口：
+    POST /jobs 提交任务，GET /jobs/<id> 查询进度，GET /jobs/<id>/result 获取结果，
+    POST /jobs/<id>/cancel 取消。任务在有上限的线程池中执行，排队数超过 max_pending 时拒绝提交；
+    同一账户、相同凭据和参数的并发请求合并为一次计算，完成的结果在 result_ttl 秒内直接复用。
+    分析缓存 (AnalysisCache) 在所有用户之间共享，但它以获取到的交易记录为键，
+    只有用自己的 cookie 成功获取到相同交易记录的请求才会命中。
+    结果以 Arrow IPC（未安装 pyarrow 时为按列的 JSON）返回，不使用 pickle。服务默认只监听本机地址。
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_SERVICE_PORT, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, cache_dir=DEFAULT_CACHE_DIR, result_ttl=DEFAULT_RESULT_TTL,
+                 api_base_url=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.api_base_url = api_base_url
+        self.cache = AnalysisCache(cache_dir) if cache_dir else None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self.jobs = {}
+        # 进行中（排队或运行）的任务和最近完成的任务，按请求键索引
+        self.inflight = {}
+        self.completed = {}
+        self.stats = {'submitted': 0, 'coalesced': 0, 'reused': 0, 'rejected': 0, 'computed': 0}
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for job in list(self.inflight.values()):
+            if job.analysis is not None:
+                job.analysis.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _purge(self):
+        """丢弃超过保留时间的已完成任务（调用方持有锁）"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl:
+                del self.jobs[job_id]
+                if self.completed.get(job.key) is job:
+                    del self.completed[job.key]
+
+    def submit(self, params):
+        """返回 (状态码, 响应对象)"""
+        missing = [field for field in REQUIRED_FIELDS if not params.get(field)]
+        if missing:
+            return 400, {'error': f"缺少参数: {', '.join(missing)}"}
+        if params.get('matching_policy', DEFAULT_MATCHING_POLICY) not in MATCHING_POLICIES:
+            return 400, {'error': f"未知的匹配策略: {params.get('matching_policy')}"}
+
+        key = request_key(params)
+        with self._lock:
+            self._purge()
+            self.stats['submitted'] += 1
+            job = self.inflight.get(key)
+            if job is not None:
+                job.subscribers += 1
+                self.stats['coalesced'] += 1
+                return 202, {**job.to_dict(), 'coalesced': True}
+            job = self.completed.get(key)
+            if job is not None:
+                self.stats['reused'] += 1
+                return 200, {**job.to_dict(), 'coalesced': True}
+            if len(self.inflight) >= self.workers + self.max_pending:
+                self.stats['rejected'] += 1
+                return 503, {'error': "分析服务繁忙，请稍后再试。"}
+
+            job = ServiceJob(key, params)
+            self.jobs[job.id] = job
+            self.inflight[key] = job
+        self.executor.submit(self._run, job)
+        return 202, {**job.to_dict(), 'coalesced': False}
+
+    def _progress(self, job, label, percent):
+        job.label = label
+        job.percent = percent
+
+    def _run(self, job):
+        try:
+            if job.status == 'cancelled':
+                return
+            params = job.params
+            job.analysis = AnalysisJob(
+                progress_callback=lambda label, percent: self._progress(job, label, percent),
+                matching_policy=params.get('matching_policy', DEFAULT_MATCHING_POLICY),
+                grid_step=params.get('grid_step'),
+                cache=self.cache,
+                window_days=params.get('window_days'),
+                page_cap=params.get('page_cap', DEFAULT_PAGE_CAP)
+            )
+            # 取消请求可能在任务创建前到达
+            if job.status == 'cancelled':
+                job.analysis.cancel()
+            job.status = 'running'
+            client = APIClient(params['user_id'], params['fund_key'], params['cookie'],
+                               params['start_date'], params['end_date'], base_url=self.api_base_url)
+            log_messages = ["正在通过API获取交易数据(分析服务)..."]
+            *frames, log_messages, stock_name_map = job.analysis.run(client, log_messages)
+            # 汇总立方体的底层汇总表（包含收益为0的分组）随结果返回，客户端据此重建立方体
+            rollup = job.analysis.rollup
+            job.result = (frames, rollup.leaf if rollup is not None else None, log_messages, stock_name_map)
+            job.label = '完成'
+            job.percent = 100
+            job.status = 'done'
+            with self._lock:
+                self.stats['computed'] += 1
+                self.completed[job.key] = job
+        except JobCancelled as e:
+            job.status = 'cancelled'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            # 原始交易记录只在计算期间需要
+            if job.analysis is not None:
+                job.analysis.raw_trades = None
+            with self._lock:
+                job.finished_at = time.time()
+                if self.inflight.get(job.key) is job:
+                    del self.inflight[job.key]
+
+    def status(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return 404, {'error': f"未知任务: {job_id}"}
+        return 200, job.to_dict()
+
+    def result(self, job_id, encoding):
+        """返回 (状态码, 响应对象)，结果帧按 encoding 编码"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return 404, {'error': f"未知任务: {job_id}"}
+        if job.status != 'done':
+            return 409, {**job.to_dict(), 'error': job.error or "任务尚未完成。"}
+        if encoding != 'arrow' or not PYARROW_AVAILABLE:
+            encoding = 'json'
+        with self._lock:
+            if encoding not in job.encoded:
+                frames, rollup_leaf, log_messages, stock_name_map = job.result
+                job.encoded[encoding] = {
+                    'job_id': job.id,
+                    'encoding': encoding,
+                    'frames': [encode_frame(df, encoding) for df in frames],
+                    'rollup': encode_frame(rollup_leaf, encoding),
+                    'log_messages': log_messages,
+                    'stock_name_map': stock_name_map,
+                }
+        return 200, job.encoded[encoding]
+
+    def cancel(self, job_id):
+        """一个请求方退出；所有合并的请求方都取消后才真正停止计算"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return 404, {'error': f"未知任务: {job_id}"}
+            if job.status in FINISHED_STATES:
+                return 200, job.to_dict()
+            job.subscribers = max(job.subscribers - 1, 0)
+            if job.subscribers == 0:
+                # 计算要到下一个检查点才会停止；先移出进行中的任务，之后相同的请求开始新的计算，
+                # 而不是合并到这个即将被取消的任务上
+                if self.inflight.get(job.key) is job:
+                    del self.inflight[job.key]
+                if job.analysis is not None:
+                    job.analysis.cancel()
+                else:
+                    job.status = 'cancelled'
+                    job.error = "任务在排队中被取消"
+        return 200, job.to_dict()
+
+    def service_stats(self):
+        with self._lock:
+            return {**self.stats, 'inflight': len(self.inflight), 'jobs': len(self.jobs)}
+
+
+def _make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            content = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            if status == 503:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _route(self):
+            path, _, query = self.path.partition('?')
+            parts = [part for part in path.split('/') if part]
+            options = dict(item.split('=', 1) for item in query.split('&') if '=' in item)
+            return parts, options
+
+        def do_POST(self):
+            parts, _ = self._route()
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+            except ValueError:
+                self._send(400, {'error': "请求体不是有效的 JSON"})
+                return
+            if parts == ['jobs']:
+                self._send(*service.submit(body))
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+                self._send(*service.cancel(parts[1]))
+            else:
+                self._send(404, {'error': f"未知接口: {self.path}"})
+
+        def do_GET(self):
+            parts, options = self._route()
+            if parts == ['health']:
+                self._send(200, service.service_stats())
+            elif len(parts) == 2 and parts[0] == 'jobs':
+                self._send(*service.status(parts[1]))
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+                self._send(*service.result(parts[1], options.get('encoding', 'arrow')))
+            else:
+                self._send(404, {'error': f"未知接口: {self.path}"})
+
+        def log_message(self, format, *args):
+            # 客户端轮询频繁，不输出访问日志
+            pass
+
+    return Handler
+
+
+class ServiceClient:
+    """分析服务的 HTTP 客户端"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"连接分析服务失败: {e}")
+        try:
+            payload = response.json()
+        except ValueError:
+            raise Exception(f"分析服务返回了无法解析的响应，状态码: {response.status_code}")
+        return response.status_code, payload
+
+    def submit(self, params):
+        status, payload = self._request('POST', '/jobs', json=params)
+        if status not in (200, 202):
+            raise Exception(f"提交分析任务失败: {payload.get('error', status)}")
+        return payload
+
+    def status(self, job_id):
+        status, payload = self._request('GET', f'/jobs/{job_id}')
+        if status != 200:
+            raise Exception(f"查询分析任务失败: {payload.get('error', status)}")
+        return payload
+
+    def result(self, job_id):
+        """
+        返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map, rollup)，
+        rollup 为由服务端返回的底层汇总表重建的 RollupCube，没有结果时为 None。
+        """
+        encoding = 'arrow' if PYARROW_AVAILABLE else 'json'
+        status, payload = self._request('GET', f'/jobs/{job_id}/result', params={'encoding': encoding})
+        if status != 200:
+            raise Exception(f"获取分析结果失败: {payload.get('error', status)}")
+        frames = [decode_frame(text, payload['encoding']) for text in payload['frames']]
+        rollup_leaf = decode_frame(payload.get('rollup'), payload['encoding'])
+        rollup = RollupCube(rollup_leaf) if rollup_leaf is not None else None
+        return (*frames, payload['log_messages'], payload['stock_name_map'], rollup)
+
+    def cancel(self, job_id):
+        return self._request('POST', f'/jobs/{job_id}/cancel')[1]
+
+
+class RemoteAnalysisRunner:
+    """
+    界面作为瘦客户端时使用：把任务提交给分析服务并轮询进度。
+    接口与 ProcessAnalysisRunner 一致 (cancel / running / run)，界面可以同样对待。
+    """
+
+    def __init__(self, base_url, params, progress_callback=None, poll_interval=0.5):
+        self.client = ServiceClient(base_url)
+        self.params = params
+        self.progress_callback = progress_callback
+        self.poll_interval = poll_interval
+        self._cancel_event = threading.Event()
+        self._running = True
+        # 分析结果的汇总立方体，run 返回后可用（接口与 AnalysisJob.rollup 一致）
+        self.rollup = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def running(self):
+        return self._running
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        """
+        提交任务并阻塞等待结果（应在后台线程中调用）。
+        返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map, tracer)，
+        计算在服务端完成，tracer 为 None。
+        """
+        try:
+            job = self.client.submit(self.params)
+            job_id = job['job_id']
+            last_progress = None
+            while job['status'] not in FINISHED_STATES:
+                if self._cancel_event.wait(self.poll_interval):
+                    self.client.cancel(job_id)
+                    raise JobCancelled("已取消分析服务中的任务")
+                job = self.client.status(job_id)
+                progress = (job['label'], job['percent'])
+                if self.progress_callback is not None and progress != last_progress:
+                    self.progress_callback(*progress)
+                    last_progress = progress
+
+            if job['status'] == 'cancelled':
+                raise JobCancelled(job.get('error') or "分析服务中的任务已取消")
+            if job['status'] == 'failed':
+                raise Exception(job.get('error') or "分析服务中的任务失败")
+            *results, self.rollup = self.client.result(job_id)
+            return (*results, None)
+        finally:
+            self._running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网格交易本地分析服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同时运行的分析任务数")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING, help="最多排队的任务数")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="共享的分析缓存目录，为空时不使用缓存")
+    parser.add_argument('--result-ttl', type=int, default=DEFAULT_RESULT_TTL, help="完成的结果保留秒数")
+    parser.add_argument('--api-base-url', help="交易接口地址，默认使用 GRID_API_BASE_URL 或真实接口")
+    args = parser.parse_args()
+
+    service = AnalysisService(args.host, args.port, args.workers, args.max_pending,
+                              args.cache_dir or None, args.result_ttl, args.api_base_url)
+    print(f"分析服务已启动: {service.base_url}  (工作线程 {args.workers}，排队上限 {args.max_pending})")
+    try:
+        service.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.httpd.server_close()
+        service.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,26 @@
 import requests
 import json
+import os
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+# 一批交易记录：窗口起止日期、记录列表、是否达到服务端返回上限、剩余待获取窗口数
+HistoryBatch = namedtuple('HistoryBatch', ['start_date', 'end_date', 'records', 'capped', 'remaining_windows'])
+
+# 接口地址。设置环境变量 GRID_API_BASE_URL 可以把所有请求指向本地的替身服务器 (mock_api_server.py)
+DEFAULT_BASE_URL = os.environ.get('GRID_API_BASE_URL', 'https://tzzb.10jqka.com.cn')
+STOCK_HISTORY_PATH = "/caishen_httpserver/tzzb/caishen_fund/stock_position/v1/stock_history_query"
+STOCK_POSITION_PATH = "/caishen_httpserver/tzzb/caishen_fund/pc/asset/v1/stock_position"
+# 交易历史接口单次返回的记录上限。返回数量达到该值的时间窗口视为可能被截断，拆成两半重新获取；
+# 服务端的实际上限不同时可通过环境变量 GRID_API_PAGE_CAP 调整
+DEFAULT_PAGE_CAP = int(os.environ.get('GRID_API_PAGE_CAP', 500))
+# 限流 (429) 和服务端错误 (5xx) 时的重试次数与退避：第 n 次重试前等待 RETRY_BACKOFF * 2^n 秒，
+# 响应带 Retry-After 时按其等待，单次等待不超过 RETRY_MAX_DELAY 秒
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_MAX_DELAY = 10
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 def parse_cookies(cookie_string):
     """安全地解析 cookie 字符串"""
@@ -17,8 +38,34 @@ def parse_cookies(cookie_string):
             print(f"警告：解析 Cookie 时出错: {e}")
     return cookies
 
+def split_date_range(start_date, end_date, window_days):
+    """把 YYYYMMDD 格式的日期区间切分为若干个不超过 window_days 天的 (开始, 结束) date 窗口"""
+    start = datetime.strptime(start_date, '%Y%m%d').date()
+    end = datetime.strptime(end_date, '%Y%m%d').date()
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=window_days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+def extract_trade_list(trade_data):
+    """
+    从交易历史接口的 JSON 中取出交易记录列表。
+    接口返回错误时抛出异常，找不到列表字段时返回 None。
+    """
+    if trade_data.get('error_code') != '0':
+        error_msg = trade_data.get('error_msg', '未知API错误')
+        raise Exception(f"交易数据API返回错误: {error_msg}")
+    if 'ex_data' in trade_data and 'list' in trade_data['ex_data']:
+        return trade_data['ex_data']['list']
+    if 'data' in trade_data and 'list' in trade_data['data']:
+        return trade_data['data']['list']
+    return None
+
 class APIClient:
-    def __init__(self, user_id, fund_key, cookie, start_date, end_date, headers=None):
+    def __init__(self, user_id, fund_key, cookie, start_date, end_date, headers=None, tracer=None, base_url=None,
+                 max_retries=DEFAULT_MAX_RETRIES):
         self.user_id = user_id
         self.fund_key = fund_key
         self.cookie = cookie
@@ -29,6 +76,11 @@ class APIClient:
             'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
             # 可以根据需要添加更多默认头
         }
+        # 可选的 PerfTracer，用于记录每次请求的延迟和响应大小
+        self.tracer = tracer
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        # 限流、服务端错误和连接失败时的最多重试次数，0 表示不重试
+        self.max_retries = max_retries
 
     def _get_session(self):
         cookies = parse_cookies(self.cookie)
@@ -36,34 +88,89 @@ class APIClient:
         session.cookies.update(cookies)
         return session
 
+    def _retry_delay(self, attempt, response=None):
+        """第 attempt 次重试前的等待秒数，优先使用响应的 Retry-After"""
+        delay = RETRY_BACKOFF * 2 ** attempt
+        if response is not None:
+            try:
+                delay = float(response.headers.get('Retry-After', delay))
+            except ValueError:
+                pass
+        return min(delay, RETRY_MAX_DELAY)
+
     def _send_request(self, url, data):
+        """
+        发送请求。返回 429 或 5xx、或连接失败时按退避重试，最多 max_retries 次；
+        重试用尽或其他错误时抛出异常。每次尝试都记录到 tracer。
+        """
         session = self._get_session()
-        try:
-            response = session.post(url=url, data=data, headers=self.headers, timeout=30)
-            response.raise_for_status() # 如果状态码不是 200，会抛出异常
-            return response
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"网络请求失败: {e}")
+        endpoint = url.rsplit('/', 1)[-1]
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = session.post(url=url, data=data, headers=self.headers, timeout=30)
+                if self.tracer is not None:
+                    self.tracer.record_request(endpoint, (time.perf_counter() - start) * 1000,
+                                               len(response.content), response.status_code)
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    time.sleep(self._retry_delay(attempt, response))
+                    attempt += 1
+                    continue
+                response.raise_for_status() # 如果状态码不是 200，会抛出异常
+                return response
+            except requests.exceptions.ConnectionError as e:
+                if attempt >= self.max_retries:
+                    raise Exception(f"网络请求失败: {e}")
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"网络请求失败: {e}")
 
-    def get_stock_history(self):
-        url = "https://tzzb.10jqka.com.cn/caishen_httpserver/tzzb/caishen_fund/stock_position/v1/stock_history_query"
+    def get_stock_history(self, start_date=None, end_date=None):
+        """获取交易历史，默认使用客户端的日期区间"""
+        url = self.base_url + STOCK_HISTORY_PATH
         data = {
             "userid": self.user_id,
             "fundkey": self.fund_key,
             "stock_code": "",
             "stock_account": "",
-            "start_date": self.start_date,
-            "end_date": self.end_date,
+            "start_date": start_date or self.start_date,
+            "end_date": end_date or self.end_date,
             "from_pc": "1"
         }
         response = self._send_request(url, data)
         return response
 
+    def iter_stock_history(self, window_days=7, page_cap=DEFAULT_PAGE_CAP):
+        """
+        按时间窗口分批获取交易历史，逐批产出 HistoryBatch。
+        page_cap 为服务端单次返回的记录上限：窗口返回数量达到上限时拆成两半重新获取，
+        单日窗口仍达到上限时 capped 为 True，表示该窗口数据可能不完整。page_cap 为 None 时不检查上限。
+        """
+        windows = deque(split_date_range(self.start_date, self.end_date, window_days))
+        while windows:
+            start, end = windows.popleft()
+            response = self.get_stock_history(start.strftime('%Y%m%d'), end.strftime('%Y%m%d'))
+            if response.status_code != 200:
+                raise Exception(f"交易数据API请求失败，状态码: {response.status_code}")
+            records = extract_trade_list(response.json())
+            if records is None:
+                raise Exception("API返回交易数据中未找到交易记录列表。")
+
+            capped = bool(page_cap) and len(records) >= page_cap
+            if capped and start < end:
+                middle = start + (end - start) // 2
+                windows.appendleft((middle + timedelta(days=1), end))
+                windows.appendleft((start, middle))
+                continue
+            yield HistoryBatch(start, end, records, capped, len(windows))
+
     def _get_stock_position(self):
         """
         获取股票持仓信息，用于获取股票名称。
         """
-        url = "https://tzzb.10jqka.com.cn/caishen_httpserver/tzzb/caishen_fund/pc/asset/v1/stock_position"
+        url = self.base_url + STOCK_POSITION_PATH
         # 注意：请求体中同时包含了 userid 和 user_id，根据示例数据推测可能都需要。
         data = {
             "userid": self.user_id,
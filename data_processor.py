@@ -1,12 +1,23 @@
 import pandas as pd
+import numpy as np
 import json
+from abc import ABC, abstractmethod
+from collections import deque
 from datetime import datetime
 import calendar
 
+from sortedcontainers import SortedList
+
+from perf_trace import trace_stage
+from details_store import DetailsWriter
+from rollup_cube import RollupCube
+from result_schema import month_labels, attach_stock_names, DATETIME_COLUMNS, DATETIME_DTYPE
+
 # --- 列名映射 ---
 COLUMN_NAME_MAP = {
     'account_name': '账户名称',
     'month': '月份',
+    'year': '年份',
     'stock_code': '股票代码',
     'stock_name': '股票名称',
     'total_profit': '总收益',
@@ -18,7 +29,12 @@ COLUMN_NAME_MAP = {
     'matched_quantity': '匹配数量',
     'buy_moneychg': '买入金额变化',
     'sell_moneychg': '卖出金额变化',
-    'profit': '收益'
+    'profit': '收益',
+    'matching_policy': '匹配策略',
+    'bucket': '分组周期',
+    'accounts': '账户范围',
+    'stocks': '股票范围',
+    'group_count': '分组数'
 }
 
 def get_current_month_range():
@@ -103,96 +119,353 @@ def preprocess_trades(trades):
     
     return df, None
 
-def calculate_grid_profit_for_group(group_df):
+class _Lot:
+    """一笔未完全匹配的买入记录，index 为其在按时间排序的交易序列中的位置"""
+    __slots__ = ('index', 'price', 'moneychg', 'quantity', 'remaining')
+
+    def __init__(self, index, price, moneychg, quantity):
+        self.index = index
+        self.price = price
+        self.moneychg = moneychg
+        self.quantity = quantity
+        self.remaining = quantity
+
+
+class MatchingPolicy(ABC):
     """
-    为一个特定的 (账户, 股票, 月份) 组计算网格收益。
-    匹配规则：为每个卖出记录找到时间在其之前且最近的买入记录。
-    收益 = 卖出记录的 moneychg + 买入记录的 moneychg
+    匹配策略基类。维护未平仓的买入批次，并为每个卖出记录挑选下一笔要匹配的买入批次。
+    子类实现 add / peek / pop / __len__，每个操作不超过 O(log n)。
     """
-    # 分离买入和卖出记录
-    buys = group_df[group_df['trade_type'] == '买入'].copy()
-    sells = group_df[group_df['trade_type'] == '卖出'].copy()
-    
-    # 按时间排序
-    buys = buys.sort_values('trans_datetime').reset_index(drop=True)
-    sells = sells.sort_values('trans_datetime').reset_index(drop=True)
-    
-    # 为买入记录创建一个副本用于跟踪剩余可匹配数量
-    buy_inventory = buys.copy()
-    buy_inventory['remaining_quantity'] = buy_inventory['quantity']
-    
-    matched_trades = []
-    total_profit = 0.0
-    
-    # 遍历每一个卖出记录
-    for _, sell_record in sells.iterrows():
-        sell_quantity = sell_record['quantity']
-        sell_moneychg = sell_record['moneychg'] # 正数 (资金流入)
-        sell_time = sell_record['trans_datetime']
-        
-        # 为当前卖出记录找到匹配的买入记录
-        # 条件：买入时间 < 卖出时间，买入数量 > 0
-        potential_buys = buy_inventory[
-            (buy_inventory['trans_datetime'] < sell_time) & 
-            (buy_inventory['remaining_quantity'] > 0)
-        ].copy()
-        
-        # 按时间倒序排序，最近的在前面
-        potential_buys = potential_buys.sort_values('trans_datetime', ascending=False)
-        
-        # 只要还有未匹配的卖出数量，并且还有潜在的买入记录可供匹配
-        while sell_quantity > 0 and not potential_buys.empty:
-            # 取出最近的买入记录
-            buy_record = potential_buys.iloc[0]
-            buy_index_in_inventory = buy_record.name # 这是 buy_inventory 的索引
-            buy_quantity_available = buy_record['remaining_quantity']
-            
+    name = None
+    label = None
+
+    def __init__(self, grid_step=None):
+        self.grid_step = grid_step
+
+    @abstractmethod
+    def add(self, lot):
+        """加入一个未平仓的买入批次"""
+
+    @abstractmethod
+    def peek(self, sell_price):
+        """返回当前卖出应匹配的买入批次（不移除）"""
+
+    @abstractmethod
+    def pop(self, lot):
+        """移除已完全匹配的买入批次（lot 为最近一次 peek 的返回值）"""
+
+    @abstractmethod
+    def __len__(self):
+        """未平仓批次的数量"""
+
+
+class LifoPolicy(MatchingPolicy):
+    """后进先出：卖出优先匹配时间在其之前且最近的买入（原有匹配规则）"""
+    name = 'lifo'
+    label = '最近买入(LIFO)'
+
+    def __init__(self, grid_step=None):
+        super().__init__(grid_step)
+        self._stack = []
+
+    def add(self, lot):
+        self._stack.append(lot)
+
+    def peek(self, sell_price):
+        return self._stack[-1]
+
+    def pop(self, lot):
+        self._stack.pop()
+
+    def __len__(self):
+        return len(self._stack)
+
+
+class FifoPolicy(MatchingPolicy):
+    """先进先出：卖出优先匹配最早的未平仓买入"""
+    name = 'fifo'
+    label = '先进先出(FIFO)'
+
+    def __init__(self, grid_step=None):
+        super().__init__(grid_step)
+        self._queue = deque()
+
+    def add(self, lot):
+        self._queue.append(lot)
+
+    def peek(self, sell_price):
+        return self._queue[0]
+
+    def pop(self, lot):
+        self._queue.popleft()
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class GridLevelPolicy(MatchingPolicy):
+    """
+    网格价位匹配：卖出匹配买入价格最接近"卖出价下方一个网格步长"的未平仓买入。
+    grid_step 为网格步长百分比，例如 3 表示 3%。
+    """
+    name = 'grid'
+    label = '网格价位'
+    DEFAULT_GRID_STEP = 3.0
+
+    def __init__(self, grid_step=None):
+        super().__init__(grid_step if grid_step else self.DEFAULT_GRID_STEP)
+        # 按 (价格, 交易序号) 排序，序号保证键唯一；SortedList 的插入、删除和查找都是 O(log n)
+        self._sorted = SortedList()
+        self._lots = {}
+
+    def add(self, lot):
+        self._sorted.add((lot.price, lot.index))
+        self._lots[lot.index] = lot
+
+    def peek(self, sell_price):
+        target = sell_price * (1 - self.grid_step / 100)
+        position = self._sorted.bisect_left((target, -1))
+        best = None
+        for candidate in (position - 1, position):
+            if 0 <= candidate < len(self._sorted):
+                price, lot_index = self._sorted[candidate]
+                if best is None or abs(price - target) < abs(best[0] - target):
+                    best = (price, lot_index)
+        return self._lots[best[1]]
+
+    def pop(self, lot):
+        self._sorted.remove((lot.price, lot.index))
+        del self._lots[lot.index]
+
+    def __len__(self):
+        return len(self._lots)
+
+
+MATCHING_POLICIES = {policy.name: policy for policy in (LifoPolicy, FifoPolicy, GridLevelPolicy)}
+DEFAULT_MATCHING_POLICY = LifoPolicy.name
+
+def create_matching_policy(policy=DEFAULT_MATCHING_POLICY, grid_step=None):
+    """根据策略名称创建匹配策略实例"""
+    if isinstance(policy, MatchingPolicy):
+        return policy
+    if policy not in MATCHING_POLICIES:
+        raise ValueError(f"未知的匹配策略: {policy}")
+    return MATCHING_POLICIES[policy](grid_step)
+
+def match_sorted_trades(is_buy, moneychgs, quantities, lots, start=0):
+    """
+    在已按时间排序（同一时间卖出在前）的交易数组上执行匹配。
+    lots 为 MatchingPolicy 实例，调用结束后其中保留未平仓的买入批次。
+    start 之前的交易视为已处理（其未平仓批次已在 lots 中），用于在追加新交易后继续匹配。
+    逐个产出 (买入下标, 卖出下标, 匹配数量, 买入金额变化, 卖出金额变化, 收益)。
+    """
+    for i in range(start, len(is_buy)):
+        quantity = quantities[i]
+        if is_buy[i]:
+            # 数量为 0 的买入无法参与匹配
+            if quantity > 0:
+                lots.add(_Lot(i, abs(moneychgs[i]) / quantity, moneychgs[i], quantity))
+            continue
+
+        # 卖出记录
+        sell_quantity = quantity
+        sell_moneychg = moneychgs[i] # 正数 (资金流入)
+        sell_price = abs(sell_moneychg) / quantity if quantity else 0.0
+
+        # 只要还有未匹配的卖出数量，并且还有未平仓的买入批次可供匹配
+        while sell_quantity > 0 and len(lots):
+            buy_lot = lots.peek(sell_price)
+
             # 确定本次交易匹配的数量
-            matched_quantity = min(sell_quantity, buy_quantity_available)
-            
+            matched_quantity = min(sell_quantity, buy_lot.remaining)
+
             # 计算匹配部分的买入金额变化
-            matched_buy_moneychg = (buy_record['moneychg'] / buy_record['quantity']) * matched_quantity
-            
+            matched_buy_moneychg = (buy_lot.moneychg / buy_lot.quantity) * matched_quantity
+
             # 计算匹配部分的卖出金额变化
-            matched_sell_moneychg = (sell_moneychg / sell_record['quantity']) * matched_quantity
-            
+            matched_sell_moneychg = (sell_moneychg / quantity) * matched_quantity
+
             # 计算此匹配对的收益
             profit = matched_sell_moneychg + matched_buy_moneychg # moneychg对于买入是负数
-            
-            # 注意：为了与显示逻辑一致，这里交换了 buy_datetime 和 sell_datetime 的含义
-            matched_trades.append({
-                'sell_datetime': buy_record['trans_datetime'], # 买入时间
-                'buy_datetime': sell_record['trans_datetime'], # 卖出时间
-                'stock_code': sell_record['stock_code'],
-                'matched_quantity': matched_quantity,
-                'buy_moneychg': matched_buy_moneychg, # 负数
-                'sell_moneychg': matched_sell_moneychg, # 正数
-                'profit': profit
-            })
-            
-            total_profit += profit
-            
-            # 更新买入记录的剩余数量
-            new_buy_quantity = buy_quantity_available - matched_quantity
-            buy_inventory.at[buy_index_in_inventory, 'remaining_quantity'] = new_buy_quantity
-            
-            # 更新待匹配的卖出数量
+
+            yield buy_lot.index, i, matched_quantity, matched_buy_moneychg, matched_sell_moneychg, profit
+
+            # 更新买入批次的剩余数量和待匹配的卖出数量
+            buy_lot.remaining -= matched_quantity
             sell_quantity -= matched_quantity
-            
-            # 更新潜在买入列表（移除已完全匹配的记录）
-            if new_buy_quantity <= 0:
-                potential_buys = potential_buys.iloc[1:] # 移除第一个（已完全匹配的）
-            else:
-                # 更新第一个记录的剩余数量
-                potential_buys.iloc[0, potential_buys.columns.get_loc('remaining_quantity')] = new_buy_quantity
-                
+
+            # 移除已完全匹配的买入批次
+            if buy_lot.remaining <= 0:
+                lots.pop(buy_lot)
+
+def calculate_grid_profit_for_group(group_df, policy=DEFAULT_MATCHING_POLICY, grid_step=None):
+    """
+    为一个特定的 (账户, 股票, 月份) 组计算网格收益。
+    按时间顺序扫描交易：买入加入匹配策略维护的未平仓批次，卖出按策略挑选买入批次匹配。
+    同一时间的卖出先于买入处理，保证只匹配时间在卖出之前的买入。
+    默认 LIFO 策略即原有规则：为每个卖出记录找到时间在其之前且最近的买入记录。
+    收益 = 卖出记录的 moneychg + 买入记录的 moneychg
+    """
+    lots = create_matching_policy(policy, grid_step)
+
+    # 按时间排序，同一时间卖出在前
+    is_buy = (group_df['trade_type'] == '买入').to_numpy()
+    times = group_df['trans_datetime'].to_numpy()
+    order = np.lexsort((is_buy, times))
+    is_buy = is_buy[order]
+    times = times[order]
+    moneychgs = group_df['moneychg'].to_numpy()[order]
+    quantities = group_df['quantity'].to_numpy()[order]
+    stock_codes = group_df['stock_code'].to_numpy()[order]
+
+    matched_trades = []
+    total_profit = 0.0
+
+    for buy_index, sell_index, matched_quantity, buy_moneychg, sell_moneychg, profit in match_sorted_trades(is_buy, moneychgs, quantities, lots):
+        # 注意：为了与显示逻辑一致，这里交换了 buy_datetime 和 sell_datetime 的含义
+        matched_trades.append({
+            'sell_datetime': times[buy_index], # 买入时间
+            'buy_datetime': times[sell_index], # 卖出时间
+            'stock_code': stock_codes[sell_index],
+            'matched_quantity': matched_quantity,
+            'buy_moneychg': buy_moneychg, # 负数
+            'sell_moneychg': sell_moneychg, # 正数
+            'profit': profit
+        })
+        total_profit += profit
+
     return total_profit, matched_trades
 
-def analyze_trades_from_data(trades_data, log_messages, stock_name_map=None):
-    """从已解析的交易数据列表进行分析。"""
+def match_group(name, group, matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None):
+    """
+    为一个 (账户, 股票, 月份) 组计算收益，返回该组的汇总信息和带账户、股票信息的匹配明细。
+    """
+    account_name, stock_code, month = name
+    # 调用收益计算函数
+    total_profit, matched_trades = calculate_grid_profit_for_group(group, matching_policy, grid_step)
+
+    # 收集汇总信息
+    summary_row = {
+        'account_name': account_name,
+        'stock_code': stock_code,
+        'month': month,
+        'total_profit': total_profit,
+        'trade_pair_count': len(matched_trades)
+    }
+
+    # 为每个明细记录添加账户和股票信息
+    for detail in matched_trades:
+        detail['account_name'] = account_name
+        detail['stock_code'] = stock_code
+        # profit 已在 calculate_grid_profit_for_group 中计算
+    return summary_row, matched_trades
+
+def _match_groups(df, all_matched_details, job=None, matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None):
+    """
+    按 (账户, 股票, 月份) 分组并按 matching_policy 逐组匹配。
+    匹配明细追加到 all_matched_details，返回每组的汇总信息列表。
+    传入 job (AnalysisJob) 时每组作为一个检查点上报进度并响应取消。
+    """
+    # 1. 按 account_name, stock_code, month 分组
+    grouped = df.groupby(['account_name', 'stock_code', 'month'], group_keys=False)
+    group_count = grouped.ngroups
+
+    summary_data = []
+    # 2. 对每个组调用 match_group，收集汇总信息和所有匹配的明细
+    for group_index, (name, group) in enumerate(grouped):
+        if job is not None:
+            job.checkpoint('match', group_index, group_count)
+        summary_row, matched_trades = match_group(name, group, matching_policy, grid_step)
+        summary_data.append(summary_row)
+        all_matched_details.extend(matched_trades)
+    return summary_data
+
+def finalize_result_frames(summary_data, all_matched_details, stock_name_map=None):
+    """
+    结果定稿：由逐组匹配的汇总信息和匹配明细生成 summary_df 和 details_df，并一次确定所有输出共用的列类型
+    （月份为 'YYYY-MM' 字符串，时间为 datetime64[ns]，见 result_schema）。
+    股票名称按代码编码只连接一次，之后由 summary_df 派生的各汇总表直接继承，不再逐表逐行查找。
+    all_matched_details 为 DetailsWriter 时明细已写入磁盘，名称和月份在读取时按同样的规则派生。
+    """
+    summary_df = pd.DataFrame(summary_data)
+    if not summary_df.empty:
+        summary_df['month'] = month_labels(summary_df['month'])
+        summary_df['total_profit'] = summary_df['total_profit'].round(2)
+        if stock_name_map:
+            attach_stock_names(summary_df, stock_name_map)
+
+    if isinstance(all_matched_details, DetailsWriter):
+        return summary_df, all_matched_details.close(stock_name_map)
+
+    details_df = pd.DataFrame(all_matched_details)
+    if not details_df.empty:
+        for col in DATETIME_COLUMNS:
+            details_df[col] = details_df[col].astype(DATETIME_DTYPE)
+        details_df['profit'] = details_df['profit'].round(2)
+        if stock_name_map:
+            attach_stock_names(details_df, stock_name_map)
+        details_df['month'] = month_labels(details_df['sell_datetime'])
+    return summary_df, details_df
+
+def build_result_frames(summary_data, all_matched_details, log_messages, stock_name_map=None, tracer=None):
+    """
+    由逐组匹配得到的汇总信息和匹配明细生成四个结果 DataFrame：
+    账户月度汇总、股票汇总、股票明细和交易匹配明细，以及汇总立方体 (RollupCube)。
+    立方体由全部分组（包括总收益为0的分组）构建，账户月度汇总直接取自立方体，
+    交易对数的合计因此不会漏掉收益为0的分组；股票汇总和股票明细仍过滤掉收益为0的分组。
+    all_matched_details 为 DetailsWriter 时，交易匹配明细以 DetailsStore 返回。
+    返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, rollup)，没有结果时 rollup 为 None。
+    """
+    account_month_summary = pd.DataFrame()
+    stock_summary = pd.DataFrame()
+    stock_detail_summary = pd.DataFrame()
+    rollup = None
+    log_messages.append("交易匹配和收益计算完成。")
+
+    with trace_stage(tracer, 'finalize', len(summary_data)) as rec:
+        if stock_name_map:
+            log_messages.append("正在添加股票名称...")
+        summary_df, details_df = finalize_result_frames(summary_data, all_matched_details, stock_name_map)
+        if stock_name_map:
+            log_messages.append("股票名称添加完成。")
+        rec['rows'] = len(details_df)
+
+    if not summary_df.empty:
+        with trace_stage(tracer, 'rollup', len(summary_df)):
+            rollup = RollupCube(summary_df)
+
+    with trace_stage(tracer, 'build_frames', len(summary_df)):
+        if not summary_df.empty:
+            # 1. 账户月度汇总，取自汇总立方体的 账户 × 月份 层级
+            account_month_summary = rollup.frame(('account_name', 'month'))[['account_name', 'month', 'total_profit']]
+            account_month_summary = account_month_summary.rename(columns={'total_profit': 'monthly_total_profit'})
+
+            # 2. 股票汇总 (按账户、月份、股票)，过滤掉总收益为0的股票
+            columns_to_include = ['account_name', 'month', 'stock_code', 'total_profit']
+            if 'stock_name' in summary_df.columns:
+                columns_to_include.insert(3, 'stock_name')
+            nonzero = summary_df['total_profit'] != 0
+            stock_summary = summary_df.loc[nonzero, columns_to_include].rename(columns={'total_profit': 'stock_total_profit'})
+
+            # 3. 股票明细 (包含交易对数)，过滤掉总收益为0的股票
+            stock_detail_summary = summary_df[nonzero]
+
+    return account_month_summary, stock_summary, stock_detail_summary, details_df, rollup
+
+def analyze_trades_from_data(trades_data, log_messages, stock_name_map=None, tracer=None, job=None,
+                             matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None, details_writer=None,
+                             raise_errors=False):
+    """
+    从已解析的交易数据列表进行分析。
+    matching_policy 为匹配策略名称 ('lifo' / 'fifo' / 'grid')，grid_step 为网格价位匹配的步长百分比。
+    传入 tracer (PerfTracer) 时记录预处理、匹配、汇总和名称标注各阶段的性能数据。
+    传入 job (AnalysisJob) 时上报匹配进度并把汇总立方体保存到 job.rollup，任务取消时异常直接向上抛出。
+    传入 details_writer (DetailsWriter) 时匹配明细边匹配边写入磁盘，返回的明细为内存映射的 DetailsStore；
+    没有得到结果（无有效记录、出错或任务被取消）时写入器被放弃，临时目录随即删除。
+    raise_errors 为 True 时分析出错直接抛出异常，不返回不完整的结果；否则记录日志并返回空结果。
+    """
     # 初始化可能返回的 DataFrame
-    summary_df = pd.DataFrame()
-    all_matched_details = []
+    all_matched_details = details_writer if details_writer is not None else []
     account_month_summary = pd.DataFrame()
     stock_summary = pd.DataFrame()
     stock_detail_summary = pd.DataFrame()
@@ -206,7 +479,9 @@ def analyze_trades_from_data(trades_data, log_messages, stock_name_map=None):
 
         log_messages.append(f"解析到 {len(trades_data)} 条原始记录。")
         log_messages.append("正在预处理交易数据...")
-        df, error_msg = preprocess_trades(trades_data)
+        with trace_stage(tracer, 'preprocess', len(trades_data)) as rec:
+            df, error_msg = preprocess_trades(trades_data)
+            rec['rows'] = len(df)
         
         if error_msg:
             log_messages.append(error_msg)
@@ -220,120 +495,30 @@ def analyze_trades_from_data(trades_data, log_messages, stock_name_map=None):
 
         # --- 新增：核心分组和收益计算逻辑 ---
         # 1. 按 account_name, stock_code, month 分组
-        log_messages.append("正在进行交易匹配和收益计算...")
-        grouped = df.groupby(['account_name', 'stock_code', 'month'], group_keys=False)
-
-        summary_data = []
-        # 2. 对每个组调用 calculate_grid_profit_for_group
-        for name, group in grouped:
-            account_name, stock_code, month = name
-            # 调用收益计算函数
-            total_profit, matched_trades = calculate_grid_profit_for_group(group)
-            trade_pair_count = len(matched_trades)
-
-            # 3. 收集汇总信息
-            summary_data.append({
-                'account_name': account_name,
-                'stock_code': stock_code,
-                'month': month,
-                'total_profit': total_profit,
-                'trade_pair_count': trade_pair_count
-            })
-
-            # 4. 收集所有匹配的明细
-            for detail in matched_trades:
-                # 为每个明细记录添加账户和股票信息
-                detail['account_name'] = account_name
-                detail['stock_code'] = stock_code
-                # profit 已在 calculate_grid_profit_for_group 中计算
-                all_matched_details.append(detail)
-
-        # 5. 创建最终的汇总 DataFrame summary_df
-        summary_df = pd.DataFrame(summary_data)
-        if not summary_df.empty:
-            summary_df['total_profit'] = summary_df['total_profit'].round(2)
-        log_messages.append("交易匹配和收益计算完成。")
-        # --- 新增逻辑结束 ---
-
-        # --- 原有后续处理逻辑 ---
-        # 1. 账户月度汇总
-        if not summary_df.empty:
-            account_month_summary = summary_df.groupby(['account_name', 'month'])['total_profit'].sum().reset_index()
-            account_month_summary.rename(columns={'total_profit': 'monthly_total_profit'}, inplace=True)
-            account_month_summary['monthly_total_profit'] = account_month_summary['monthly_total_profit'].round(2)
-        
-        # --- 新增：添加股票名称 ---
-        if stock_name_map:
-            log_messages.append("正在添加股票名称...")
-            def get_stock_name(code):
-                return stock_name_map.get(str(code), str(code)) # 如果找不到名称，则使用代码
-            
-            # 为所有包含 'stock_code' 列的 DataFrame 添加 'stock_name' 列
-            for df_temp in [summary_df, account_month_summary, stock_summary, stock_detail_summary, details_df]:
-                if df_temp is not None and 'stock_code' in df_temp.columns:
-                    df_temp['stock_name'] = df_temp['stock_code'].apply(get_stock_name)
-            
-            # 特别处理 all_matched_details（它是列表，转换为DataFrame后添加）
-            if all_matched_details:
-                details_df_for_name = pd.DataFrame(all_matched_details)
-                if 'stock_code' in details_df_for_name.columns:
-                    details_df_for_name['stock_name'] = details_df_for_name['stock_code'].apply(get_stock_name)
-                    # 更新 all_matched_details 列表中的字典（如果需要，或者直接用 details_df_for_name）
-                    # 这里选择更新 details_df_for_name 并在最后赋值给 details_df
-                    details_df = details_df_for_name
-                else:
-                    details_df = pd.DataFrame(all_matched_details)
-            else:
-                details_df = pd.DataFrame(all_matched_details)
+        policy_label = MATCHING_POLICIES[matching_policy].label
+        log_messages.append(f"正在进行交易匹配和收益计算 (匹配策略: {policy_label})...")
+        with trace_stage(tracer, 'match', len(df)) as rec:
+            summary_data = _match_groups(df, all_matched_details, job, matching_policy, grid_step)
+            rec['rows'] = len(all_matched_details)
 
-            log_messages.append("股票名称添加完成。")
-        else:
-            # 如果没有 stock_name_map，也要从 all_matched_details 创建 details_df
-            details_df = pd.DataFrame(all_matched_details)
-
-        # 2. 新增：股票汇总 (按账户、月份、股票)
-        if not summary_df.empty:
-            # 先添加 stock_name 列（如果存在）
-            columns_to_include = ['account_name', 'month', 'stock_code', 'total_profit']
-            # 如果 stock_name 存在，则也包含它
-            if 'stock_name' in summary_df.columns:
-                columns_to_include.insert(3, 'stock_name')
-    
-            stock_summary = summary_df[columns_to_include].copy()
-            # 注意：如果 stock_name_map 存在，stock_name 列已在 summary_df 中添加
-            stock_summary.rename(columns={'total_profit': 'stock_total_profit'}, inplace=True)
-            stock_summary['stock_total_profit'] = stock_summary['stock_total_profit'].round(2)
-            
-            # 过滤掉总收益为0的股票
-            stock_summary = stock_summary[stock_summary['stock_total_profit'] != 0]
-        
-        # 3. 股票明细 (保持原样，包含交易对数)
-        if not summary_df.empty:
-            stock_detail_summary = summary_df.copy()
-            # 注意：如果 stock_name_map 存在，stock_name 列已在 summary_df 中添加
-            stock_detail_summary['total_profit'] = stock_detail_summary['total_profit'].round(2)
-            
-            # 过滤掉总收益为0的股票
-            stock_detail_summary = stock_detail_summary[stock_detail_summary['total_profit'] != 0]
-        
-        # details_df 的最终处理已在上面 stock_name_map 分支中处理
-        # 确保 datetime 列是 datetime 类型 (如果 details_df 不为空)
-        if not details_df.empty:
-            # 确保 datetime 列是 datetime 类型
-            details_df['sell_datetime'] = pd.to_datetime(details_df['sell_datetime'])
-            details_df['buy_datetime'] = pd.to_datetime(details_df['buy_datetime'])
-            details_df['account_name'] = details_df['account_name'].astype(str)
-            # 重新计算 month，因为 details_df 现在来自 matched details
-            details_df['month'] = details_df['sell_datetime'].dt.to_period('M').astype(str)
-            details_df['profit'] = details_df['profit'].round(2)
+        account_month_summary, stock_summary, stock_detail_summary, details_df, rollup = build_result_frames(
+            summary_data, all_matched_details, log_messages, stock_name_map, tracer)
+        if job is not None:
+            job.rollup = rollup
         
         return account_month_summary, stock_summary, stock_detail_summary, details_df, log_messages
 
     except Exception as e:
+        if raise_errors or (job is not None and job.cancelled):
+            raise
         error_msg = f"分析过程中发生未知错误: {e}"
         log_messages.append(error_msg)
         # 即使出错也返回空的DataFrame和日志
         return account_month_summary, stock_summary, stock_detail_summary, details_df, log_messages
+    finally:
+        # 成功时写入器已在定稿时关闭，目录归返回的 DetailsStore 所有；其余情况下删除临时目录和列文件
+        if details_writer is not None:
+            details_writer.abort()
 
 def analyze_trades_from_file(file_path, log_messages):
     """
@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from result_schema import month_labels, stock_name_labels
+
+# 交易匹配明细的列顺序，与内存中的 details_df 一致（stock_name 仅在有名称映射时存在）
+DETAIL_COLUMNS = ['sell_datetime', 'buy_datetime', 'stock_code', 'matched_quantity', 'buy_moneychg',
+                  'sell_moneychg', 'profit', 'account_name', 'stock_name', 'month']
+# 磁盘上每列一个定长二进制文件；账户和股票代码以整数编码保存，名称和月份在读取时派生
+_STORED_DTYPES = {
+    'sell_datetime': 'datetime64[ns]',
+    'buy_datetime': 'datetime64[ns]',
+    'matched_quantity': 'float64',
+    'buy_moneychg': 'float64',
+    'sell_moneychg': 'float64',
+    'profit': 'float64',
+    'account_name': 'int32',
+    'stock_code': 'int32',
+}
+_CODED_COLUMNS = ('account_name', 'stock_code')
+_META_FILE = 'meta.json'
+DEFAULT_CHUNK_ROWS = 50000
+
+
+class DetailsWriter:
+    """
+    匹配明细的磁盘写入器。匹配过程中逐组调用 extend（与 list.extend 用法相同），
+    明细积累到 chunk_rows 条后追加写入列文件，内存中只保留一个批次。
+    close() 返回以内存映射方式读取这些文件的 DetailsStore；分析被取消或出错时调用 abort() 删除临时目录。
+    """
+
+    def __init__(self, directory=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.directory = directory or tempfile.mkdtemp(prefix='grid_details_')
+        os.makedirs(self.directory, exist_ok=True)
+        self.chunk_rows = chunk_rows
+        self._codes = {col: {} for col in _CODED_COLUMNS}
+        self._buffers = {col: [] for col in _STORED_DTYPES}
+        self._files = {col: open(os.path.join(self.directory, f"{col}.bin"), 'wb') for col in _STORED_DTYPES}
+        self._integral_quantity = True
+        self._rows = 0
+        self._closed = False
+
+    def __len__(self):
+        return self._rows + len(self._buffers['profit'])
+
+    def extend(self, matched_trades):
+        buffers = self._buffers
+        for trade in matched_trades:
+            for col in _CODED_COLUMNS:
+                codes = self._codes[col]
+                buffers[col].append(codes.setdefault(str(trade[col]), len(codes)))
+            buffers['sell_datetime'].append(trade['sell_datetime'])
+            buffers['buy_datetime'].append(trade['buy_datetime'])
+            buffers['matched_quantity'].append(trade['matched_quantity'])
+            buffers['buy_moneychg'].append(trade['buy_moneychg'])
+            buffers['sell_moneychg'].append(trade['sell_moneychg'])
+            buffers['profit'].append(trade['profit'])
+        if len(buffers['profit']) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        count = len(self._buffers['profit'])
+        if not count:
+            return
+        quantity = np.asarray(self._buffers['matched_quantity'])
+        if quantity.dtype.kind == 'f':
+            self._integral_quantity = False
+        for col, dtype in _STORED_DTYPES.items():
+            np.asarray(self._buffers[col]).astype(dtype).tofile(self._files[col])
+            self._buffers[col].clear()
+        self._rows += count
+
+    def close(self, stock_name_map=None):
+        """写完剩余批次和元数据，返回 DetailsStore（临时目录随其一起删除）"""
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        meta = {
+            'rows': self._rows,
+            'categories': {col: list(codes) for col, codes in self._codes.items()},
+            'quantity_dtype': 'int64' if self._integral_quantity else 'float64',
+            'stock_names': stock_name_map or {},
+        }
+        with open(os.path.join(self.directory, _META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        store = DetailsStore(self.directory, remove_on_close=True)
+        self._closed = True
+        return store
+
+    def abort(self):
+        """放弃已写入的明细：关闭列文件并删除临时目录。已经 close() 的写入器目录归 DetailsStore 所有，不做处理"""
+        if self._closed:
+            return
+        self._closed = True
+        for f in self._files.values():
+            f.close()
+        for buffer in self._buffers.values():
+            buffer.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class DetailsStore:
+    """
+    以内存映射方式读取的交易匹配明细。只有被访问的行会读入内存：
+    take / slice 返回指定行的 DataFrame，iter_frames 按排序顺序分块产出，
+    界面分页显示和导出都按块读取，不需要把全部明细放进内存。
+    """
+
+    def __init__(self, directory, remove_on_close=False):
+        self.directory = directory
+        with open(os.path.join(directory, _META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.quantity_dtype = meta['quantity_dtype']
+        self.stock_name_map = meta['stock_names']
+        self.categories = {col: np.array(values, dtype=object) for col, values in meta['categories'].items()}
+        # 股票代码编码 -> 名称，按编码整列取值
+        self.stock_names = stock_name_labels(self.categories['stock_code'], self.stock_name_map) if self.stock_name_map else None
+        self._arrays = {}
+        for col, dtype in _STORED_DTYPES.items():
+            if self.rows:
+                self._arrays[col] = np.memmap(os.path.join(directory, f"{col}.bin"), dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                self._arrays[col] = np.empty(0, dtype=dtype)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, directory, True) if remove_on_close else None
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def empty(self):
+        return self.rows == 0
+
+    @property
+    def columns(self):
+        if self.stock_name_map:
+            return list(DETAIL_COLUMNS)
+        return [col for col in DETAIL_COLUMNS if col != 'stock_name']
+
+    def take(self, positions):
+        """按行号读取明细，返回与内存中的 details_df 格式相同的 DataFrame"""
+        positions = np.asarray(positions, dtype=np.int64)
+        arrays = self._arrays
+        sell_datetime = np.asarray(arrays['sell_datetime'][positions])
+        code_ids = arrays['stock_code'][positions]
+        stock_codes = self.categories['stock_code'][code_ids]
+        data = {
+            'sell_datetime': sell_datetime,
+            'buy_datetime': np.asarray(arrays['buy_datetime'][positions]),
+            'stock_code': stock_codes,
+            'matched_quantity': np.asarray(arrays['matched_quantity'][positions]).astype(self.quantity_dtype),
+            'buy_moneychg': np.asarray(arrays['buy_moneychg'][positions]),
+            'sell_moneychg': np.asarray(arrays['sell_moneychg'][positions]),
+            'profit': np.asarray(arrays['profit'][positions]).round(2),
+            'account_name': self.categories['account_name'][arrays['account_name'][positions]],
+        }
+        if self.stock_name_map:
+            data['stock_name'] = self.stock_names[code_ids]
+        data['month'] = month_labels(sell_datetime)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def slice(self, start, stop, order=None):
+        """读取第 start 到 stop 行；给出 order 时按该排序顺序取行"""
+        if order is None:
+            return self.take(np.arange(start, min(stop, self.rows)))
+        return self.take(order[start:stop])
+
+    def _sort_key(self, col):
+        if col in _CODED_COLUMNS:
+            # 编码按出现顺序分配，按名称排序时需要先换算成名称的排名
+            categories = self.categories[col]
+            ranks = np.empty(len(categories), dtype=np.int64)
+            ranks[np.argsort(categories.astype(str), kind='stable')] = np.arange(len(categories))
+            return ranks[self._arrays[col]]
+        if col == 'stock_name':
+            names = self.stock_names.astype(str)
+            ranks = np.empty(len(names), dtype=np.int64)
+            ranks[np.argsort(names, kind='stable')] = np.arange(len(names))
+            return ranks[self._arrays['stock_code']]
+        if col == 'month':
+            return self._arrays['sell_datetime'].astype('datetime64[M]')
+        return self._arrays[col]
+
+    def month_keys(self):
+        """每行的月份（datetime64[M]），与 month 列一致"""
+        return self._sort_key('month')
+
+    def account_codes(self):
+        """每行的账户编码，对应 categories['account_name'] 中的账户名称"""
+        return self._arrays['account_name']
+
+    def sort_order(self, by):
+        """返回按 by 中各列升序排列的行号数组，只读取排序键所在的列"""
+        if isinstance(by, str):
+            by = [by]
+        return np.lexsort([self._sort_key(col) for col in reversed(by)])
+
+    def iter_frames(self, by=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """按排序顺序（by 为 None 时按写入顺序）分块产出明细 DataFrame"""
+        order = self.sort_order(by) if by else None
+        for start in range(0, self.rows, chunk_rows):
+            yield self.slice(start, start + chunk_rows, order)
+
+    def to_frame(self):
+        """一次性读取全部明细"""
+        return self.take(np.arange(self.rows))
+
+    def detach(self):
+        """放弃对目录的所有权（交给其他进程打开），返回目录路径"""
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+        return self.directory
+
+    def close(self):
+        self._arrays = {}
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
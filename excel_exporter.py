@@ -1,8 +1,17 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 
 try:
     from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
     from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
     from openpyxl.utils.dataframe import dataframe_to_rows
     OPENPYXL_AVAILABLE = True
 except ImportError:
@@ -11,20 +20,21 @@ except ImportError:
     print("      可以通过运行 'pip install openpyxl' 来安装。")
 
 from data_processor import COLUMN_NAME_MAP
+from details_store import DetailsStore
+
+# 分区导出：每个 (账户, 月份) 一个工作簿，索引文件记录各分区的内容哈希
+PARTITION_FORMAT_VERSION = 3
+DEFAULT_PARTITION_DIR = '网格交易收益分析结果'
+PARTITION_INDEX_FILE = 'index.json'
+PARTITION_INDEX_WORKBOOK = '索引.xlsx'
 
 def format_excel_sheet(sheet, df, title="", header_font=Font(bold=True), header_fill=PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")):
     """为 Excel 工作表应用基本格式"""
     if title:
         sheet.title = title
 
-    # 创建df的副本并转换Period类型列
-    df_processed = df.copy()
-    for col in df_processed.columns:
-        if isinstance(df_processed[col].dtype, pd.PeriodDtype):
-            df_processed[col] = df_processed[col].astype(str)
-
-    # 应用列名映射
-    df_display = df_processed.rename(columns=COLUMN_NAME_MAP)
+    # 应用列名映射（月份已是字符串，见 result_schema）
+    df_display = df.rename(columns=COLUMN_NAME_MAP)
 
     for r_idx, row in enumerate(dataframe_to_rows(df_display, index=False, header=True), 1):
         for c_idx, value in enumerate(row, 1):
@@ -47,33 +57,68 @@ def format_excel_sheet(sheet, df, title="", header_font=Font(bold=True), header_
         adjusted_width = (max_length + 2) * 1.2
         sheet.column_dimensions[column_letter].width = min(adjusted_width, 50) # Max width 50
 
+def format_details_for_export(details_df):
+    """交易匹配明细导出前的处理：交换买/卖时间列名以匹配显示逻辑，时间格式化为字符串"""
+    details_with_formatted_dates = details_df.copy()
+    # 交换买/卖时间列名以匹配显示逻辑
+    if 'sell_datetime' in details_with_formatted_dates.columns and 'buy_datetime' in details_with_formatted_dates.columns:
+        details_with_formatted_dates.rename(columns={'sell_datetime': 'temp_buy', 'buy_datetime': 'temp_sell'}, inplace=True)
+        details_with_formatted_dates.rename(columns={'temp_buy': 'buy_datetime', 'temp_sell': 'sell_datetime'}, inplace=True)
+
+    if 'sell_datetime' in details_with_formatted_dates.columns:
+        details_with_formatted_dates['sell_datetime'] = details_with_formatted_dates['sell_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if 'buy_datetime' in details_with_formatted_dates.columns:
+        details_with_formatted_dates['buy_datetime'] = details_with_formatted_dates['buy_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return details_with_formatted_dates
+
+def write_sheet_streaming(wb, title, frames, header_font=Font(bold=True), header_fill=PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")):
+    """
+    向只写模式的工作簿逐块写入一个工作表，frames 为 DataFrame 的迭代器。
+    只写模式下行写出后即释放，列宽按第一块数据估算。
+    """
+    sheet = wb.create_sheet(title=title)
+    first = True
+    for df in frames:
+        df_display = df.rename(columns=COLUMN_NAME_MAP)
+        if first:
+            for c_idx, col in enumerate(df_display.columns, 1):
+                max_length = max([len(str(col))] + [len(str(value)) for value in df_display[col].head(1000)])
+                sheet.column_dimensions[get_column_letter(c_idx)].width = min((max_length + 2) * 1.2, 50)
+            header = []
+            for col in df_display.columns:
+                cell = WriteOnlyCell(sheet, value=col)
+                cell.font = header_font
+                cell.fill = header_fill
+                cell.alignment = Alignment(horizontal="center", vertical="center")
+                header.append(cell)
+            sheet.append(header)
+            first = False
+        for row in df_display.itertuples(index=False, name=None):
+            sheet.append(row)
+
+def save_details_store_to_excel(account_month_summary, stock_summary, stock_detail_summary, details_store, output_file):
+    """明细保存在磁盘上时使用只写模式的工作簿，按块读取明细写出，不在内存中展开全部明细"""
+    try:
+        wb = Workbook(write_only=True)
+        for df, title in [(account_month_summary, "账户月度汇总"), (stock_summary, "股票汇总"), (stock_detail_summary, "股票明细")]:
+            if df is not None and not df.empty:
+                write_sheet_streaming(wb, title, [df])
+        if not details_store.empty:
+            write_sheet_streaming(wb, "交易匹配明细", (format_details_for_export(chunk) for chunk in details_store.iter_frames()))
+        wb.save(output_file)
+        return True, f"格式化的结果已保存到 '{output_file}'"
+    except Exception as e:
+        print(f"保存Excel文件时出错: {e}")
+        return False, f"保存Excel文件时出错2: {e}"
+
 def save_results_to_excel(account_month_summary, stock_summary, stock_detail_summary, details_df, output_file):
     """将结果保存到格式化的 Excel 文件"""
-    # 在保存前，先将所有DataFrame中的Period类型列转换为字符串
-    if account_month_summary is not None and not account_month_summary.empty:
-        account_month_summary = account_month_summary.copy()
-        for col in account_month_summary.columns:
-            if isinstance(account_month_summary[col].dtype, pd.PeriodDtype):
-                account_month_summary[col] = account_month_summary[col].astype(str)
-    
-    if stock_summary is not None and not stock_summary.empty:
-        stock_summary = stock_summary.copy()
-        for col in stock_summary.columns:
-            if isinstance(stock_summary[col].dtype, pd.PeriodDtype):
-                stock_summary[col] = stock_summary[col].astype(str)
-    
-    if stock_detail_summary is not None and not stock_detail_summary.empty:
-        stock_detail_summary = stock_detail_summary.copy()
-        for col in stock_detail_summary.columns:
-            if isinstance(stock_detail_summary[col].dtype, pd.PeriodDtype):
-                stock_detail_summary[col] = stock_detail_summary[col].astype(str)
-    
-    if details_df is not None and not details_df.empty:
-        details_df = details_df.copy()
-        for col in details_df.columns:
-            if isinstance(details_df[col].dtype, pd.PeriodDtype):
-                details_df[col] = details_df[col].astype(str)
-    
+    if isinstance(details_df, DetailsStore):
+        if OPENPYXL_AVAILABLE:
+            return save_details_store_to_excel(account_month_summary, stock_summary, stock_detail_summary, details_df, output_file)
+        details_df = details_df.to_frame()
+
+    # 结果中的月份已是字符串、时间已是 datetime64 (见 result_schema)，这里不再逐表转换
     if not OPENPYXL_AVAILABLE:
         try:
             # 应用列名映射
@@ -96,12 +141,9 @@ def save_results_to_excel(account_month_summary, stock_summary, stock_detail_sum
                 if not details_df_display.empty:
                     # 格式化日期时间列
                     if '卖出时间' in details_df_display.columns:
-                        details_df_display['卖出时间'] = pd.to_datetime(details_df_display['卖出时间']).dt.strftime('%Y-%m-%d %H:%M:%S')
+                        details_df_display['卖出时间'] = details_df_display['卖出时间'].dt.strftime('%Y-%m-%d %H:%M:%S')
                     if '买入时间' in details_df_display.columns:
-                        details_df_display['买入时间'] = pd.to_datetime(details_df_display['买入时间']).dt.strftime('%Y-%m-%d %H:%M:%S')
-                    # 转换Period类型的month列为字符串
-                    if '月份' in details_df_display.columns:
-                        details_df_display['月份'] = details_df_display['月份'].astype(str)
+                        details_df_display['买入时间'] = details_df_display['买入时间'].dt.strftime('%Y-%m-%d %H:%M:%S')
                     details_df_display.to_excel(writer, sheet_name='交易匹配明细', index=False)
             return True, f"结果已保存到 '{output_file}' (基础格式，建议安装 openpyxl 获得美化效果)"
         except Exception as e:
@@ -125,20 +167,7 @@ def save_results_to_excel(account_month_summary, stock_summary, stock_detail_sum
 
         if not details_df.empty:
             ws3 = wb.create_sheet(title="交易匹配明细")
-            details_with_formatted_dates = details_df.copy()
-            # 交换买/卖时间列名以匹配显示逻辑
-            if 'sell_datetime' in details_with_formatted_dates.columns and 'buy_datetime' in details_with_formatted_dates.columns:
-                details_with_formatted_dates.rename(columns={'sell_datetime': 'temp_buy', 'buy_datetime': 'temp_sell'}, inplace=True)
-                details_with_formatted_dates.rename(columns={'temp_buy': 'buy_datetime', 'temp_sell': 'sell_datetime'}, inplace=True)
-            
-            if 'sell_datetime' in details_with_formatted_dates.columns:
-                details_with_formatted_dates['sell_datetime'] = pd.to_datetime(details_with_formatted_dates['sell_datetime']).dt.strftime('%Y-%m-%d %H:%M:%S')
-            if 'buy_datetime' in details_with_formatted_dates.columns:
-                details_with_formatted_dates['buy_datetime'] = pd.to_datetime(details_with_formatted_dates['buy_datetime']).dt.strftime('%Y-%m-%d %H:%M:%S')
-            
-            # 转换Period类型的month列为字符串
-            if 'month' in details_with_formatted_dates.columns:
-                details_with_formatted_dates['month'] = details_with_formatted_dates['month'].astype(str)
+            details_with_formatted_dates = format_details_for_export(details_df)
             
             format_excel_sheet(ws3, details_with_formatted_dates, "交易匹配明细")
 
@@ -147,4 +176,149 @@ def save_results_to_excel(account_month_summary, stock_summary, stock_detail_sum
     except Exception as e:
         # 输出错误信息
         print(f"保存Excel文件时出错: {e}")
-        return False, f"保存Excel文件时出错2: {e}"
\ No newline at end of file
+        return False, f"保存Excel文件时出错2: {e}"
+
+def _split_by_partition(df):
+    """按 (账户, 月份) 把结果表拆分为 {(账户, 月份字符串): DataFrame}"""
+    if df is None or df.empty or 'month' not in df.columns or 'account_name' not in df.columns:
+        return {}
+    return {key: part for key, part in df.groupby(['account_name', 'month'], sort=True)}
+
+def _split_details_by_partition(details_df):
+    """明细按 (账户, 月份) 拆分；DetailsStore 只计算每个分区的行号，读取推迟到写出该分区时"""
+    if details_df is None or details_df.empty:
+        return {}
+    if isinstance(details_df, DetailsStore):
+        accounts = details_df.account_codes()
+        months = details_df.month_keys()
+        order = np.lexsort((months, accounts))
+        sorted_accounts = accounts[order]
+        sorted_months = months[order]
+        changed = (sorted_accounts[1:] != sorted_accounts[:-1]) | (sorted_months[1:] != sorted_months[:-1])
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        stops = list(starts[1:]) + [len(order)]
+        account_names = details_df.categories['account_name']
+        return {(str(account_names[sorted_accounts[start]]), str(sorted_months[start])):
+                    (lambda positions=order[start:stop]: details_df.take(positions))
+                for start, stop in zip(starts, stops)}
+    return {key: (lambda part=part: part) for key, part in _split_by_partition(details_df).items()}
+
+def _partition_file_name(account_name, month):
+    # 账户名称中不能用于文件名的字符替换为下划线
+    safe_account = re.sub(r'[\\/:*?"<>|\s]', '_', str(account_name))
+    return f"网格交易收益_{safe_account}_{month}.xlsx"
+
+def _months_in_range(date_range):
+    """date_range 为 ('YYYYMMDD', 'YYYYMMDD')，返回其覆盖的 'YYYY-MM' 月份集合"""
+    if not date_range:
+        return set()
+    start, end = (pd.Timestamp(datetime.strptime(str(value), '%Y%m%d')) for value in date_range)
+    return set(pd.period_range(start, end, freq='M').strftime('%Y-%m'))
+
+def partition_hash(frames):
+    """一个分区内各结果表内容的 SHA-256"""
+    digest = hashlib.sha256(str(PARTITION_FORMAT_VERSION).encode())
+    for df in frames:
+        if df is None or df.empty:
+            digest.update(b'empty\0')
+            continue
+        digest.update(json.dumps([str(col) for col in df.columns], ensure_ascii=False).encode('utf-8'))
+        # 内存中的明细和磁盘上的明细列类型一致 (见 result_schema)，可以直接哈希
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _load_partition_index(output_dir):
+    try:
+        with open(os.path.join(output_dir, PARTITION_INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == PARTITION_FORMAT_VERSION:
+            return index
+    except (FileNotFoundError, ValueError):
+        pass
+    return {'version': PARTITION_FORMAT_VERSION, 'partitions': {}}
+
+def save_results_partitioned(account_month_summary, stock_summary, stock_detail_summary, details_df,
+                             output_dir=DEFAULT_PARTITION_DIR, date_range=None):
+    """
+    按 (账户, 月份) 分区导出：每个分区写入 output_dir 下单独的工作簿，并维护索引。
+    各分区按内容哈希判断是否变化，只重写结果发生变化的分区。
+    date_range 为本次分析的 ('YYYYMMDD', 'YYYYMMDD')：只有本次结果中出现的账户、且月份在该区间内、
+    但本次已没有结果的分区才会被删除；区间外的月份和其他账户的分区始终保留。未给出 date_range 时不删除任何分区。
+    返回 (是否成功, 消息)。
+    """
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        index = _load_partition_index(output_dir)
+        old_partitions = index['partitions']
+
+        account_month_parts = _split_by_partition(account_month_summary)
+        stock_summary_parts = _split_by_partition(stock_summary)
+        stock_detail_parts = _split_by_partition(stock_detail_summary)
+        details_parts = _split_details_by_partition(details_df)
+        keys = sorted(set(account_month_parts) | set(stock_summary_parts) | set(stock_detail_parts) | set(details_parts))
+
+        partitions = dict(old_partitions)
+        written = 0
+        for account_name, month in keys:
+            frames = [
+                account_month_parts.get((account_name, month), pd.DataFrame()),
+                stock_summary_parts.get((account_name, month), pd.DataFrame()),
+                stock_detail_parts.get((account_name, month), pd.DataFrame()),
+                details_parts[(account_name, month)]() if (account_name, month) in details_parts else pd.DataFrame(),
+            ]
+            content_hash = partition_hash(frames)
+            file_name = _partition_file_name(account_name, month)
+            path = os.path.join(output_dir, file_name)
+            key = f"{account_name}|{month}"
+            old = old_partitions.get(key)
+            if old is not None and old['hash'] == content_hash and os.path.exists(path):
+                continue
+
+            success, save_msg = save_results_to_excel(*frames, path)
+            if not success:
+                return False, save_msg
+            written += 1
+            partitions[key] = {
+                'account_name': account_name,
+                'month': month,
+                'file': file_name,
+                'hash': content_hash,
+                'total_profit': round(float(frames[0]['monthly_total_profit'].sum()), 2) if 'monthly_total_profit' in frames[0].columns else 0.0,
+                'detail_rows': len(frames[3]),
+                'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+
+        # 只删除本次分析范围内（本次出现的账户、区间内的月份）已没有结果的分区
+        current_keys = {f"{account_name}|{month}" for account_name, month in keys}
+        analysed_accounts = {account_name for account_name, _ in keys}
+        analysed_months = _months_in_range(date_range)
+        removed = 0
+        for key, old in old_partitions.items():
+            if (key not in current_keys and old['account_name'] in analysed_accounts
+                    and old['month'] in analysed_months):
+                stale_path = os.path.join(output_dir, old['file'])
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                del partitions[key]
+                removed += 1
+
+        partitions = dict(sorted(partitions.items(), key=lambda item: (item[1]['account_name'], item[1]['month'])))
+        if written or removed or not os.path.exists(os.path.join(output_dir, PARTITION_INDEX_WORKBOOK)):
+            index_df = pd.DataFrame([
+                {'账户': info['account_name'], '月份': info['month'], '文件': info['file'], '月度总收益': info['total_profit'],
+                 '明细条数': info['detail_rows'], '更新时间': info['updated']}
+                for info in partitions.values()
+            ])
+            index_df.to_excel(os.path.join(output_dir, PARTITION_INDEX_WORKBOOK), sheet_name='索引', index=False)
+
+        index['partitions'] = partitions
+        tmp_path = os.path.join(output_dir, PARTITION_INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(output_dir, PARTITION_INDEX_FILE))
+
+        return True, (f"分区结果已保存到 '{output_dir}'：本次 {len(keys)} 个分区（账户 × 月份），"
+                      f"重写 {written} 个，未变化跳过 {len(keys) - written} 个，删除 {removed} 个，索引中共 {len(partitions)} 个")
+    except Exception as e:
+        return False, f"分区保存Excel文件时出错: {e}"
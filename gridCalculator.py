@@ -1,16 +1,42 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import pandas as pd
-from datetime import datetime
 
 from data_processor import (
     get_current_month_range, 
     analyze_trades_from_data,
-    COLUMN_NAME_MAP
+    COLUMN_NAME_MAP,
+    MATCHING_POLICIES,
+    DEFAULT_MATCHING_POLICY
 )
-from api_client import APIClient
-from excel_exporter import save_results_to_excel
+from api_client import APIClient, DEFAULT_PAGE_CAP
+from excel_exporter import save_results_to_excel, save_results_partitioned, DEFAULT_PARTITION_DIR
 from table_manager import TableManager
+from perf_trace import PerfTracer, trace_stage
+from analysis_job import AnalysisJob, JobCancelled, fetch_trades, fetch_stock_names
+from process_runner import ProcessAnalysisRunner
+from analysis_service import RemoteAnalysisRunner, DEFAULT_SERVICE_URL
+from scenario_sweep import run_sweep, build_scenarios
+from result_cache import AnalysisCache, DEFAULT_CACHE_DIR
+from log_sink import LogSink, DEFAULT_LOG_FILE
+from details_store import DetailsStore
+from intraday_watch import IntradayWatcher, DEFAULT_WATCH_INTERVAL
+from session_snapshot import save_snapshot, load_snapshot, SNAPSHOT_EXTENSION
+from text_report import render_details_report, report_sort_order, write_details_report
+
+# 交易匹配明细每页显示的条数
+DETAILS_PAGE_ROWS = 2000
+
+# 透视视图：显示名称 -> 汇总维度
+PIVOT_VIEWS = {
+    "账户 × 年度": ('account_name', 'year'),
+    "账户 × 月份": ('account_name', 'month'),
+    "股票 × 月份": ('stock_code', 'month'),
+    "账户 × 股票": ('account_name', 'stock_code'),
+    "股票合计": ('stock_code',),
+    "月度合计": ('month',),
+    "年度合计": ('year',),
+}
 
 class GridProfitApp:
     def __init__(self, root):
@@ -24,11 +50,30 @@ class GridProfitApp:
         self.details_df = None
         self.api_controls = {}
         self.stock_summary_controls = {}
+        self.tracer = None
+        self.current_job = None
+        self.last_raw_trades = None
+        # last_raw_trades 对应的 (用户账号, 股票账户, 开始日期, 结束日期)，输入变化后缓存的交易记录不再使用
+        self.last_raw_key = None
+        self.rollup = None
+        self.pivot_controls = {}
+        # 明细分页状态：当前页和报表排序后的行号数组
+        self.details_page = 0
+        self.details_sorted = None
+        self.stock_name_map = None
+        self.watcher = None
+        # 从会话快照打开时，交易匹配明细在切换到明细标签页时才读取
+        self.pending_snapshot = None
+        # 最近一次分析的运行参数（不含 Cookie），保存会话快照时一并写入
+        self.last_run_params = None
         
         # 初始化表格管理器
         self.table_manager = TableManager(self)
 
         self.create_widgets()
+        # 运行日志批量刷新到界面，完整历史写入滚动日志文件
+        self.log_sink = LogSink(self.root, self.log_text, log_file=DEFAULT_LOG_FILE)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         # --- API 接口区域 ---
@@ -68,11 +113,59 @@ class GridProfitApp:
         tk.Label(row2, text="Cookie:", width=10, anchor='w').pack(side=tk.LEFT)
         self.api_controls['cookie_var'] = tk.StringVar(value='')
         tk.Entry(row2, textvariable=self.api_controls['cookie_var'], width=50).pack(side=tk.LEFT, padx=(5, 10), fill=tk.X, expand=True)
+        # 填写分析服务地址时，界面只提交任务并显示结果，获取与分析由服务完成
+        tk.Label(row2, text="分析服务:", width=10, anchor='w').pack(side=tk.LEFT)
+        self.api_controls['service_url_var'] = tk.StringVar(value=DEFAULT_SERVICE_URL)
+        tk.Entry(row2, textvariable=self.api_controls['service_url_var'], width=24).pack(side=tk.LEFT, padx=(5, 0))
+
+        # 第三行：匹配策略
+        row3 = tk.Frame(api_inputs_frame)
+        row3.pack(fill=tk.X, pady=2)
+        tk.Label(row3, text="匹配规则:", width=10, anchor='w').pack(side=tk.LEFT)
+        self.api_controls['policy_labels'] = {policy.label: name for name, policy in MATCHING_POLICIES.items()}
+        self.api_controls['policy_var'] = tk.StringVar(value=MATCHING_POLICIES[DEFAULT_MATCHING_POLICY].label)
+        ttk.Combobox(row3, textvariable=self.api_controls['policy_var'], values=list(self.api_controls['policy_labels']), width=16, state="readonly").pack(side=tk.LEFT, padx=(5, 10))
+        tk.Label(row3, text="网格步长(%):", width=10, anchor='w').pack(side=tk.LEFT)
+        self.api_controls['grid_step_var'] = tk.StringVar(value='3')
+        tk.Entry(row3, textvariable=self.api_controls['grid_step_var'], width=8).pack(side=tk.LEFT, padx=(5, 10))
+        # 盘中盯盘：按间隔只获取最近的成交并增量更新结果
+        tk.Label(row3, text="盯盘间隔(秒):", width=12, anchor='w').pack(side=tk.LEFT)
+        self.api_controls['watch_interval_var'] = tk.StringVar(value=str(DEFAULT_WATCH_INTERVAL))
+        tk.Entry(row3, textvariable=self.api_controls['watch_interval_var'], width=6).pack(side=tk.LEFT, padx=(5, 10))
+        self.watch_button = tk.Button(row3, text="开始盯盘", command=self.toggle_watch)
+        self.watch_button.pack(side=tk.LEFT)
 
         # API 操作按钮
         api_button_frame = tk.Frame(api_frame)
         api_button_frame.pack(fill=tk.X, padx=5, pady=5)
         tk.Button(api_button_frame, text="从接口获取数据", command=self.start_api_analysis).pack(side=tk.LEFT)
+        self.cancel_button = tk.Button(api_button_frame, text="取消", command=self.cancel_api_analysis, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=(5, 0))
+        # 性能追踪选项
+        self.api_controls['profile_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="性能剖析(cProfile/tracemalloc)", variable=self.api_controls['profile_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['save_trace_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="保存性能追踪文件", variable=self.api_controls['save_trace_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['use_cache_var'] = tk.BooleanVar(value=True)
+        tk.Checkbutton(api_button_frame, text="使用分析缓存", variable=self.api_controls['use_cache_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['streaming_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="按周分段获取", variable=self.api_controls['streaming_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['process_mode_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="独立进程运行", variable=self.api_controls['process_mode_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['spill_details_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="明细写入磁盘", variable=self.api_controls['spill_details_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['partitioned_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="分区处理(低内存)", variable=self.api_controls['partitioned_var']).pack(side=tk.LEFT, padx=(10, 0))
+        self.api_controls['partition_export_var'] = tk.BooleanVar(value=False)
+        tk.Checkbutton(api_button_frame, text="按月分区导出", variable=self.api_controls['partition_export_var']).pack(side=tk.LEFT, padx=(10, 0))
+
+        # 进度条
+        progress_frame = tk.Frame(api_frame)
+        progress_frame.pack(fill=tk.X, padx=5, pady=(0, 5))
+        self.progress_var = tk.DoubleVar(value=0)
+        ttk.Progressbar(progress_frame, variable=self.progress_var, maximum=100).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.progress_label = tk.Label(progress_frame, text="", width=30, anchor='w')
+        self.progress_label.pack(side=tk.LEFT, padx=(5, 0))
 
         # --- 通用操作按钮区域 ---
         button_frame = tk.Frame(self.root)
@@ -81,9 +174,16 @@ class GridProfitApp:
         self.clear_button = tk.Button(button_frame, text="清空结果", command=self.clear_results)
         self.clear_button.pack(side=tk.LEFT, padx=5)
 
+        self.sweep_button = tk.Button(button_frame, text="参数扫描", command=self.start_sweep)
+        self.sweep_button.pack(side=tk.LEFT, padx=5)
+
+        tk.Button(button_frame, text="保存会话", command=self.save_session).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="打开会话", command=self.open_session).pack(side=tk.LEFT, padx=5)
+
         # --- Notebook (标签页) ---
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
 
         # 标签页 1: 账户月度汇总
         self.account_month_frame = ttk.Frame(self.notebook)
@@ -94,11 +194,16 @@ class GridProfitApp:
         self.notebook.add(self.stock_summary_frame, text="股票汇总")
         self.create_stock_summary_with_controls()
 
-        # 标签页 3: 股票明细
+        # 标签页 3: 汇总透视 (从汇总立方体直接读取任意层级的合计)
+        self.pivot_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.pivot_frame, text="汇总透视")
+        self.create_pivot_controls()
+
+        # 标签页 4: 股票明细
         self.stock_detail_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.stock_detail_frame, text="股票明细")
 
-        # 标签页 4: 交易匹配明细 (文本)
+        # 标签页 5: 交易匹配明细 (文本)
         self.details_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.details_frame, text="交易匹配明细")
         self.details_text = scrolledtext.ScrolledText(self.details_frame, wrap=tk.NONE, state=tk.DISABLED, font=("Consolas", 9))
@@ -108,10 +213,22 @@ class GridProfitApp:
         self.details_text.grid(row=0, column=0, sticky='nsew')
         v_scrollbar_d.grid(row=0, column=1, sticky='ns')
         h_scrollbar_d.grid(row=1, column=0, sticky='ew')
+        # 明细按页渲染，每页 DETAILS_PAGE_ROWS 条
+        details_page_frame = ttk.Frame(self.details_frame)
+        details_page_frame.grid(row=2, column=0, columnspan=2, sticky='ew', pady=(3, 0))
+        ttk.Button(details_page_frame, text="上一页", command=lambda: self.change_details_page(-1)).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(details_page_frame, text="下一页", command=lambda: self.change_details_page(1)).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(details_page_frame, text="导出文本", command=self.export_details_text).pack(side=tk.RIGHT)
+        self.details_page_label = ttk.Label(details_page_frame, text="")
+        self.details_page_label.pack(side=tk.LEFT)
         self.details_frame.grid_rowconfigure(0, weight=1)
         self.details_frame.grid_columnconfigure(0, weight=1)
 
-        # 标签页 5: 运行日志
+        # 标签页 6: 参数对比 (不同匹配规则和分组周期的收益对比)
+        self.sweep_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.sweep_frame, text="参数对比")
+
+        # 标签页 7: 运行日志
         self.log_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.log_frame, text="运行日志")
         self.log_text = scrolledtext.ScrolledText(self.log_frame, height=10, wrap=tk.WORD, state=tk.DISABLED)
@@ -150,33 +267,55 @@ class GridProfitApp:
         self.stock_summary_controls['table_frame'] = ttk.Frame(self.stock_summary_frame)
         self.stock_summary_controls['table_frame'].pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+    def create_pivot_controls(self):
+        """为汇总透视标签页创建视图选择控件"""
+        control_frame = ttk.Frame(self.pivot_frame)
+        control_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(control_frame, text="视图:").pack(side=tk.LEFT, padx=(0, 5))
+        self.pivot_controls['view_var'] = tk.StringVar(value=next(iter(PIVOT_VIEWS)))
+        view_combo = ttk.Combobox(control_frame, textvariable=self.pivot_controls['view_var'], values=list(PIVOT_VIEWS), width=15, state="readonly")
+        view_combo.pack(side=tk.LEFT, padx=(0, 10))
+        view_combo.bind("<<ComboboxSelected>>", lambda event: self.show_pivot_view())
+
+        self.pivot_controls['table_frame'] = ttk.Frame(self.pivot_frame)
+        self.pivot_controls['table_frame'].pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+    def show_pivot_view(self):
+        if self.rollup is None:
+            return
+        dims = PIVOT_VIEWS[self.pivot_controls['view_var'].get()]
+        self.table_manager.populate_table("pivot", self.rollup.frame(dims))
+
     def update_stock_summary_controls(self):
-        if self.stock_summary_df is None or self.stock_summary_df.empty:
+        if self.rollup is None:
             return
             
-        accounts = ["全部"] + sorted(self.stock_summary_df['account_name'].unique())
+        accounts = ["全部"] + self.rollup.values('account_name')
         self.stock_summary_controls['account_combo']['values'] = accounts
         if self.stock_summary_controls['account_var'].get() not in accounts:
             self.stock_summary_controls['account_var'].set("全部")
             
-        months = ["全部"] + sorted(self.stock_summary_df['month'].astype(str).unique())
+        months = ["全部"] + self.rollup.values('month')
         self.stock_summary_controls['month_combo']['values'] = months
         if self.stock_summary_controls['month_var'].get() not in months:
             self.stock_summary_controls['month_var'].set("全部")
 
     def apply_stock_summary_filter(self):
-        if self.stock_summary_df is None or self.stock_summary_df.empty:
+        if self.rollup is None:
             return
-            
-        df_filtered = self.stock_summary_df.copy()
-        
+
+        # 从汇总立方体中直接取出满足筛选条件的行，无需扫描整张股票汇总表
         selected_account = self.stock_summary_controls['account_var'].get()
-        if selected_account != "全部":
-            df_filtered = df_filtered[df_filtered['account_name'] == selected_account]
-            
         selected_month = self.stock_summary_controls['month_var'].get()
-        if selected_month != "全部":
-            df_filtered = df_filtered[df_filtered['month'].astype(str) == selected_month]
+        rows = self.rollup.rows(
+            account_name=None if selected_account == "全部" else selected_account,
+            month=None if selected_month == "全部" else selected_month
+        )
+        # 立方体包含收益为0的分组，股票汇总表与之前一样只显示有收益的股票
+        rows = rows[rows['total_profit'] != 0]
+        columns = [col for col in self.stock_summary_df.columns if col != 'stock_total_profit']
+        df_filtered = rows[columns].assign(stock_total_profit=rows['total_profit'])
             
         sort_ascending = not self.stock_summary_controls['profit_sort_var'].get()
         try:
@@ -207,6 +346,119 @@ class GridProfitApp:
         except Exception as e:
             self.log_message(f"排序时出错: {e}")
 
+    def toggle_watch(self):
+        """开始或停止盘中盯盘"""
+        if self.watcher is not None:
+            self.stop_watch()
+            self.log_message("已停止盯盘。")
+            return
+
+        params = [self.api_controls[key].get().strip() for key in ['user_id_var', 'fund_key_var', 'cookie_var', 'start_date_var', 'end_date_var']]
+        if not all(params):
+            messagebox.showwarning("警告", "请填写所有API接口参数。")
+            return
+        if self.current_job is not None and self.current_job.running:
+            messagebox.showwarning("警告", "已有分析任务正在运行，请等待完成或先取消。")
+            return
+        try:
+            interval = float(self.api_controls['watch_interval_var'].get().strip())
+            grid_step = float(self.api_controls['grid_step_var'].get().strip() or 0) or None
+        except ValueError:
+            messagebox.showwarning("警告", "盯盘间隔和网格步长必须是数字。")
+            return
+        matching_policy = self.api_controls['policy_labels'][self.api_controls['policy_var'].get()]
+
+        client = APIClient(*params)
+        self.watcher = IntradayWatcher(client, self.stock_name_map, matching_policy, grid_step)
+        self.watch_button.config(text="停止盯盘")
+        self.log_message(f"开始盯盘，每 {interval:g} 秒获取一次最新成交...")
+        import threading
+        thread = threading.Thread(target=self.run_watch, args=(self.watcher, self.cached_raw_trades(params), interval))
+        thread.daemon = True
+        thread.start()
+
+    def cached_raw_trades(self, params):
+        """params 为 [用户账号, 股票账户, Cookie, 开始日期, 结束日期]；与上次获取时的输入一致才返回缓存的交易记录"""
+        user_id, fund_key, _, start_date, end_date = params
+        if self.last_raw_key != (user_id, fund_key, start_date, end_date):
+            return None
+        return self.last_raw_trades
+
+    def run_watch(self, watcher, raw_trades, interval):
+        """先用已有的交易记录（没有时完整获取一次）建立各分组的未平仓状态，再开始轮询"""
+        try:
+            if raw_trades is None:
+                log_messages = []
+                watcher.stock_name_map = fetch_stock_names(watcher.client, log_messages)
+                raw_trades = fetch_trades(watcher.client, log_messages, page_cap=DEFAULT_PAGE_CAP)
+                self.root.after(0, self.log_sink.write_many, log_messages)
+            result = watcher.seed(raw_trades)
+            if result is not None:
+                self.root.after(0, self.apply_watch_update, watcher, result, True)
+            watcher.start(interval,
+                          on_update=lambda update: self.root.after(0, self.apply_watch_update, watcher, update),
+                          on_error=lambda e: self.root.after(0, self.log_message, f"盯盘获取数据出错: {e}"))
+        except Exception as e:
+            self.root.after(0, self.log_message, f"盯盘初始化出错: {e}")
+            self.root.after(0, self.stop_watch)
+
+    def stop_watch(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.watch_button.config(text="开始盯盘")
+
+    def apply_watch_update(self, watcher, result, seeded=False):
+        """把一次增量匹配的结果原地更新到各表格，只更新受影响的行"""
+        if watcher is not self.watcher:
+            # 已停止或已被新的盯盘替换
+            return
+        (account_month_df, stock_summary_df, stock_detail_df, new_details_df), changed, rebuilt, new_count, rollup = result
+        # 盯盘建立状态时会替换全部明细，快照中尚未读取的明细不再需要
+        self.pending_snapshot = None
+        self.account_month_df = account_month_df
+        self.stock_summary_df = stock_summary_df
+        self.stock_detail_df = stock_detail_df
+
+        changed_months = {(account_name, str(month)) for account_name, _, month in changed}
+        changed_stocks = {(account_name, stock_code, str(month)) for account_name, stock_code, month in changed}
+        def rows_for(df, keys, columns):
+            if df is None or df.empty:
+                return df
+            mask = [key in keys for key in zip(*(df[col] for col in columns))]
+            return df[mask]
+
+        self.table_manager.upsert_rows("account_month", rows_for(account_month_df, changed_months, ['account_name', 'month']))
+        self.table_manager.upsert_rows("stock_detail", rows_for(stock_detail_df, changed_stocks, ['account_name', 'stock_code', 'month']))
+
+        self.rollup = rollup
+        self.update_stock_summary_controls()
+        selected_account = self.stock_summary_controls['account_var'].get()
+        selected_month = self.stock_summary_controls['month_var'].get()
+        summary_keys = {key for key in changed_stocks
+                        if selected_account in ("全部", key[0]) and selected_month in ("全部", key[2])}
+        self.table_manager.upsert_rows("stock_summary", rows_for(stock_summary_df, summary_keys, ['account_name', 'stock_code', 'month']))
+        self.show_pivot_view()
+
+        if isinstance(self.details_df, DetailsStore):
+            if not seeded:
+                self.log_message("明细已写入磁盘，盯盘期间新增的匹配明细不追加到明细页。")
+        elif seeded or self.details_df is None:
+            self.details_df = new_details_df
+        else:
+            # 整组重算的分组先去掉旧明细，再追加本次产生的明细
+            details_df = self.details_df
+            if rebuilt and not details_df.empty:
+                rebuilt_keys = {(account_name, stock_code, str(month)) for account_name, stock_code, month in rebuilt}
+                keep = [key not in rebuilt_keys for key in zip(details_df['account_name'], details_df['stock_code'], details_df['month'])]
+                details_df = details_df[keep]
+            self.details_df = pd.concat([details_df, new_details_df], ignore_index=True) if not new_details_df.empty else details_df
+        self.details_sorted = None
+        self.show_details_page()
+
+        if not seeded:
+            self.log_message(f"盯盘：新增 {new_count} 条成交，更新 {len(changed)} 个分组。")
+
     def start_api_analysis(self):
         user_id = self.api_controls['user_id_var'].get().strip()
         fund_key = self.api_controls['fund_key_var'].get().strip()
@@ -218,186 +470,397 @@ class GridProfitApp:
             messagebox.showwarning("警告", "请填写所有API接口参数。")
             return
 
+        matching_policy = self.api_controls['policy_labels'][self.api_controls['policy_var'].get()]
+        try:
+            grid_step = float(self.api_controls['grid_step_var'].get().strip() or 0) or None
+        except ValueError:
+            messagebox.showwarning("警告", "网格步长必须是数字。")
+            return
+
+        # 同一时间只允许一个分析任务
+        if self.current_job is not None and self.current_job.running:
+            messagebox.showwarning("警告", "已有分析任务正在运行，请等待完成或先取消。")
+            return
+
         self.log_message("开始从接口获取数据...")
         self.clear_results()
         self.clear_button.config(state=tk.DISABLED)
 
+        profile_enabled = self.api_controls['profile_var'].get()
+        self.cancel_button.config(state=tk.NORMAL)
+        self.update_progress("开始分析", 0)
+
+        use_cache = self.api_controls['use_cache_var'].get()
+        window_days = 7 if self.api_controls['streaming_var'].get() else None
+        spill_details = self.api_controls['spill_details_var'].get()
+        partitioned = self.api_controls['partitioned_var'].get()
+        service_url = self.api_controls['service_url_var'].get().strip()
+        self.last_run_params = {'user_id': user_id, 'fund_key': fund_key, 'start_date': start_date, 'end_date': end_date,
+                                'matching_policy': matching_policy, 'grid_step': grid_step, 'window_days': window_days}
         import threading
-        thread = threading.Thread(target=self.run_api_analysis, args=(user_id, fund_key, cookie, start_date, end_date))
+        if service_url:
+            # 瘦客户端模式：任务提交给分析服务，相同的并发请求在服务端合并为一次计算
+            params = {'user_id': user_id, 'fund_key': fund_key, 'cookie': cookie,
+                      'start_date': start_date, 'end_date': end_date,
+                      'matching_policy': matching_policy, 'grid_step': grid_step,
+                      'window_days': window_days, 'page_cap': DEFAULT_PAGE_CAP}
+            self.tracer = None
+            self.current_job = RemoteAnalysisRunner(service_url, params, progress_callback=self.report_progress)
+            thread = threading.Thread(target=self.run_process_analysis, args=(self.current_job,))
+        elif self.api_controls['process_mode_var'].get():
+            # 独立进程模式：获取与分析在子进程中完成，界面线程只负责绑定结果
+            params = {'user_id': user_id, 'fund_key': fund_key, 'cookie': cookie,
+                      'start_date': start_date, 'end_date': end_date,
+                      'matching_policy': matching_policy, 'grid_step': grid_step,
+                      'cache_dir': DEFAULT_CACHE_DIR if use_cache else None,
+                      'window_days': window_days, 'page_cap': DEFAULT_PAGE_CAP,
+                      'spill_details': spill_details, 'partitioned': partitioned}
+            self.tracer = None
+            self.current_job = ProcessAnalysisRunner(params, progress_callback=self.report_progress, capture_profile=profile_enabled)
+            thread = threading.Thread(target=self.run_process_analysis, args=(self.current_job,))
+        else:
+            self.tracer = PerfTracer(capture_profile=profile_enabled, trace_memory=profile_enabled)
+            self.current_job = AnalysisJob(progress_callback=self.report_progress, tracer=self.tracer,
+                                           matching_policy=matching_policy, grid_step=grid_step,
+                                           cache=AnalysisCache() if use_cache else None,
+                                           window_days=window_days, page_cap=DEFAULT_PAGE_CAP,
+                                           spill_details=spill_details, partitioned=partitioned)
+            thread = threading.Thread(target=self.run_api_analysis, args=(self.current_job, user_id, fund_key, cookie, start_date, end_date))
         thread.daemon = True
         thread.start()
 
-    def run_api_analysis(self, user_id, fund_key, cookie, start_date, end_date):
+    def cancel_api_analysis(self):
+        if self.current_job is not None and self.current_job.running:
+            self.current_job.cancel()
+            self.log_message("已请求取消分析任务，将在下一个检查点停止...")
+
+    def report_progress(self, label, percent):
+        """供工作线程调用，把进度转交给界面线程"""
+        self.root.after(0, self.update_progress, label, percent)
+
+    def update_progress(self, label, percent):
+        self.progress_var.set(percent)
+        self.progress_label.config(text=label)
+
+    def run_api_analysis(self, job, user_id, fund_key, cookie, start_date, end_date):
+        tracer = job.tracer
+        tracer.start()
         try:
             log_messages = ["正在通过API获取交易数据..."]
-            client = APIClient(user_id, fund_key, cookie, start_date, end_date)
-            
-            # 1. 获取交易历史
-            trade_response = client.get_stock_history()
-            
-            if trade_response.status_code == 200:
-                log_messages.append("交易数据API请求成功。")
-                trade_data = trade_response.json()
-                
-                if trade_data.get('error_code') != '0':
-                    error_msg = trade_data.get('error_msg', '未知API错误')
-                    raise Exception(f"交易数据API返回错误: {error_msg}")
-
-                raw_trades = None
-                if 'ex_data' in trade_data and 'list' in trade_data['ex_data']:
-                    raw_trades = trade_data['ex_data']['list']
-                elif 'data' in trade_data and 'list' in trade_data['data']:
-                    raw_trades = trade_data['data']['list']
-                
-                if not raw_trades:
-                    raise Exception("API返回交易数据中未找到交易记录列表。")
-
-                log_messages.append(f"从API获取到 {len(raw_trades)} 条交易记录。")
-                
-                # 2. 获取股票持仓信息（用于股票名称）
-                log_messages.append("正在通过API获取股票持仓信息...")
-                position_response = client._get_stock_position()
-                stock_name_map = {}
-                if position_response.status_code == 200:
-                    log_messages.append("股票持仓信息API请求成功。")
-                    position_data = position_response.json()
-                    if position_data.get('error_code') == '0':
-                        positions = position_data.get('ex_data', {}).get('position', [])
-                        for pos in positions:
-                            code = pos.get('code')
-                            name = pos.get('name')
-                            if code and name:
-                                stock_name_map[code] = name
-                        log_messages.append(f"获取到 {len(stock_name_map)} 支股票的名称。")
-                    else:
-                        error_msg = position_data.get('error_msg', '未知API错误')
-                        log_messages.append(f"股票持仓信息API返回错误: {error_msg}")
-                else:
-                    log_messages.append(f"股票持仓信息API请求失败，状态码: {position_response.status_code}")
-                
-                # 3. 调用分析函数 (传递 stock_name_map)
-                account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages = analyze_trades_from_data(raw_trades, log_messages, stock_name_map)
-                # 4. 传递 details_df 而不是 details_text
-                self.root.after(0, self.display_results, account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map)
-            else:
-                raise Exception(f"交易数据API请求失败，状态码: {trade_response.status_code}")
-                
+            client = APIClient(user_id, fund_key, cookie, start_date, end_date, tracer=tracer)
+            account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map = job.run(client, log_messages)
+            self.last_raw_trades = job.raw_trades
+            self.last_raw_key = (user_id, fund_key, start_date, end_date)
+            self.rollup = job.rollup
+            tracer.stop()
+            # 传递 details_df 而不是 details_text
+            self.root.after(0, self.display_results, account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map)
+        except JobCancelled as e:
+            self.root.after(0, self.log_message, f"{e}")
+            self.root.after(0, self.update_progress, "已取消", 0)
         except Exception as e:
             self.root.after(0, self.log_message, f"API获取数据或分析出错: {e}")
+            self.root.after(0, self.update_progress, "出错", 0)
         finally:
+            job.finish()
+            tracer.stop()
             self.root.after(0, lambda: self.clear_button.config(state=tk.NORMAL))
+            self.root.after(0, lambda: self.cancel_button.config(state=tk.DISABLED))
 
-    def generate_details_text(self, details_df):
-        """
-        根据 details_df 生成用于显示的文本。"""
-        result_text = ""
-        result_text += "="*150 + "\n"
-        result_text += "详细的交易匹配记录 (收益 = 卖出moneychg + 买入moneychg)\n"
-        result_text += "="*150 + "\n"
-        if details_df is not None and not details_df.empty:
-            # 为了文本显示，交换买/卖时间的含义 (如果需要，取决于 details_df 的结构)
-            # 假设 details_df 已经是最终格式
-            details_for_text = details_df.copy()
-            
-            # 构建表头，考虑是否有 stock_name
-            if 'stock_name' in details_for_text.columns:
-                header = f"{'账户名称':<25} {'月份':<10} {'股票名称':<15} {'股票代码':<10} {'卖出时间':<20} {'买入时间':<20} {'匹配数量':<8} {'买入金额变化':<15} {'卖出金额变化':<15} {'收益':<12}\n"
-                separator_len = 170
-            else:
-                header = f"{'账户名称':<25} {'月份':<10} {'股票代码':<10} {'卖出时间':<20} {'买入时间':<20} {'匹配数量':<8} {'买入金额变化':<15} {'卖出金额变化':<15} {'收益':<12}\n"
-                separator_len = 150
-                
-            result_text += header
-            result_text += "-" * separator_len + "\n"
-            
-            # 确保排序列存在
-            sort_cols = ['account_name', 'month', 'stock_code']
-            if 'stock_name' in details_for_text.columns:
-                sort_cols.insert(2, 'stock_name')
-                
-            for _, row in details_for_text.sort_values(sort_cols).iterrows():
-                # 将Period类型的month转换为字符串
-                month_str = str(row['month']) if pd.notna(row['month']) else ""
-                
-                if 'stock_name' in row:
-                     result_text += f"{row['account_name']:<25} {month_str:<10} {row['stock_name']:<15} {row['stock_code']:<10} " \
-                                   f"{row['sell_datetime'].strftime('%Y-%m-%d %H:%M:%S'):<20} {row['buy_datetime'].strftime('%Y-%m-%d %H:%M:%S'):<20} " \
-                                   f"{row['matched_quantity']:<8} {row['buy_moneychg']:<15.2f} {row['sell_moneychg']:<15.2f} {row['profit']:<12.2f}\n"
-                else:
-                     result_text += f"{row['account_name']:<25} {month_str:<10} {row['stock_code']:<10} " \
-                                   f"{row['sell_datetime'].strftime('%Y-%m-%d %H:%M:%S'):<20} {row['buy_datetime'].strftime('%Y-%m-%d %H:%M:%S'):<20} " \
-                                   f"{row['matched_quantity']:<8} {row['buy_moneychg']:<15.2f} {row['sell_moneychg']:<15.2f} {row['profit']:<12.2f}\n"
+    def run_process_analysis(self, runner):
+        try:
+            account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map, tracer = runner.run()
+            # 子进程中的各阶段统计随结果一起返回，界面阶段继续记录到同一个 tracer
+            self.tracer = tracer
+            self.rollup = runner.rollup
+            self.root.after(0, self.display_results, account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map)
+        except JobCancelled as e:
+            self.root.after(0, self.log_message, f"{e}")
+            self.root.after(0, self.update_progress, "已取消", 0)
+        except Exception as e:
+            self.root.after(0, self.log_message, f"API获取数据或分析出错: {e}")
+            self.root.after(0, self.update_progress, "出错", 0)
+        finally:
+            self.root.after(0, lambda: self.clear_button.config(state=tk.NORMAL))
+            self.root.after(0, lambda: self.cancel_button.config(state=tk.DISABLED))
+
+    def start_sweep(self):
+        """对最近获取的交易数据评估所有匹配规则、分组周期以及账户、股票组合"""
+        params = [self.api_controls[key].get().strip() for key in ['user_id_var', 'fund_key_var', 'cookie_var', 'start_date_var', 'end_date_var']]
+        if self.cached_raw_trades(params) is None and not all(params):
+            messagebox.showwarning("警告", "请先获取数据或填写所有API接口参数。")
+            return
+        try:
+            grid_step = float(self.api_controls['grid_step_var'].get().strip() or 0) or None
+        except ValueError:
+            messagebox.showwarning("警告", "网格步长必须是数字。")
+            return
+
+        self.sweep_button.config(state=tk.DISABLED)
+        self.log_message("开始参数扫描...")
+        import threading
+        thread = threading.Thread(target=self.run_sweep, args=(params, grid_step))
+        thread.daemon = True
+        thread.start()
+
+    def run_sweep(self, params, grid_step):
+        try:
+            log_messages = []
+            raw_trades = self.cached_raw_trades(params)
+            if raw_trades is None:
+                raw_trades = fetch_trades(APIClient(*params), log_messages, page_cap=DEFAULT_PAGE_CAP)
+                self.last_raw_trades = raw_trades
+                self.last_raw_key = (params[0], params[1], params[3], params[4])
+            # 除全部账户/全部股票外，每个账户、每只股票各作为一个子集
+            accounts = sorted({str(trade.get('account_name')) for trade in raw_trades})
+            stocks = sorted({str(trade.get('stock_code')) for trade in raw_trades})
+            account_subsets = [None] + [[account] for account in accounts] if len(accounts) > 1 else [None]
+            stock_subsets = [None] + [[stock] for stock in stocks] if len(stocks) > 1 else [None]
+            scenarios = build_scenarios(account_subsets=account_subsets, stock_subsets=stock_subsets, grid_step=grid_step)
+            sweep_df = run_sweep(raw_trades, scenarios, log_messages)
+            self.root.after(0, self.display_sweep_results, sweep_df, log_messages)
+        except Exception as e:
+            self.root.after(0, self.log_message, f"参数扫描出错: {e}")
+        finally:
+            self.root.after(0, lambda: self.sweep_button.config(state=tk.NORMAL))
+
+    def display_sweep_results(self, sweep_df, log_messages):
+        self.log_sink.write_many(log_messages)
+        if sweep_df is not None and not sweep_df.empty:
+            self.table_manager.populate_table("sweep", sweep_df)
+            self.notebook.select(self.sweep_frame)
+        else:
+            self.log_message("参数扫描结果为空。")
+
+    def details_page_count(self):
+        if self.details_df is None or self.details_df.empty:
+            return 1
+        return (len(self.details_df) + DETAILS_PAGE_ROWS - 1) // DETAILS_PAGE_ROWS
+
+    def show_details_page(self):
+        """分块渲染当前页的明细。写入磁盘的明细只读取当前页的行"""
+        order = None
+        if self.details_df is not None and not self.details_df.empty:
+            if self.details_sorted is None:
+                self.details_sorted = report_sort_order(self.details_df)
+            start = self.details_page * DETAILS_PAGE_ROWS
+            order = self.details_sorted[start:start + DETAILS_PAGE_ROWS]
+
+        self.details_text.config(state=tk.NORMAL)
+        self.details_text.delete(1.0, tk.END)
+        for text in render_details_report(self.details_df, chunk_rows=500, order=order):
+            self.details_text.insert(tk.END, text)
+        self.details_text.config(state=tk.DISABLED)
+
+        total = 0 if self.details_df is None else len(self.details_df)
+        self.details_page_label.config(text=f"第 {self.details_page + 1}/{self.details_page_count()} 页，共 {total} 条")
+
+    def ensure_details_loaded(self):
+        """从会话快照打开的结果，在需要明细时才读取明细帧"""
+        if self.pending_snapshot is None:
+            return
+        snapshot = self.pending_snapshot
+        self.pending_snapshot = None
+        try:
+            with trace_stage(self.tracer, 'snapshot_details', snapshot.details_rows()):
+                self.details_df = snapshot.load_details()
+        except Exception as e:
+            self.log_message(f"读取会话快照中的匹配明细时出错: {e}")
+            return
+        self.details_page = 0
+        self.details_sorted = None
+        self.show_details_page()
+
+    def on_tab_changed(self, event=None):
+        if self.pending_snapshot is not None and self.notebook.select() == str(self.details_frame):
+            self.ensure_details_loaded()
+
+    def save_session(self):
+        """把当前结果、股票名称和运行参数保存为会话快照（在后台线程中写入）"""
+        if all(df is None or df.empty for df in [self.account_month_df, self.stock_summary_df, self.stock_detail_df]):
+            messagebox.showinfo("提示", "没有可保存的分析结果。")
+            return
+        output_file = filedialog.asksaveasfilename(defaultextension=SNAPSHOT_EXTENSION, initialfile=f"网格交易会话{SNAPSHOT_EXTENSION}",
+                                                   filetypes=[("会话快照", f"*{SNAPSHOT_EXTENSION}")])
+        if not output_file:
+            return
+        self.ensure_details_loaded()
+        frames = (self.account_month_df, self.stock_summary_df, self.stock_detail_df, self.details_df)
+        stock_name_map = self.stock_name_map
+        params = self.last_run_params
+        rollup = self.rollup
+        import threading
+        def run():
+            success, msg = save_snapshot(output_file, frames, stock_name_map, params, rollup)
+            self.root.after(0, self.log_message, msg)
+        threading.Thread(target=run, daemon=True).start()
+
+    def open_session(self):
+        """打开会话快照：只读取三个汇总帧，明细在切换到明细标签页时读取"""
+        if self.current_job is not None and self.current_job.running:
+            messagebox.showwarning("警告", "已有分析任务正在运行，请等待完成或先取消。")
+            return
+        input_file = filedialog.askopenfilename(filetypes=[("会话快照", f"*{SNAPSHOT_EXTENSION}")])
+        if not input_file:
+            return
+        self.clear_results()
+        try:
+            snapshot = load_snapshot(input_file)
+            account_month_df, stock_summary_df, stock_detail_df = snapshot.summary_frames()
+            rollup = snapshot.load_rollup()
+        except Exception as e:
+            self.log_message(f"打开会话快照出错: {e}")
+            return
+
+        # 恢复运行参数（Cookie 不保存，需要重新获取数据时另行填写）
+        params = snapshot.params
+        for key in ['user_id', 'fund_key', 'start_date', 'end_date']:
+            if params.get(key):
+                self.api_controls[f'{key}_var'].set(params[key])
+        policy = MATCHING_POLICIES.get(params.get('matching_policy'))
+        if policy is not None:
+            self.api_controls['policy_var'].set(policy.label)
+        if params.get('grid_step'):
+            self.api_controls['grid_step_var'].set(f"{params['grid_step']:g}")
+        self.last_run_params = params
+        self.last_raw_trades = None
+
+        self.tracer = None
+        self.rollup = rollup
+        self.pending_snapshot = snapshot
+        log_messages = [f"已打开会话快照 '{input_file}'（保存于 {snapshot.saved_at}）。"]
+        self.display_results(account_month_df, stock_summary_df, stock_detail_df, None, log_messages,
+                             snapshot.stock_name_map, export_results=False)
+        if self.notebook.select() == str(self.details_frame):
+            self.ensure_details_loaded()
         else:
-            result_text += "无匹配记录。\n"
-        return result_text
+            self.details_page_label.config(text=f"共 {snapshot.details_rows()} 条，切换到本标签页时加载")
 
-    def display_results(self, account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map):
+    def export_details_text(self):
+        """把全部明细逐块写入文本文件（在后台线程中执行）"""
+        self.ensure_details_loaded()
+        if self.details_df is None or self.details_df.empty:
+            messagebox.showinfo("提示", "没有可导出的匹配明细。")
+            return
+        output_file = filedialog.asksaveasfilename(defaultextension=".txt", initialfile="交易匹配明细.txt",
+                                                   filetypes=[("文本文件", "*.txt")])
+        if not output_file:
+            return
+        details_df = self.details_df
+        import threading
+        def run():
+            success, msg = write_details_report(details_df, output_file)
+            self.root.after(0, self.log_message, msg)
+        threading.Thread(target=run, daemon=True).start()
+
+    def change_details_page(self, step):
+        page = min(max(self.details_page + step, 0), self.details_page_count() - 1)
+        if page != self.details_page:
+            self.details_page = page
+            self.show_details_page()
+
+    def display_results(self, account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map, export_results=True):
         """
         展示分析结果。
         新增 stock_name_map 参数，虽然主要在 analyze_trades_from_data 中用了，
         但保留参数以备将来可能需要。
         现在接收 details_df 而不是 details_text。
+        export_results 为 False 时（打开会话快照）不重新导出 Excel。
         """
         self.account_month_df = account_month_df
         self.stock_summary_df = stock_summary_df
         self.stock_detail_df = stock_detail_df
         # 存储 details_df
         self.details_df = details_df 
+        self.stock_name_map = stock_name_map
+        tracer = self.tracer
         
-        if self.account_month_df is not None and not self.account_month_df.empty:
-            self.table_manager.populate_table("account_month", self.account_month_df)
-        else:
-            self.log_message("账户月度汇总数据为空。")
+        with trace_stage(tracer, 'populate_tables') as rec:
+            if self.account_month_df is not None and not self.account_month_df.empty:
+                self.table_manager.populate_table("account_month", self.account_month_df)
+            else:
+                self.log_message("账户月度汇总数据为空。")
 
-        if self.stock_summary_df is not None and not self.stock_summary_df.empty:
-            self.update_stock_summary_controls()
-            self.table_manager.populate_table("stock_summary", self.stock_summary_df)
-        else:
-            self.log_message("股票汇总数据为空。")
+            if self.stock_summary_df is not None and not self.stock_summary_df.empty:
+                self.update_stock_summary_controls()
+                self.table_manager.populate_table("stock_summary", self.stock_summary_df)
+            else:
+                self.log_message("股票汇总数据为空。")
 
-        if self.stock_detail_df is not None and not self.stock_detail_df.empty:
-            self.table_manager.populate_table("stock_detail", self.stock_detail_df)
-        else:
-            self.log_message("股票明细数据为空。")
+            if self.stock_detail_df is not None and not self.stock_detail_df.empty:
+                self.table_manager.populate_table("stock_detail", self.stock_detail_df)
+            else:
+                self.log_message("股票明细数据为空。")
 
-        # 重新生成 details_text 用于显示
-        details_text = self.generate_details_text(self.details_df)
-        self.details_text.config(state=tk.NORMAL)
-        self.details_text.delete(1.0, tk.END)
-        self.details_text.insert(tk.END, details_text)
-        self.details_text.config(state=tk.DISABLED)
+            self.show_pivot_view()
+            rec['rows'] = sum(len(df) for df in [account_month_df, stock_summary_df, stock_detail_df] if df is not None)
 
-        for msg in log_messages:
-            self.log_message(msg)
-            
+        # 重新生成 details_text 用于显示（只渲染第一页）
+        with trace_stage(tracer, 'render_details', 0 if details_df is None else len(details_df)):
+            self.details_page = 0
+            self.details_sorted = None
+            self.show_details_page()
+
+        self.log_sink.write_many(log_messages)
+        if not export_results:
+            self.update_progress("完成", 100)
+            return
         self.log_message("分析完成。")
 
         # 保存结果到Excel (现在传递 details_df)
         if any(df is not None and not df.empty for df in [account_month_df, stock_summary_df, stock_detail_df, details_df]):
             try:
-                output_file = '网格交易收益分析结果.xlsx'
-                # 调用修改后的 save function，传递 details_df
-                success, save_msg = save_results_to_excel(account_month_df, stock_summary_df, stock_detail_df, details_df, output_file)
+                with trace_stage(tracer, 'excel_export'):
+                    if self.api_controls['partition_export_var'].get():
+                        # 每个 (账户, 月份) 一个工作簿，只重写结果有变化的分区；只在本次分析的日期区间内删除过期分区
+                        run_params = self.last_run_params or {}
+                        date_range = (run_params['start_date'], run_params['end_date']) if run_params.get('start_date') and run_params.get('end_date') else None
+                        success, save_msg = save_results_partitioned(account_month_df, stock_summary_df, stock_detail_df, details_df,
+                                                                     DEFAULT_PARTITION_DIR, date_range)
+                    else:
+                        output_file = '网格交易收益分析结果.xlsx'
+                        # 调用修改后的 save function，传递 details_df
+                        success, save_msg = save_results_to_excel(account_month_df, stock_summary_df, stock_detail_df, details_df, output_file)
                 self.log_message(save_msg)
             except Exception as e:
                 self.log_message(f"保存Excel时出错3: {e}")
 
+        self.update_progress("完成", 100)
+        self.report_performance()
+
+    def report_performance(self):
+        """在运行日志中输出性能统计摘要，并按需写入 JSON 追踪文件"""
+        if self.tracer is None:
+            return
+        for line in self.tracer.summary_lines():
+            self.log_message(line)
+        if self.api_controls['save_trace_var'].get():
+            trace_file = '网格交易性能追踪.json'
+            success, trace_msg = self.tracer.save_json(trace_file)
+            self.log_message(trace_msg)
+
     def clear_results(self):
+        self.stop_watch()
         self.table_manager.clear_tables()
 
         self.details_text.config(state=tk.NORMAL)
         self.details_text.delete(1.0, tk.END)
         self.details_text.config(state=tk.DISABLED)
+        self.details_page_label.config(text="")
         
         # 同时清空运行日志
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.delete(1.0, tk.END)
-        self.log_text.config(state=tk.DISABLED)
+        self.log_sink.clear()
         
         self.account_month_df = None
         self.stock_summary_df = None
         self.stock_detail_df = None
+        if isinstance(self.details_df, DetailsStore):
+            # 删除明细的临时文件
+            self.details_df.close()
         self.details_df = None # 清空 details_df
+        self.details_sorted = None
+        self.pending_snapshot = None
+        self.rollup = None
         
         if 'account_var' in self.stock_summary_controls:
             self.stock_summary_controls['account_var'].set("全部")
@@ -409,13 +872,19 @@ class GridProfitApp:
         # 不再在日志中显示"结果已清空"消息，因为日志本身已被清空
 
     def log_message(self, message):
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state=tk.DISABLED)
+        """写入运行日志，可以在任意线程中调用"""
+        self.log_sink.write(message)
+
+    def on_close(self):
+        self.stop_watch()
+        self.log_sink.close()
+        self.root.destroy()
 
 # --- 主程序入口 ---
 if __name__ == "__main__":
+    # 独立进程模式在打包成 exe 后也需要正常启动子进程
+    import multiprocessing
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = GridProfitApp(root)
     root.mainloop()
\ No newline at end of file
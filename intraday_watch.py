@@ -0,0 +1,202 @@
+import json
+import threading
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from api_client import extract_trade_list
+from data_processor import (
+    preprocess_trades,
+    create_matching_policy,
+    match_sorted_trades,
+    build_result_frames,
+    DEFAULT_MATCHING_POLICY
+)
+
+DEFAULT_WATCH_INTERVAL = 30
+
+
+def trade_identity(trade):
+    """
+    交易记录的标识：全部字段的规范化 JSON，同一笔成交在不同窗口中返回时标识相同。
+    同一时间、同价同量的两笔真实成交标识也相同，因此去重按标识计数，而不是当作集合。
+    """
+    return json.dumps(trade, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class _GroupState:
+    """一个 (账户, 股票, 月份) 分组的增量匹配状态：按时间排序的交易、未平仓批次和累计收益"""
+
+    def __init__(self, matching_policy, grid_step):
+        self.matching_policy = matching_policy
+        self.grid_step = grid_step
+        self.times = []
+        self.is_buy = []
+        self.moneychgs = []
+        self.quantities = []
+        self.reset()
+
+    def reset(self):
+        self.lots = create_matching_policy(self.matching_policy, self.grid_step)
+        self.matched = 0
+        self.total_profit = 0.0
+        self.pair_count = 0
+
+    def last_key(self):
+        return (self.times[-1], self.is_buy[-1]) if self.times else None
+
+    def add(self, times, is_buy, moneychgs, quantities):
+        """
+        追加已排序的新交易。新交易全部晚于已处理的交易时，只需从断点继续匹配；
+        否则（迟到的成交）整组重新匹配。返回 (是否整组重算, 新产生的匹配明细)。
+        """
+        rebuilt = bool(self.times) and (times[0], is_buy[0]) < self.last_key()
+        self.times.extend(times)
+        self.is_buy.extend(is_buy)
+        self.moneychgs.extend(moneychgs)
+        self.quantities.extend(quantities)
+        if rebuilt:
+            order = np.lexsort((self.is_buy, self.times))
+            for name in ('times', 'is_buy', 'moneychgs', 'quantities'):
+                values = getattr(self, name)
+                setattr(self, name, [values[i] for i in order])
+            self.reset()
+        return rebuilt, self.match()
+
+    def match(self):
+        details = []
+        for buy_index, sell_index, matched_quantity, buy_moneychg, sell_moneychg, profit in match_sorted_trades(
+                self.is_buy, self.moneychgs, self.quantities, self.lots, self.matched):
+            # 与 calculate_grid_profit_for_group 一致，交换了 buy_datetime 和 sell_datetime 的含义
+            details.append({
+                'sell_datetime': self.times[buy_index],
+                'buy_datetime': self.times[sell_index],
+                'matched_quantity': matched_quantity,
+                'buy_moneychg': buy_moneychg,
+                'sell_moneychg': sell_moneychg,
+                'profit': profit
+            })
+            self.total_profit += profit
+            self.pair_count += 1
+        self.matched = len(self.times)
+        return details
+
+
+class IntradayWatcher:
+    """
+    盘中盯盘：按固定间隔只获取最近一个时间窗口的交易，按交易标识去重后，
+    新成交与各分组保留的未平仓批次继续匹配，只有受影响的分组需要更新。
+    每次刷新的开销取决于新成交数量，而不是当月累计的交易量。
+    """
+
+    def __init__(self, client, stock_name_map=None, matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None):
+        self.client = client
+        self.stock_name_map = stock_name_map or {}
+        self.matching_policy = matching_policy
+        self.grid_step = grid_step
+        self.groups = {}
+        # 每个交易标识在此前任意一次响应中出现的最多次数
+        self.seen = Counter()
+        self.window_start = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def seed(self, raw_trades):
+        """用已获取的完整交易记录建立初始状态，返回 ingest 的结果"""
+        return self.ingest(raw_trades)
+
+    def ingest(self, trades):
+        """
+        处理一批交易记录（可与此前处理过的记录重复）。只与之前的响应去重：某个标识在本批中出现的次数
+        超过此前单次响应中出现的最多次数时，多出的记录才是新成交；同一批内标识相同的记录都是真实的成交。
+        返回 None（没有新成交），或 (结果帧, 受影响的分组键, 整组重算的分组键, 新成交条数, 汇总立方体)，
+        结果帧为 build_result_frames 的四个 DataFrame：汇总帧包含全部分组，明细帧只包含本次新产生的匹配。
+        """
+        new_trades = []
+        occurrences = Counter()
+        for trade in trades:
+            identity = trade_identity(trade)
+            occurrences[identity] += 1
+            if occurrences[identity] > self.seen[identity]:
+                new_trades.append(trade)
+        # 取两者的较大值：轮询窗口与之前的窗口重叠，同一笔成交会在多次响应中重复出现
+        self.seen |= occurrences
+        if not new_trades:
+            return None
+
+        df, _ = preprocess_trades(new_trades)
+        if df.empty:
+            return None
+
+        changed = set()
+        rebuilt = set()
+        new_details = []
+        for key, group in df.groupby(['account_name', 'stock_code', 'month']):
+            is_buy = (group['trade_type'] == '买入').to_numpy()
+            times = group['trans_datetime'].to_numpy()
+            order = np.lexsort((is_buy, times))
+            state = self.groups.setdefault(key, _GroupState(self.matching_policy, self.grid_step))
+            was_rebuilt, details = state.add(
+                list(times[order]), list(is_buy[order]),
+                list(group['moneychg'].to_numpy()[order]), list(group['quantity'].to_numpy()[order]))
+            account_name, stock_code, _ = key
+            for detail in details:
+                detail['stock_code'] = stock_code
+                detail['account_name'] = account_name
+            new_details.extend(details)
+            changed.add(key)
+            if was_rebuilt:
+                rebuilt.add(key)
+
+        summary_data = [
+            {'account_name': key[0], 'stock_code': key[1], 'month': key[2],
+             'total_profit': state.total_profit, 'trade_pair_count': state.pair_count}
+            for key, state in sorted(self.groups.items())
+        ]
+        *frames, rollup = build_result_frames(summary_data, new_details, [], self.stock_name_map)
+        return tuple(frames), changed, rebuilt, len(new_trades), rollup
+
+    def poll(self):
+        """获取最近的时间窗口（上次轮询的日期到今天）并处理其中的新成交"""
+        today = datetime.now().strftime('%Y%m%d')
+        start_date = self.window_start or today
+        response = self.client.get_stock_history(start_date, today)
+        if response.status_code != 200:
+            raise Exception(f"交易数据API请求失败，状态码: {response.status_code}")
+        records = extract_trade_list(response.json())
+        if records is None:
+            raise Exception("API返回交易数据中未找到交易记录列表。")
+        # 跨日运行时下一次从今天开始，前一天的成交已经取完
+        self.window_start = today
+        return self.ingest(records)
+
+    def start(self, interval, on_update, on_error=None):
+        """
+        在后台线程中按 interval 秒轮询。有新成交时调用 on_update(ingest 的结果)，
+        出错时调用 on_error(异常) 并继续轮询。
+        停止事件只在创建时建立、不会被重置：start 之前已调用过 stop 时不再启动轮询。
+        """
+        if self._stop_event.is_set():
+            return
+
+        def loop():
+            while not self._stop_event.is_set():
+                try:
+                    result = self.poll()
+                    if result is not None:
+                        on_update(result)
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+                self._stop_event.wait(interval)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,103 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import tkinter as tk
+from collections import deque
+from datetime import datetime
+
+DEFAULT_LOG_FILE = '网格交易运行日志.log'
+
+
+class LogSink:
+    """
+    运行日志缓冲区。任意线程都可以写入，界面线程按固定间隔把积累的消息一次性插入文本控件。
+    文本控件只保留最近 max_lines 行；设置 log_file 时完整历史由后台线程写入滚动日志文件。
+    """
+
+    def __init__(self, root, text_widget, max_lines=2000, flush_interval_ms=100,
+                 log_file=None, max_file_bytes=5 * 1024 * 1024, backup_count=3):
+        self.root = root
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.flush_interval_ms = flush_interval_ms
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._line_count = 0
+        self._logger = None
+        self._listener = None
+        if log_file:
+            self._setup_file_log(log_file, max_file_bytes, backup_count)
+        self._after_id = self.root.after(self.flush_interval_ms, self._flush)
+
+    def _setup_file_log(self, log_file, max_file_bytes, backup_count):
+        # 文件写入交给 QueueListener 的后台线程，调用方只做一次入队
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_file_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        log_queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self._listener.start()
+        self._logger = logging.getLogger(f"grid_calculator.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    def write(self, message):
+        """写入一条消息（线程安全）"""
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n"
+        with self._lock:
+            self._pending.append(line)
+        if self._logger is not None:
+            self._logger.info(message)
+
+    def write_many(self, messages):
+        """批量写入多条消息（线程安全）"""
+        timestamp = datetime.now().strftime('%H:%M:%S')
+        lines = [f"[{timestamp}] {message}\n" for message in messages]
+        with self._lock:
+            self._pending.extend(lines)
+        if self._logger is not None:
+            for message in messages:
+                self._logger.info(message)
+
+    def _flush(self):
+        """在界面线程中执行：一次插入所有待写消息，并裁剪超出上限的旧行"""
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+        if lines:
+            # 消息本身可能包含换行，按插入文本中的换行符计算控件的行数
+            text = ''.join(lines)
+            line_count = text.count('\n')
+            # 单次刷新超过上限时，只有最后 max_lines 行会留在控件中
+            if line_count > self.max_lines:
+                text = '\n'.join(text.split('\n')[-(self.max_lines + 1):])
+                line_count = self.max_lines
+            self.text_widget.config(state=tk.NORMAL)
+            self.text_widget.insert(tk.END, text)
+            self._line_count += line_count
+            excess = self._line_count - self.max_lines
+            if excess > 0:
+                self.text_widget.delete('1.0', f'{excess + 1}.0')
+                self._line_count -= excess
+            self.text_widget.see(tk.END)
+            self.text_widget.config(state=tk.DISABLED)
+        self._after_id = self.root.after(self.flush_interval_ms, self._flush)
+
+    def clear(self):
+        """清空控件中的日志和尚未刷新的消息（日志文件保留）"""
+        with self._lock:
+            self._pending.clear()
+        self.text_widget.config(state=tk.NORMAL)
+        self.text_widget.delete(1.0, tk.END)
+        self.text_widget.config(state=tk.DISABLED)
+        self._line_count = 0
+
+    def close(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
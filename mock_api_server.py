@@ -0,0 +1,263 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from api_client import STOCK_HISTORY_PATH, STOCK_POSITION_PATH
+
+DEFAULT_STOCKS = {
+    '600000': '浦发银行',
+    '000001': '平安银行',
+    '300750': '宁德时代',
+    '510300': '沪深300ETF',
+}
+DEFAULT_ACCOUNTS = ['模拟账户A', '模拟账户B']
+
+
+def generate_trades(count, start_date, end_date, accounts=None, stocks=None, seed=0, padding=0):
+    """
+    生成合成交易记录，字段与交易历史接口一致。
+    价格围绕一个基准随机游走，买卖交替出现，便于产生可匹配的交易对。
+    padding > 0 时每条记录附加一个该长度的备注字段，用于放大响应体积。
+    """
+    rng = random.Random(seed)
+    accounts = accounts or DEFAULT_ACCOUNTS
+    stocks = list(stocks or DEFAULT_STOCKS)
+    start = datetime.strptime(start_date, '%Y%m%d')
+    span = int((datetime.strptime(end_date, '%Y%m%d') + timedelta(days=1) - start).total_seconds())
+    prices = {code: 10 + rng.random() * 40 for code in stocks}
+
+    trades = []
+    for offset in sorted(rng.randrange(span) for _ in range(count)):
+        code = rng.choice(stocks)
+        prices[code] = max(1.0, prices[code] * (1 + rng.uniform(-0.03, 0.03)))
+        op = rng.choice((1, 2))
+        quantity = rng.choice((100, 200, 300, 500))
+        amount = round(prices[code] * quantity, 2)
+        trade = {
+            'account_name': rng.choice(accounts),
+            'stock_code': code,
+            'stock_name': DEFAULT_STOCKS.get(code, code),
+            'transDateTime': (start + timedelta(seconds=offset)).strftime('%Y%m%d%H%M%S'),
+            'moneychg': str(-amount if op == 1 else amount),
+            'trans_count': str(quantity if op == 1 else -quantity),
+            'op': str(op),
+        }
+        if padding:
+            trade['remark'] = 'x' * padding
+        trades.append(trade)
+    return trades
+
+
+def load_fixture(path):
+    """读取录制的接口响应 (JSON)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class TokenBucket:
+    """令牌桶限流：每秒补充 rate 个令牌，最多积累 burst 个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class MockAPIServer:
+    """
+    交易接口的本地替身服务器。回放录制的或合成的 stock_history_query / stock_position 响应，
+    可配置响应延迟、错误率、限流和单次返回上限，用于离线测试和压测 APIClient。
+    交易历史请求会按请求中的 start_date / end_date 过滤记录，分段获取时行为与真实接口一致。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, history_fixture=None, position_fixture=None,
+                 trade_count=2000, start_date=None, end_date=None, padding=0, seed=0,
+                 latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit=None, burst=None, page_cap=None):
+        today = datetime.now()
+        self.start_date = start_date or today.replace(day=1).strftime('%Y%m%d')
+        self.end_date = end_date or today.strftime('%Y%m%d')
+        if history_fixture:
+            self.trades = _history_records(load_fixture(history_fixture))
+        else:
+            self.trades = generate_trades(trade_count, self.start_date, self.end_date, seed=seed, padding=padding)
+        # 按成交时间排序后，日期过滤只需要比较前 8 位
+        self.trades.sort(key=lambda trade: str(trade.get('transDateTime', '')))
+        if position_fixture:
+            self.position_response = load_fixture(position_fixture)
+        else:
+            self.position_response = {
+                'error_code': '0',
+                'error_msg': '',
+                'ex_data': {'position': [{'code': code, 'name': name} for code, name in DEFAULT_STOCKS.items()]},
+            }
+
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.page_cap = page_cap
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0, 'bytes': 0}
+        self._stats_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count(self, key, size=0):
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats[key] += 1
+            self.stats['bytes'] += size
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random()
+
+    def history_response(self, form):
+        start_date = form.get('start_date') or self.start_date
+        end_date = form.get('end_date') or self.end_date
+        records = [trade for trade in self.trades
+                   if start_date <= str(trade.get('transDateTime', ''))[:8] <= end_date]
+        if self.page_cap:
+            records = records[:self.page_cap]
+        return {'error_code': '0', 'error_msg': '', 'ex_data': {'list': records}}
+
+    def handle(self, path, form):
+        """返回 (状态码, 响应对象)"""
+        if self.bucket is not None and not self.bucket.acquire():
+            return 429, {'error_code': '429', 'error_msg': '请求过于频繁'}
+        delay = self.latency_ms + (self._random() * self.jitter_ms if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if self.error_rate and self._random() < self.error_rate:
+            return 500, {'error_code': '500', 'error_msg': '模拟服务端错误'}
+        if path == STOCK_HISTORY_PATH:
+            return 200, self.history_response(form)
+        if path == STOCK_POSITION_PATH:
+            return 200, self.position_response
+        return 404, {'error_code': '404', 'error_msg': f'未知接口: {path}'}
+
+
+def _history_records(fixture):
+    """录制文件可以是完整的接口响应，也可以直接是交易记录列表"""
+    if isinstance(fixture, list):
+        return list(fixture)
+    for key in ('ex_data', 'data'):
+        if key in fixture and 'list' in fixture[key]:
+            return list(fixture[key]['list'])
+    raise Exception("录制文件中未找到交易记录列表。")
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8') if length else ''
+            form = {key: values[-1] for key, values in parse_qs(body, keep_blank_values=True).items()}
+            status, payload = server.handle(self.path.split('?', 1)[0], form)
+            content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            if status == 200:
+                server._count('ok', len(content))
+            elif status == 429:
+                server._count('rate_limited', len(content))
+            else:
+                server._count('errors', len(content))
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            if status == 429:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            # 压测时请求量很大，不输出访问日志
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="交易接口本地替身服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--history-fixture', help="录制的交易历史响应 (JSON)")
+    parser.add_argument('--position-fixture', help="录制的持仓响应 (JSON)")
+    parser.add_argument('--trades', type=int, default=2000, help="未提供录制文件时合成的交易记录数")
+    parser.add_argument('--start-date', help="合成数据的开始日期 (YYYYMMDD)")
+    parser.add_argument('--end-date', help="合成数据的结束日期 (YYYYMMDD)")
+    parser.add_argument('--padding', type=int, default=0, help="每条记录附加的填充字节数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 的概率 (0~1)")
+    parser.add_argument('--rate-limit', type=float, help="每秒允许的请求数，超出返回 429")
+    parser.add_argument('--burst', type=int, help="限流令牌桶容量")
+    parser.add_argument('--page-cap', type=int, help="单次请求最多返回的记录数")
+    args = parser.parse_args()
+
+    server = MockAPIServer(
+        host=args.host, port=args.port,
+        history_fixture=args.history_fixture, position_fixture=args.position_fixture,
+        trade_count=args.trades, start_date=args.start_date, end_date=args.end_date,
+        padding=args.padding, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, rate_limit=args.rate_limit, burst=args.burst, page_cap=args.page_cap
+    )
+    print(f"替身服务器已启动: {server.base_url} ({len(server.trades)} 条交易记录)")
+    print(f"设置环境变量 GRID_API_BASE_URL={server.base_url} 后启动程序即可离线使用。")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"请求统计: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data_processor import (
+    preprocess_trades,
+    match_group,
+    build_result_frames,
+    DEFAULT_MATCHING_POLICY,
+    MATCHING_POLICIES
+)
+from details_store import DetailsWriter
+from perf_trace import trace_stage
+
+# 溢写到磁盘的预处理交易：只保留匹配需要的列
+_TRADE_DTYPE = np.dtype([('time', 'datetime64[ns]'), ('is_buy', '?'), ('moneychg', 'f8'), ('quantity', 'f8')])
+
+
+class PartitionSpill:
+    """
+    按 (账户, 股票) 把预处理后的交易追加写入磁盘，每个分区一个文件。
+    写入按批进行，内存中只有当前批次。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {}
+        self.rows = {}
+        self.integral_quantity = True
+
+    def append(self, df):
+        """写入一批预处理后的交易 (preprocess_trades 的结果)"""
+        if df['quantity'].dtype.kind == 'f':
+            self.integral_quantity = False
+        for key, part in df.groupby(['account_name', 'stock_code'], sort=False):
+            records = np.empty(len(part), dtype=_TRADE_DTYPE)
+            records['time'] = part['trans_datetime'].to_numpy(dtype='datetime64[ns]')
+            records['is_buy'] = (part['trade_type'] == '买入').to_numpy()
+            records['moneychg'] = part['moneychg'].to_numpy(dtype=float)
+            records['quantity'] = part['quantity'].to_numpy(dtype=float)
+            path = self.paths.setdefault(key, os.path.join(self.directory, f"part_{len(self.paths)}.npy"))
+            with open(path, 'ab') as f:
+                np.save(f, records)
+            self.rows[key] = self.rows.get(key, 0) + len(part)
+
+    def read(self, key):
+        """读取一个分区的全部交易，按写入顺序拼接"""
+        chunks = []
+        with open(self.paths[key], 'rb') as f:
+            while True:
+                try:
+                    chunks.append(np.load(f))
+                except EOFError:
+                    break
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+    def partition_frame(self, key):
+        """把一个分区还原为 match_group 需要的 DataFrame"""
+        records = self.read(key)
+        account_name, stock_code = key
+        times = pd.DatetimeIndex(records['time'])
+        quantity = records['quantity']
+        return pd.DataFrame({
+            'account_name': account_name,
+            'stock_code': stock_code,
+            'trans_datetime': times,
+            'trade_type': np.where(records['is_buy'], '买入', '卖出'),
+            'moneychg': records['moneychg'],
+            'quantity': quantity.astype(np.int64) if self.integral_quantity else quantity,
+            'month': times.to_period('M'),
+        })
+
+
+def analyze_trades_partitioned(batches, log_messages, stock_name_map=None, tracer=None, job=None,
+                               matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None, spill_dir=None):
+    """
+    低内存的分区分析。batches 为交易记录列表的迭代器（例如按时间窗口分批获取的结果）。
+    每批预处理后按 (账户, 股票) 溢写到磁盘，全部到达后逐个分区读回、按月分组匹配；
+    匹配明细直接写入 DetailsWriter，内存中同时只有一个分区的交易。
+    结果与 analyze_trades_from_data 相同，交易匹配明细以 DetailsStore 返回。
+    返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages)。
+    """
+    policy_label = MATCHING_POLICIES[matching_policy].label
+    details_writer = None
+    try:
+        with tempfile.TemporaryDirectory(prefix='grid_partitions_', dir=spill_dir) as directory:
+            spill = PartitionSpill(directory)
+            raw_count = 0
+            valid_count = 0
+            log_messages.append("正在分批预处理交易数据并按账户、股票溢写到磁盘...")
+            with trace_stage(tracer, 'spill_partitions') as rec:
+                for batch in batches:
+                    if job is not None:
+                        # 只响应取消，进度由产出批次的一方上报
+                        job.checkpoint('spill')
+                    raw_count += len(batch)
+                    df, error_msg = preprocess_trades(batch)
+                    if error_msg and batch:
+                        log_messages.append(error_msg)
+                    if df.empty:
+                        continue
+                    valid_count += len(df)
+                    spill.append(df)
+                rec['rows'] = valid_count
+            log_messages.append(f"解析到 {raw_count} 条原始记录，预处理后得到 {valid_count} 条有效交易记录，"
+                                f"分为 {len(spill.paths)} 个 (账户, 股票) 分区。")
+            if not spill.paths:
+                log_messages.append("预处理后无有效交易记录。")
+                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), log_messages
+
+            log_messages.append(f"正在逐个分区进行交易匹配和收益计算 (匹配策略: {policy_label})...")
+            summary_data = []
+            details_writer = DetailsWriter()
+            keys = sorted(spill.paths)
+            with trace_stage(tracer, 'match', valid_count) as rec:
+                for index, key in enumerate(keys):
+                    if job is not None:
+                        job.checkpoint('match', index, len(keys))
+                    partition = spill.partition_frame(key)
+                    for month, group in partition.groupby('month', sort=True):
+                        summary_row, matched_trades = match_group((key[0], key[1], month), group, matching_policy, grid_step)
+                        summary_data.append(summary_row)
+                        details_writer.extend(matched_trades)
+                    del partition
+                rec['rows'] = len(details_writer)
+
+        *frames, rollup = build_result_frames(summary_data, details_writer, log_messages, stock_name_map, tracer)
+    except BaseException:
+        # 取消或出错时分区文件随临时目录删除，已写入的匹配明细也一并放弃
+        if details_writer is not None:
+            details_writer.abort()
+        raise
+    if job is not None:
+        job.rollup = rollup
+    return (*frames, log_messages)
@@ -0,0 +1,189 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    # Windows 没有 resource 模块，安装了 psutil 时改用它读取峰值工作集
+    RESOURCE_AVAILABLE = False
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+
+def rss_peak_kb():
+    """进程常驻内存 (RSS) 的历史峰值，单位 KB；无法获取时返回 None。开销只有一次系统调用，始终记录"""
+    if RESOURCE_AVAILABLE:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以字节为单位，Linux 以 KB 为单位
+        return peak / 1024 if sys.platform == 'darwin' else peak
+    if PSUTIL_AVAILABLE:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024
+    return None
+
+
+class PerfTracer:
+    """
+    性能追踪器，记录分析流程各阶段的耗时、CPU时间、行数、内存峰值以及每次API请求的延迟。
+    进程内存峰值 (RSS) 始终记录；按代码行统计的分配峰值需要开启 tracemalloc (trace_memory)。
+    """
+
+    def __init__(self, capture_profile=False, trace_memory=False, profile_top_n=30):
+        self.capture_profile = capture_profile
+        self.trace_memory = trace_memory
+        self.profile_top_n = profile_top_n
+        self.started_at = datetime.now()
+        self.stages = []
+        self.requests = []
+        self.profile_text = ""
+        self.memory_top = []
+        self._profiler = None
+        self._stack = []
+        self._owns_tracemalloc = False
+        self._stopped = False
+
+    # --- 剖析模式 (cProfile / tracemalloc) ---
+    def start(self):
+        """开启剖析模式。cProfile 只对调用 start 的线程生效。"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        if self.capture_profile and self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        """结束剖析模式，收集 cProfile 统计和 tracemalloc 分配热点。重复调用无副作用。"""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._profiler is not None:
+            self._profiler.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(self.profile_top_n)
+            self.profile_text = stream.getvalue()
+            self._profiler = None
+        if tracemalloc.is_tracing() and self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            for stat in snapshot.statistics('lineno')[:self.profile_top_n]:
+                self.memory_top.append({
+                    'location': str(stat.traceback[0]),
+                    'size_kb': round(stat.size / 1024, 1),
+                    'count': stat.count
+                })
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+                self._owns_tracemalloc = False
+
+    # --- 阶段与请求记录 ---
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        记录一个流程阶段。调用方可以在 with 块内设置 record['rows']。
+        rss_peak_kb 为阶段结束时进程 RSS 的历史峰值，rss_growth_kb 为该阶段把峰值抬高了多少，两者始终记录。
+        peak_kb（本阶段 Python 分配的峰值）仅在 tracemalloc 开启时记录，嵌套阶段的峰值会向外层传递。
+        """
+        record = {'stage': name, 'rows': rows, 'wall_ms': None, 'cpu_ms': None,
+                  'rss_peak_kb': None, 'rss_growth_kb': None, 'peak_kb': None}
+        rss_start = rss_peak_kb()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent['_peak'] = max(parent['_peak'], peak)
+            tracemalloc.reset_peak()
+            record['_base'] = current
+            record['_peak'] = current
+        self._stack.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_ms'] = round((time.perf_counter() - wall_start) * 1000, 2)
+            record['cpu_ms'] = round((time.process_time() - cpu_start) * 1000, 2)
+            rss_end = rss_peak_kb()
+            if rss_end is not None:
+                record['rss_peak_kb'] = round(rss_end, 1)
+                record['rss_growth_kb'] = round(rss_end - rss_start, 1)
+            self._stack.pop()
+            if tracing and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(record['_peak'], peak)
+                record['peak_kb'] = round((peak - record['_base']) / 1024, 1)
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['_peak'] = max(parent['_peak'], peak)
+            record.pop('_base', None)
+            record.pop('_peak', None)
+            self.stages.append(record)
+
+    def record_request(self, name, latency_ms, payload_bytes, status_code=None):
+        """记录一次API请求的延迟和响应大小"""
+        self.requests.append({
+            'request': name,
+            'latency_ms': round(latency_ms, 2),
+            'payload_bytes': payload_bytes,
+            'status_code': status_code
+        })
+
+    # --- 输出 ---
+    def summary_lines(self):
+        """生成用于运行日志的摘要文本行"""
+        lines = ["性能统计:"]
+        for rec in self.stages:
+            rows = "-" if rec['rows'] is None else rec['rows']
+            rss = "-" if rec.get('rss_peak_kb') is None else \
+                f"{rec['rss_peak_kb'] / 1024:.1f}MB (+{rec['rss_growth_kb'] / 1024:.1f}MB)"
+            line = (f"  [{rec['stage']}] 耗时 {rec['wall_ms']:.1f}ms, CPU {rec['cpu_ms']:.1f}ms, "
+                    f"行数 {rows}, 内存峰值 {rss}")
+            if rec['peak_kb'] is not None:
+                line += f", 分配峰值 {rec['peak_kb']:.1f}KB"
+            lines.append(line)
+        for req in self.requests:
+            lines.append(
+                f"  [请求 {req['request']}] 延迟 {req['latency_ms']:.1f}ms, "
+                f"响应大小 {req['payload_bytes'] / 1024:.1f}KB, 状态码 {req['status_code']}"
+            )
+        return lines
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'capture_profile': self.capture_profile,
+            'trace_memory': self.trace_memory,
+            'stages': self.stages,
+            'requests': self.requests,
+            'profile': self.profile_text,
+            'memory_top': self.memory_top
+        }
+
+    def save_json(self, path):
+        """将追踪结果写入 JSON 文件"""
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+            return True, f"性能追踪已保存到 '{path}'"
+        except Exception as e:
+            return False, f"保存性能追踪文件时出错: {e}"
+
+
+def trace_stage(tracer, name, rows=None):
+    """tracer 为 None 时返回空上下文，便于在未开启追踪时直接调用"""
+    if tracer is None:
+        return nullcontext({'stage': name, 'rows': rows})
+    return tracer.stage(name, rows)
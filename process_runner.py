@@ -0,0 +1,176 @@
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from analysis_job import AnalysisJob, JobCancelled
+from api_client import APIClient, DEFAULT_PAGE_CAP
+from data_processor import DEFAULT_MATCHING_POLICY
+from details_store import DetailsStore
+from perf_trace import PerfTracer, trace_stage
+from result_cache import AnalysisCache
+from rollup_cube import RollupCube
+
+
+def _write_arrow_stream(sink, table):
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _frame_to_shared_memory(df):
+    """
+    将 DataFrame 以 Arrow IPC 流格式直接写入一块共享内存，返回 (共享内存名称, 字节数)。
+    先用 MockOutputStream 计算大小，再写入共享内存，避免中间缓冲区的拷贝。
+    """
+    if df is None:
+        return None
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    mock = pa.MockOutputStream()
+    _write_arrow_stream(mock, table)
+    size = mock.size()
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    _write_arrow_stream(pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf)), table)
+    name = shm.name
+    # 只解除本进程的映射，共享内存由主进程读取后释放
+    shm.close()
+    return name, size
+
+
+def _frame_from_shared_memory(handle):
+    """
+    从共享内存读取 Arrow IPC 流并还原为 DataFrame，读取后释放共享内存。
+    这一步不是零拷贝：先把 IPC 数据整体复制一次，共享内存即可立即关闭并删除
+    （to_pandas 会引用读取用的缓冲区），再由 to_pandas 按列转换。
+    整个过程是按列的内存拷贝，不经过 pickle 的逐对象序列化。
+    """
+    if handle is None:
+        return None
+    name, size = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def _worker_main(params, result_queue, cancel_event, capture_profile):
+    """子进程入口：获取数据、完成分析，并把结果帧交给主进程"""
+    tracer = PerfTracer(capture_profile=capture_profile, trace_memory=capture_profile)
+    tracer.start()
+    try:
+        job = AnalysisJob(
+            progress_callback=lambda label, percent: result_queue.put(('progress', label, percent)),
+            tracer=tracer,
+            cancel_event=cancel_event,
+            matching_policy=params.get('matching_policy', DEFAULT_MATCHING_POLICY),
+            grid_step=params.get('grid_step'),
+            cache=AnalysisCache(params['cache_dir']) if params.get('cache_dir') else None,
+            window_days=params.get('window_days'),
+            page_cap=params.get('page_cap', DEFAULT_PAGE_CAP),
+            spill_details=params.get('spill_details', False),
+            partitioned=params.get('partitioned', False)
+        )
+        client = APIClient(params['user_id'], params['fund_key'], params['cookie'],
+                           params['start_date'], params['end_date'], tracer=tracer)
+        log_messages = ["正在通过API获取交易数据(独立进程)..."]
+        *frames, log_messages, stock_name_map = job.run(client, log_messages)
+        tracer.stop()
+        # 汇总立方体不跨进程传递，只传递其底层汇总表（包含收益为0的分组），由主进程重建
+        frames.append(job.rollup.leaf if job.rollup is not None else None)
+        # 写入磁盘的明细只传递目录，由主进程直接映射同一组文件
+        details_dir = None
+        if isinstance(frames[3], DetailsStore):
+            details_dir = frames[3].detach()
+            frames[3] = None
+        payload = ([_frame_to_shared_memory(df) for df in frames], details_dir)
+        result_queue.put(('done', payload, log_messages, stock_name_map, tracer))
+    except JobCancelled as e:
+        result_queue.put(('cancelled', str(e)))
+    except Exception as e:
+        result_queue.put(('error', str(e)))
+
+
+class ProcessAnalysisRunner:
+    """
+    在独立进程中运行获取与分析，避免匹配计算与 Tk 事件循环争抢 GIL。
+    结果帧通过共享内存中的 Arrow IPC 流返回，不经过队列序列化；需要安装 pyarrow。
+    接口与 AnalysisJob 保持一致 (cancel / running)，界面可以同样对待。
+    """
+
+    def __init__(self, params, progress_callback=None, capture_profile=False):
+        self.params = params
+        self.progress_callback = progress_callback
+        self.capture_profile = capture_profile
+        # Tk 进程中不安全使用 fork，统一使用 spawn
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = self._context.Queue()
+        self._cancel_event = self._context.Event()
+        self._process = None
+        self._running = True
+        # 分析结果的汇总立方体，run 返回后可用（接口与 AnalysisJob.rollup 一致）
+        self.rollup = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def running(self):
+        return self._running
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        """
+        启动子进程并阻塞等待结果（应在后台线程中调用）。
+        返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, stock_name_map, tracer)。
+        未安装 pyarrow 时直接抛出异常，不会退回到逐对象序列化。
+        """
+        try:
+            if not PYARROW_AVAILABLE:
+                raise Exception("独立进程运行需要安装 pyarrow (pip install -r requirements.txt)。")
+            self._process = self._context.Process(
+                target=_worker_main,
+                args=(self.params, self._queue, self._cancel_event, self.capture_profile),
+                daemon=True
+            )
+            self._process.start()
+            while True:
+                try:
+                    message = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    if not self._process.is_alive():
+                        raise Exception(f"分析子进程意外退出，退出码: {self._process.exitcode}")
+                    continue
+
+                kind = message[0]
+                if kind == 'progress':
+                    if self.progress_callback is not None:
+                        self.progress_callback(message[1], message[2])
+                elif kind == 'done':
+                    _, (handles, details_dir), log_messages, stock_name_map, tracer = message
+                    frames = [_frame_from_shared_memory(handle) for handle in handles]
+                    if details_dir is not None:
+                        frames[3] = DetailsStore(details_dir, remove_on_close=True)
+                    rollup_leaf = frames.pop()
+                    with trace_stage(tracer, 'rollup', 0 if rollup_leaf is None else len(rollup_leaf)):
+                        self.rollup = RollupCube(rollup_leaf) if rollup_leaf is not None else None
+                    return (*frames, log_messages, stock_name_map, tracer)
+                elif kind == 'cancelled':
+                    raise JobCancelled(message[1])
+                else:
+                    raise Exception(message[1])
+        finally:
+            if self._process is not None:
+                self._process.join(timeout=5)
+            self._running = False
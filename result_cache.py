@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+
+from session_snapshot import write_frames_file, read_manifest, read_segment
+
+# 结果格式变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 4
+CACHE_EXTENSION = '.gridcache'
+# 缓存的结果元组中各帧的名称：四个结果帧和汇总立方体的底层汇总表
+CACHE_FRAME_NAMES = ('account_month', 'stock_summary', 'stock_detail', 'details', 'rollup')
+DEFAULT_CACHE_DIR = '.analysis_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class AnalysisCache:
+    """
+    分析结果缓存。以原始交易记录、股票名称映射和分析参数的哈希作为键，
+    把 analyze_trades_from_data 的四个结果 DataFrame 和汇总立方体的底层汇总表保存在磁盘上。
+    与会话快照使用同一种文件格式（Arrow IPC 数据段 + JSON 清单），缓存目录可能由分析服务的所有用户共享，
+    读取时只解析数据，不会反序列化任何对象。
+    按最近使用时间淘汰，保证目录总大小不超过 max_bytes。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(trades, stock_name_map, params):
+        """对输入内容做规范化 JSON 序列化后计算 SHA-256"""
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_FORMAT_VERSION).encode())
+        for part in (params, stock_name_map or {}, trades):
+            digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{CACHE_EXTENSION}")
+
+    def get(self, key):
+        """命中时返回结果元组并刷新其最近使用时间，否则返回 None"""
+        path = self._path(key)
+        try:
+            manifest = read_manifest(path, '分析缓存')
+            if manifest.get('version') != CACHE_FORMAT_VERSION:
+                raise Exception(f"不支持的分析缓存版本: {manifest.get('version')}")
+            frames = tuple(read_segment(path, manifest['segments'].get(name)) for name in CACHE_FRAME_NAMES)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 损坏或格式不对的缓存文件直接丢弃
+            self._remove(path)
+            return None
+        os.utime(path)
+        return frames
+
+    def put(self, key, frames):
+        """写入结果（先写临时文件再替换，避免读到半个文件），然后按大小淘汰"""
+        write_frames_file(self._path(key), dict(zip(CACHE_FRAME_NAMES, frames)), {'version': CACHE_FORMAT_VERSION})
+        self.evict()
+
+    def evict(self):
+        """按最近使用时间从旧到新删除，直到总大小不超过上限"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
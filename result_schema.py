@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+# 结果帧的规范列类型，由 data_processor.finalize_result_frames 一次确定：
+# 月份为 'YYYY-MM' 字符串，时间列为 datetime64[ns]。界面、导出、缓存和快照直接使用，不再转换
+DATETIME_DTYPE = 'datetime64[ns]'
+DATETIME_COLUMNS = ('sell_datetime', 'buy_datetime')
+
+
+def month_labels(values):
+    """把 Period[M] 或时间列整列转换为 'YYYY-MM' 字符串数组"""
+    if isinstance(getattr(values, 'dtype', None), pd.PeriodDtype):
+        # 月度 Period 的序号就是距 1970-01 的月数，与 datetime64[M] 相同
+        months = np.asarray(values.array.asi8).astype('datetime64[M]')
+    else:
+        months = np.asarray(values, dtype='datetime64[ns]').astype('datetime64[M]')
+    return months.astype(str)
+
+
+def stock_name_labels(codes, stock_name_map):
+    """每个不同的股票代码只查一次映射，返回与 codes 对应的名称数组（找不到名称时使用代码）"""
+    return np.array([stock_name_map.get(code, code) for code in codes], dtype=object)
+
+
+def attach_stock_names(df, stock_name_map):
+    """按股票代码的分类编码连接名称：先对代码编码，再按编码整列取名称，添加 stock_name 列"""
+    codes, uniques = pd.factorize(df['stock_code'])
+    df['stock_name'] = stock_name_labels(uniques, stock_name_map)[codes]
+    return df
@@ -0,0 +1,89 @@
+from itertools import combinations
+
+import pandas as pd
+
+
+class RollupCube:
+    """
+    账户 × 年份 × 月份 × 股票 汇总立方体。
+    构建时一次性计算所有维度组合上的收益合计和交易对数，之后任意层级的查询都是字典查找，
+    不需要再对结果表做分组汇总。
+    """
+    DIMENSIONS = ('account_name', 'year', 'month', 'stock_code')
+
+    def __init__(self, summary_df, profit_col='total_profit', pairs_col='trade_pair_count'):
+        leaf = summary_df.reset_index(drop=True)
+        self.profit_col = profit_col
+        self.pairs_col = pairs_col if pairs_col in leaf.columns else None
+        self.stock_names = {}
+        if 'stock_name' in leaf.columns:
+            self.stock_names = dict(zip(leaf['stock_code'], leaf['stock_name']))
+
+        # 结果中的月份已是 'YYYY-MM' 字符串，年份取其前四位，便于界面直接用下拉框的值查询
+        keys = pd.DataFrame({
+            'account_name': leaf['account_name'],
+            'year': leaf['month'].str[:4].astype(int),
+            'month': leaf['month'],
+            'stock_code': leaf['stock_code'],
+            'profit': leaf[profit_col],
+            'pairs': leaf[self.pairs_col] if self.pairs_col else 0,
+        })
+        self.leaf = leaf
+
+        self._cells = {}
+        self._frames = {}
+        self._rows = {}
+        for size in range(len(self.DIMENSIONS) + 1):
+            for dims in combinations(self.DIMENSIONS, size):
+                self._build_level(keys, dims)
+
+    def _build_level(self, keys, dims):
+        if not dims:
+            profit = round(float(keys['profit'].sum()), 2)
+            pairs = int(keys['pairs'].sum())
+            self._cells[dims] = {(): (profit, pairs)}
+            self._frames[dims] = pd.DataFrame({'total_profit': [profit], 'trade_pair_count': [pairs]})
+            self._rows[dims] = {(): list(range(len(keys)))}
+            return
+
+        grouped = keys.groupby(list(dims), sort=True)
+        totals = grouped[['profit', 'pairs']].sum()
+        totals['profit'] = totals['profit'].round(2)
+        index = [key if isinstance(key, tuple) else (key,) for key in totals.index]
+        self._cells[dims] = dict(zip(index, zip(totals['profit'].tolist(), totals['pairs'].tolist())))
+        self._rows[dims] = {
+            (key if isinstance(key, tuple) else (key,)): positions
+            for key, positions in grouped.indices.items()
+        }
+
+        frame = totals.reset_index().rename(columns={'profit': 'total_profit', 'pairs': 'trade_pair_count'})
+        if 'stock_code' in dims and self.stock_names:
+            frame.insert(frame.columns.get_loc('stock_code') + 1, 'stock_name', frame['stock_code'].map(self.stock_names))
+        self._frames[dims] = frame
+
+    @staticmethod
+    def _key(filters):
+        dims = tuple(dim for dim in RollupCube.DIMENSIONS if filters.get(dim) is not None)
+        return dims, tuple(filters[dim] for dim in dims)
+
+    def get(self, **filters):
+        """返回指定维度取值上的 (收益合计, 交易对数)，未指定的维度视为全部"""
+        dims, key = self._key(filters)
+        return self._cells[dims].get(key, (0.0, 0))
+
+    def rows(self, **filters):
+        """返回满足筛选条件的明细行（原始汇总表中的行）"""
+        dims, key = self._key(filters)
+        positions = self._rows[dims].get(key)
+        if positions is None:
+            return self.leaf.iloc[0:0]
+        return self.leaf.iloc[positions]
+
+    def frame(self, dims):
+        """返回按给定维度汇总的表，例如 ('stock_code', 'month') 或 ('account_name', 'year')"""
+        dims = tuple(dim for dim in self.DIMENSIONS if dim in dims)
+        return self._frames[dims]
+
+    def values(self, dim):
+        """返回某个维度的所有取值（已排序）"""
+        return [key[0] for key in self._cells[(dim,)]]
@@ -0,0 +1,220 @@
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from data_processor import (
+    preprocess_trades,
+    create_matching_policy,
+    match_sorted_trades,
+    MATCHING_POLICIES
+)
+
+# 分组周期：按月、按周、整个区间
+BUCKET_LABELS = {
+    'month': '按月',
+    'week': '按周',
+    'all': '整个区间',
+}
+
+# 子进程中共享的预处理数据，由进程池初始化函数从共享内存映射
+_SWEEP_DATA = None
+_SWEEP_BLOCKS = []
+# prepare_sweep_data 结果中的列式数组，并行评估时放入共享内存
+_ARRAY_FIELDS = ('account_codes', 'stock_codes', 'is_buy', 'moneychg', 'quantity')
+
+
+def prepare_sweep_data(trades):
+    """
+    只做一次预处理，把交易转换为按 (账户, 股票, 时间, 买卖) 排序的列式数组。
+    账户和股票用整数编码，各分组周期的键预先计算好，供所有场景共用。
+    """
+    df, error_msg = preprocess_trades(trades)
+    if df.empty:
+        return None, error_msg or "预处理后无有效交易记录。"
+
+    account_cat = pd.Categorical(df['account_name'])
+    stock_cat = pd.Categorical(df['stock_code'])
+    is_buy = (df['trade_type'] == '买入').to_numpy()
+    times = df['trans_datetime'].to_numpy()
+    account_codes = account_cat.codes.astype(np.int32)
+    stock_codes = stock_cat.codes.astype(np.int32)
+
+    # 同一 (账户, 股票) 内按时间排序，同一时间卖出在前
+    order = np.lexsort((is_buy, times, stock_codes, account_codes))
+    data = {
+        'accounts': list(account_cat.categories),
+        'stocks': list(stock_cat.categories),
+        'account_codes': account_codes[order],
+        'stock_codes': stock_codes[order],
+        'is_buy': is_buy[order],
+        'moneychg': df['moneychg'].to_numpy(dtype=float)[order],
+        'quantity': df['quantity'].to_numpy()[order],
+        'bucket_keys': {
+            'month': df['trans_datetime'].dt.to_period('M').array.asi8[order],
+            'week': df['trans_datetime'].dt.to_period('W').array.asi8[order],
+            'all': np.zeros(len(df), dtype=np.int64),
+        },
+    }
+    return data, error_msg
+
+
+def build_scenarios(policies=None, buckets=None, account_subsets=None, stock_subsets=None, grid_step=None):
+    """
+    生成场景网格。account_subsets / stock_subsets 为子集列表，None 表示全部。
+    """
+    policies = policies or list(MATCHING_POLICIES)
+    buckets = buckets or list(BUCKET_LABELS)
+    account_subsets = account_subsets or [None]
+    stock_subsets = stock_subsets or [None]
+    scenarios = []
+    for policy, bucket, accounts, stocks in product(policies, buckets, account_subsets, stock_subsets):
+        scenarios.append({
+            'matching_policy': policy,
+            'bucket': bucket,
+            'accounts': tuple(accounts) if accounts else None,
+            'stocks': tuple(stocks) if stocks else None,
+            'grid_step': grid_step,
+        })
+    return scenarios
+
+
+def evaluate_scenario(data, scenario):
+    """在共享的列式数据上评估一个场景，返回收益合计、交易对数和分组数"""
+    mask = np.ones(len(data['is_buy']), dtype=bool)
+    if scenario['accounts']:
+        codes = [data['accounts'].index(a) for a in scenario['accounts'] if a in data['accounts']]
+        mask &= np.isin(data['account_codes'], codes)
+    if scenario['stocks']:
+        codes = [data['stocks'].index(s) for s in scenario['stocks'] if s in data['stocks']]
+        mask &= np.isin(data['stock_codes'], codes)
+
+    account_codes = data['account_codes'][mask]
+    stock_codes = data['stock_codes'][mask]
+    bucket_keys = data['bucket_keys'][scenario['bucket']][mask]
+    is_buy = data['is_buy'][mask]
+    moneychg = data['moneychg'][mask]
+    quantity = data['quantity'][mask]
+
+    total_profit = 0.0
+    pair_count = 0
+    group_count = 0
+    if len(is_buy):
+        # 数据已按 (账户, 股票, 时间) 排序，分组键单调，同一分组是连续区间
+        changed = ((account_codes[1:] != account_codes[:-1]) |
+                   (stock_codes[1:] != stock_codes[:-1]) |
+                   (bucket_keys[1:] != bucket_keys[:-1]))
+        bounds = np.concatenate(([0], np.flatnonzero(changed) + 1, [len(is_buy)]))
+        group_count = len(bounds) - 1
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            lots = create_matching_policy(scenario['matching_policy'], scenario['grid_step'])
+            for *_, profit in match_sorted_trades(is_buy[start:end], moneychg[start:end], quantity[start:end], lots):
+                total_profit += profit
+                pair_count += 1
+
+    return {
+        'matching_policy': MATCHING_POLICIES[scenario['matching_policy']].label,
+        'bucket': BUCKET_LABELS[scenario['bucket']],
+        'accounts': '、'.join(scenario['accounts']) if scenario['accounts'] else '全部',
+        'stocks': '、'.join(scenario['stocks']) if scenario['stocks'] else '全部',
+        'total_profit': round(total_profit, 2),
+        'trade_pair_count': pair_count,
+        'group_count': group_count,
+    }
+
+
+def _share_arrays(data):
+    """
+    把列式数组复制到共享内存，返回 (描述, 共享内存块列表)。
+    描述只包含各数组的共享内存名称、形状和类型以及账户、股票名称，传给子进程的开销与数据量无关。
+    """
+    blocks = []
+    arrays = {}
+    named = [(field, data[field]) for field in _ARRAY_FIELDS]
+    named += [(('bucket_keys', bucket), keys) for bucket, keys in data['bucket_keys'].items()]
+    try:
+        for field, array in named:
+            array = np.ascontiguousarray(array)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            arrays[field] = (shm.name, array.shape, array.dtype.str)
+    except Exception:
+        _release_blocks(blocks, unlink=True)
+        raise
+    spec = {'accounts': data['accounts'], 'stocks': data['stocks'], 'arrays': arrays}
+    return spec, blocks
+
+
+def _release_blocks(blocks, unlink=False):
+    for shm in blocks:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _attach_arrays(spec):
+    """在子进程中按描述映射共享内存，数组直接引用共享内存，不复制"""
+    data = {'accounts': spec['accounts'], 'stocks': spec['stocks'], 'bucket_keys': {}}
+    for field, (name, shape, dtype) in spec['arrays'].items():
+        shm = shared_memory.SharedMemory(name=name)
+        _SWEEP_BLOCKS.append(shm)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        if isinstance(field, tuple):
+            data['bucket_keys'][field[1]] = array
+        else:
+            data[field] = array
+    return data
+
+
+def _detach_worker():
+    """子进程退出前先释放引用共享内存的数组，再关闭映射"""
+    global _SWEEP_DATA
+    _SWEEP_DATA = None
+    _release_blocks(_SWEEP_BLOCKS)
+    _SWEEP_BLOCKS.clear()
+
+
+def _init_worker(spec):
+    global _SWEEP_DATA
+    _SWEEP_DATA = _attach_arrays(spec)
+    atexit.register(_detach_worker)
+
+
+def _evaluate_in_worker(scenario):
+    return evaluate_scenario(_SWEEP_DATA, scenario)
+
+
+def run_sweep(trades, scenarios, log_messages, max_workers=None):
+    """
+    预处理一次后并行评估所有场景，返回按总收益降序排列的对比表。
+    预处理得到的列式数组放入共享内存，工作进程初始化时只接收名称、形状和类型并直接映射，之后各场景只传递参数。
+    """
+    data, error_msg = prepare_sweep_data(trades)
+    if error_msg:
+        log_messages.append(error_msg)
+    if data is None:
+        return pd.DataFrame()
+
+    max_workers = max_workers or min(len(scenarios), os.cpu_count() or 1)
+    log_messages.append(f"正在评估 {len(scenarios)} 个场景 (并行进程数: {max_workers})...")
+    if max_workers <= 1:
+        results = [evaluate_scenario(data, scenario) for scenario in scenarios]
+    else:
+        spec, blocks = _share_arrays(data)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(spec,)) as executor:
+                results = list(executor.map(_evaluate_in_worker, scenarios))
+        finally:
+            _release_blocks(blocks, unlink=True)
+
+    log_messages.append("场景评估完成。")
+    result_df = pd.DataFrame(results)
+    return result_df.sort_values('total_profit', ascending=False).reset_index(drop=True)
@@ -0,0 +1,166 @@
+import json
+import os
+import struct
+import tempfile
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from details_store import DetailsStore
+from rollup_cube import RollupCube
+
+# 快照格式变化时递增，旧版本的快照拒绝加载
+SNAPSHOT_FORMAT_VERSION = 4
+SNAPSHOT_EXTENSION = '.gridsnap'
+FRAME_NAMES = ('account_month', 'stock_summary', 'stock_detail', 'details')
+# 汇总立方体的底层汇总表（包含收益为0的分组），打开快照时据此重建立方体
+ROLLUP_SEGMENT = 'rollup'
+# 文件结构：MAGIC | 各结果帧的数据段 | 清单 JSON | 清单偏移量(8 字节) | MAGIC
+_MAGIC = b'GRIDSNAP'
+_FOOTER = struct.Struct('<Q8s')
+_DETAILS_CHUNK_ROWS = 50000
+
+
+def _iter_chunks(df):
+    """按块产出要写入的 DataFrame；写入磁盘的明细逐块读取，不需要整体载入内存"""
+    if isinstance(df, DetailsStore) and not df.empty:
+        yield from df.iter_frames(chunk_rows=_DETAILS_CHUNK_ROWS)
+    elif isinstance(df, DetailsStore):
+        yield df.to_frame()
+    else:
+        yield df.reset_index(drop=True)
+
+
+def _write_segment(f, df):
+    """把一个结果帧以 Arrow IPC 文件格式 (Feather V2) 写入文件的当前位置，返回该数据段的描述"""
+    offset = f.tell()
+    # 结果帧已是规范类型（月份为 'YYYY-MM' 字符串，时间列为 datetime64[ns]），直接写入
+    sink = pa.PythonFile(f, mode='w')
+    writer = None
+    for chunk in _iter_chunks(df):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+    writer.close()
+    return {'offset': offset, 'length': f.tell() - offset, 'encoding': 'feather', 'rows': len(df)}
+
+
+def write_frames_file(path, named_frames, manifest):
+    """
+    把若干结果帧写入一个文件：MAGIC | 各结果帧的数据段 | 清单 JSON | 页脚。
+    named_frames 为 {名称: DataFrame 或 DetailsStore 或 None}，各数据段的位置记录在清单的 segments 中。
+    先写临时文件再替换，出错时抛出异常。会话快照和分析缓存都使用这种格式。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_MAGIC)
+            segments = {name: _write_segment(f, df) if df is not None else None for name, df in named_frames.items()}
+            manifest_offset = f.tell()
+            f.write(json.dumps({**manifest, 'segments': segments}, ensure_ascii=False, default=str).encode('utf-8'))
+            f.write(_FOOTER.pack(manifest_offset, _MAGIC))
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def read_manifest(path, kind='会话快照'):
+    """读取 write_frames_file 写入的文件的清单，文件不完整或格式不对时抛出异常"""
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise Exception(f"'{path}' 不是{kind}文件。")
+        f.seek(-_FOOTER.size, os.SEEK_END)
+        manifest_end = f.tell()
+        manifest_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != _MAGIC:
+            raise Exception(f"{kind} '{path}' 不完整或已损坏。")
+        f.seek(manifest_offset)
+        return json.loads(f.read(manifest_end - manifest_offset).decode('utf-8'))
+
+
+def read_segment(path, segment):
+    """读取一个数据段并还原为 DataFrame；只接受 Arrow IPC 数据，不会反序列化任何对象"""
+    if segment is None:
+        return None
+    # 只读取该数据段；不保留文件映射，文件可以随时被覆盖
+    with open(path, 'rb') as f:
+        f.seek(segment['offset'])
+        data = f.read(segment['length'])
+    if segment['encoding'] != 'feather':
+        raise Exception(f"不支持的数据段格式: {segment['encoding']}")
+    if not PYARROW_AVAILABLE:
+        raise Exception("读取该文件需要安装 pyarrow (pip install -r requirements.txt)。")
+    return pa.ipc.open_file(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def save_snapshot(path, frames, stock_name_map=None, params=None, rollup=None):
+    """
+    保存会话快照：四个结果帧、汇总立方体的底层汇总表、股票名称映射和运行参数写入一个文件。
+    结果帧以 Feather (Arrow IPC) 列式格式保存，只包含数据，打开快照时不会执行任何代码。
+    先写临时文件再替换，返回 (是否成功, 消息)。
+    """
+    if not PYARROW_AVAILABLE:
+        return False, "保存会话快照需要安装 pyarrow (pip install -r requirements.txt)。"
+    named_frames = dict(zip(FRAME_NAMES, frames))
+    named_frames[ROLLUP_SEGMENT] = rollup.leaf if rollup is not None else None
+    manifest = {
+        'version': SNAPSHOT_FORMAT_VERSION,
+        'saved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'params': params or {},
+        'stock_name_map': stock_name_map or {},
+    }
+    try:
+        write_frames_file(path, named_frames, manifest)
+        return True, f"会话快照已保存到 '{path}'"
+    except Exception as e:
+        return False, f"保存会话快照时出错: {e}"
+
+
+class SessionSnapshot:
+    """
+    已保存的会话快照。打开时只读取清单，summary_frames 读取三个汇总帧，
+    交易匹配明细只在调用 load_details 时读取。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        manifest = read_manifest(path)
+        if manifest.get('version') != SNAPSHOT_FORMAT_VERSION:
+            raise Exception(f"不支持的会话快照版本: {manifest.get('version')}")
+        self.saved_at = manifest['saved_at']
+        self.params = manifest['params']
+        self.stock_name_map = manifest['stock_name_map']
+        self.segments = manifest['segments']
+
+    def details_rows(self):
+        segment = self.segments.get('details')
+        return 0 if segment is None else segment['rows']
+
+    def read_frame(self, name):
+        return read_segment(self.path, self.segments.get(name))
+
+    def summary_frames(self):
+        """返回 (account_month_df, stock_summary_df, stock_detail_df)"""
+        return tuple(self.read_frame(name) for name in FRAME_NAMES[:3])
+
+    def load_details(self):
+        return self.read_frame('details')
+
+    def load_rollup(self):
+        """由保存的底层汇总表重建汇总立方体，没有结果时返回 None"""
+        leaf = self.read_frame(ROLLUP_SEGMENT)
+        return RollupCube(leaf) if leaf is not None else None
+
+
+def load_snapshot(path):
+    return SessionSnapshot(path)
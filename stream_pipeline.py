@@ -0,0 +1,182 @@
+import json
+import queue
+import threading
+from collections import Counter
+from datetime import timedelta
+
+import pandas as pd
+
+from data_processor import (
+    preprocess_trades,
+    match_group,
+    build_result_frames,
+    DEFAULT_MATCHING_POLICY,
+    MATCHING_POLICIES
+)
+from perf_trace import trace_stage
+
+_END_OF_STREAM = object()
+
+
+def _prefetch(batches, stop_event, maxsize=2, put_timeout=0.1):
+    """
+    在后台线程中提前拉取批次，使网络等待与当前批次的预处理和匹配重叠。
+    队列有界，消费跟不上时生产者会等待；stop_event 置位后生产者不再发起新的请求，
+    正在等待放入队列的批次和结束标记也会被丢弃，线程随即退出。
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+
+    def put(item):
+        # 带超时的放入，消费者取消或出错后不会永远阻塞在满队列上
+        while not stop_event.is_set():
+            try:
+                buffer.put(item, timeout=put_timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if stop_event.is_set() or not put(batch):
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            put(_END_OF_STREAM)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # 消费者提前退出时通知生产者停止，并清空队列释放已拉取的批次
+        stop_event.set()
+        while True:
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                break
+
+
+def count_duplicates(batch_records):
+    """
+    统计在多个批次中重复返回的记录数。batch_records 为各批次的记录列表。
+    同一批次中字段完全相同的记录是真实的多笔成交（例如同一秒同价同量的两笔），不计为重复；
+    某条记录在各批次中出现的总次数超过它在单个批次中出现的最多次数时，多出的部分才是重复。
+    """
+    total = Counter()
+    most = Counter()
+    for records in batch_records:
+        counts = Counter(json.dumps(trade, sort_keys=True, ensure_ascii=False, default=str) for trade in records)
+        total.update(counts)
+        most |= counts
+    return sum(total.values()) - sum(most.values())
+
+
+def check_completeness(batches_meta, start_date, end_date, batch_records, log_messages):
+    """
+    检查分批获取的结果是否完整：窗口是否连续覆盖整个区间、是否有窗口达到返回上限、
+    是否有记录在多个窗口中重复返回。batch_records 为各批次的记录列表。返回 True 表示完整。
+    """
+    complete = True
+    windows = sorted((meta[0], meta[1]) for meta in batches_meta)
+    expected = start_date
+    for window_start, window_end in windows:
+        if window_start != expected:
+            log_messages.append(f"警告：{expected} 至 {window_start - timedelta(days=1)} 的交易记录缺失。")
+            complete = False
+        expected = window_end + timedelta(days=1)
+    if expected <= end_date:
+        log_messages.append(f"警告：{expected} 至 {end_date} 的交易记录缺失。")
+        complete = False
+
+    capped = [f"{meta[0]}~{meta[1]}" for meta in batches_meta if meta[2]]
+    if capped:
+        log_messages.append(f"警告：以下时间窗口的返回数量达到服务端上限，记录可能不完整：{', '.join(capped)}")
+        complete = False
+
+    duplicate_count = count_duplicates(batch_records)
+    if duplicate_count:
+        log_messages.append(f"警告：分批获取的结果中有 {duplicate_count} 条记录在多个时间窗口中重复返回。")
+        complete = False
+    return complete
+
+
+def analyze_trades_streaming(batches, log_messages, start_date, end_date, stock_name_map=None, tracer=None, job=None,
+                             matching_policy=DEFAULT_MATCHING_POLICY, grid_step=None, details_writer=None):
+    """
+    边获取边分析。batches 为 APIClient.iter_stock_history 产出的按时间先后排列的批次。
+    每批到达后立即预处理并按 (账户, 股票, 月份) 归入分组；某个月份的数据全部到达后，
+    该月的分组立即完成匹配，其余分组在最后一批到达后匹配。结果与 analyze_trades_from_data 相同。
+    传入 details_writer 时每组的匹配明细在该组完成时立即写入磁盘，不在内存中积累。
+    返回 (account_month_df, stock_summary_df, stock_detail_df, details_df, log_messages, raw_trades)。
+    """
+    raw_trades = []
+    batch_records = []
+    batches_meta = []
+    pending = {}
+    group_results = {}
+    stop_event = threading.Event()
+
+    def match_pending(closed_before=None):
+        keys = [key for key in pending if closed_before is None or key[2] < closed_before]
+        for key in keys:
+            group = pd.concat(pending.pop(key)) if len(pending[key]) > 1 else pending.pop(key)[0]
+            summary_row, matched_trades = match_group(key, group, matching_policy, grid_step)
+            if details_writer is not None:
+                details_writer.extend(matched_trades)
+                matched_trades = []
+            group_results[key] = (summary_row, matched_trades)
+
+    policy_label = MATCHING_POLICIES[matching_policy].label
+    log_messages.append(f"正在分段获取交易数据并同步匹配 (匹配策略: {policy_label})...")
+    try:
+        with trace_stage(tracer, 'stream_fetch_match') as rec:
+            for batch in _prefetch(batches, stop_event):
+                batches_meta.append((batch.start_date, batch.end_date, batch.capped))
+                raw_trades.extend(batch.records)
+                batch_records.append(batch.records)
+                if job is not None:
+                    done = len(batches_meta)
+                    job.checkpoint('stream', done, done + batch.remaining_windows)
+
+                if batch.records:
+                    df, _ = preprocess_trades(batch.records)
+                    if not df.empty:
+                        for key, part in df.groupby(['account_name', 'stock_code', 'month']):
+                            pending.setdefault(key, []).append(part)
+
+                # 窗口结束日之后的第一个月之前的月份都已获取完整，可以立即匹配
+                match_pending(pd.Period(batch.end_date + timedelta(days=1), 'M'))
+            match_pending()
+            rec['rows'] = len(raw_trades)
+
+        log_messages.append(f"分 {len(batches_meta)} 个时间窗口获取到 {len(raw_trades)} 条交易记录。")
+        if check_completeness(batches_meta, start_date, end_date, batch_records, log_messages):
+            log_messages.append("完整性检查通过：时间窗口连续覆盖查询区间，无截断和重复记录。")
+
+        summary_data = []
+        all_matched_details = details_writer if details_writer is not None else []
+        for key in sorted(group_results):
+            summary_row, matched_trades = group_results[key]
+            summary_data.append(summary_row)
+            all_matched_details.extend(matched_trades)
+
+        *frames, rollup = build_result_frames(summary_data, all_matched_details, log_messages, stock_name_map, tracer)
+        if job is not None:
+            job.rollup = rollup
+        return (*frames, log_messages, raw_trades)
+    except BaseException:
+        stop_event.set()
+        # 取消或出错时放弃已写入磁盘的明细，删除临时目录
+        if details_writer is not None:
+            details_writer.abort()
+        raise
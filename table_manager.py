@@ -3,16 +3,30 @@ from tkinter import ttk
 import pandas as pd
 from data_processor import COLUMN_NAME_MAP
 
+# 各表格中标识一行的键列。刷新时按键比较新旧数据，只插入、删除或更新有变化的行
+TABLE_KEYS = {
+    'account_month': ('account_name', 'month'),
+    'stock_summary': ('account_name', 'stock_code', 'month'),
+    'stock_detail': ('account_name', 'stock_code', 'month'),
+    'sweep': ('matching_policy', 'bucket', 'accounts', 'stocks'),
+    # 透视表的键为当前视图中出现的维度列
+    'pivot': ('account_name', 'year', 'month', 'stock_code'),
+}
+
 class TableManager:
     """表格管理器，用于处理表格的创建和更新"""
     
     def __init__(self, app):
         self.app = app
         self.treeviews = {}
+        # 每个表格的 行键 -> (item id, 显示值)，用于增量刷新
+        self.row_items = {}
         
     def create_dynamic_table(self, table_type, df):
         if table_type == "stock_summary":
             parent_frame = self.app.stock_summary_controls['table_frame']
+        elif table_type == "pivot":
+            parent_frame = self.app.pivot_controls['table_frame']
         else:
             parent_frame = getattr(self.app, f"{table_type}_frame")
         
@@ -27,6 +41,7 @@ class TableManager:
         
         tree = ttk.Treeview(frame, columns=columns, show='headings')
         self.treeviews[table_type] = tree
+        self.row_items[table_type] = {}
         
         for i, (col, disp_col) in enumerate(zip(columns, display_columns)):
             tree.heading(col, text=disp_col, command=lambda _col=col: self.app.treeview_sort_column(table_type, _col, False))
@@ -87,7 +102,9 @@ class TableManager:
             # 重新排列DataFrame列
             df = df[new_column_order]
 
-        if table_type not in self.treeviews or not self.treeviews[table_type].winfo_exists():
+        if (table_type not in self.treeviews or not self.treeviews[table_type].winfo_exists()
+                or tuple(self.treeviews[table_type]['columns']) != tuple(df.columns)):
+            # 列发生变化（例如透视视图切换维度）时重新创建表格
             self.create_dynamic_table(table_type, df)
         
         tree = self.treeviews.get(table_type)
@@ -95,16 +112,71 @@ class TableManager:
             self.app.log_message(f"无法找到或创建 {table_type} 的表格。")
             return
 
-        for item in tree.get_children():
-            tree.delete(item)
+        self.sync_rows(table_type, df, remove_missing=True)
+
+    def row_keys(self, table_type, df):
+        """计算每行的键；没有键列或键不唯一时按行位置作为键"""
+        key_columns = [col for col in TABLE_KEYS.get(table_type, ()) if col in df.columns]
+        if key_columns:
+            keys = list(zip(*(df[col].astype(str) for col in key_columns)))
+            if len(set(keys)) == len(keys):
+                return keys
+        return list(range(len(df)))
+
+    def sync_rows(self, table_type, df, remove_missing=True):
+        """
+        按行键把 df 同步到表格：新键插入，显示值变化的行原地更新，
+        remove_missing 为 True 时删除 df 中已不存在的行并按 df 的顺序排列。
+        未变化的行保持不动，因此选中状态和滚动位置得以保留。
+        """
+        tree = self.treeviews[table_type]
+        items = self.row_items.setdefault(table_type, {})
+        columns = list(tree['columns'])
+        df = df.reindex(columns=columns, fill_value="")
+        keys = self.row_keys(table_type, df)
+        first_visible = tree.yview()[0]
+
+        if remove_missing:
+            new_keys = set(keys)
+            stale = [items.pop(key)[0] for key in list(items) if key not in new_keys]
+            if stale:
+                tree.delete(*stale)
+
+        order = []
+        for key, values in zip(keys, df.itertuples(index=False, name=None)):
+            display = tuple(str(value) for value in values)
+            entry = items.get(key)
+            if entry is None:
+                item = tree.insert("", "end", values=values)
+                items[key] = (item, display)
+            else:
+                item, old_display = entry
+                if old_display != display:
+                    tree.item(item, values=values)
+                    items[key] = (item, display)
+            order.append(item)
+
+        if remove_missing and list(tree.get_children()) != order:
+            for index, item in enumerate(order):
+                tree.move(item, '', index)
+        tree.yview_moveto(first_visible)
+
+    def upsert_rows(self, table_type, df):
+        """
+        只更新 df 中给出的行：键已存在的行更新其值，不存在的追加到末尾，其余行不变。
+        表格尚未创建时退回到 populate_table。
+        """
+        if df is None or df.empty:
+            return
+        tree = self.treeviews.get(table_type)
+        if not tree or not tree.winfo_exists() or not tree.get_children():
+            self.populate_table(table_type, df)
+            return
+        self.sync_rows(table_type, df, remove_missing=False)
 
-        for index, row in df.iterrows():
-            values = [row[col] for col in df.columns]
-            tree.insert("", "end", values=values)
-            
     def clear_tables(self):
-        for table_type in ["account_month", "stock_summary", "stock_detail"]:
+        for table_type in ["account_month", "stock_summary", "stock_detail", "sweep", "pivot"]:
             tree = self.treeviews.get(table_type)
             if tree:
-                for item in tree.get_children():
-                    tree.delete(item)
\ No newline at end of file
+                tree.delete(*tree.get_children())
+            self.row_items[table_type] = {}
\ No newline at end of file
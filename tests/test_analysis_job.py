@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_job import AnalysisJob
+from api_client import APIClient, DEFAULT_PAGE_CAP
+from data_processor import analyze_trades_from_data
+from mock_api_server import MockAPIServer
+
+
+def run_job(server, start_date, end_date, **job_kwargs):
+    client = APIClient('u1', 'f1', 'c1', start_date, end_date, base_url=server.base_url)
+    job = AnalysisJob(**job_kwargs)
+    *frames, log_messages, stock_name_map = job.run(client, [])
+    return frames, log_messages, stock_name_map
+
+
+def test_job_uses_the_default_page_cap():
+    assert AnalysisJob().page_cap == DEFAULT_PAGE_CAP
+
+
+def test_capped_windows_are_split_and_results_are_complete():
+    # 每个 31 天的窗口约 1500 条，超过上限，需要拆分到 8 天左右的窗口才能取全
+    with MockAPIServer(trade_count=1500, start_date='20240101', end_date='20240131',
+                       page_cap=DEFAULT_PAGE_CAP) as server:
+        frames, log_messages, stock_name_map = run_job(server, '20240101', '20240131', window_days=31)
+        expected = analyze_trades_from_data(list(server.trades), [], stock_name_map)
+
+    assert any('完整性检查通过' in message for message in log_messages)
+    window_log = next(message for message in log_messages if message.startswith('分 '))
+    assert not window_log.startswith('分 1 个') and window_log.endswith('获取到 1500 条交易记录。')
+    for frame, expected_frame in zip(frames[:3], expected[:3]):
+        pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected_frame.reset_index(drop=True))
+
+
+def test_single_day_overflow_is_reported_as_incomplete():
+    # 每天约 700 条，单日窗口仍超过上限，无法再拆分
+    with MockAPIServer(trade_count=2100, start_date='20240101', end_date='20240103',
+                       page_cap=DEFAULT_PAGE_CAP) as server:
+        _, log_messages, _ = run_job(server, '20240101', '20240103', window_days=7)
+
+    warning = next(message for message in log_messages if '达到服务端上限' in message)
+    assert '2024-01-01~2024-01-01' in warning
+    assert not any('完整性检查通过' in message for message in log_messages)
+
+
+def test_single_request_reaching_the_cap_is_reported():
+    with MockAPIServer(trade_count=1000, start_date='20240101', end_date='20240131',
+                       page_cap=DEFAULT_PAGE_CAP) as server:
+        _, log_messages, _ = run_job(server, '20240101', '20240131')
+
+    assert any('达到服务端单次返回上限' in message for message in log_messages)
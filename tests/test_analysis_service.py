@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_service import AnalysisService, FINISHED_STATES, ServiceClient
+from mock_api_server import MockAPIServer
+
+
+def make_params(**overrides):
+    params = {'user_id': 'u1', 'fund_key': 'f1', 'cookie': 'c1',
+              'start_date': '20240101', 'end_date': '20240331'}
+    params.update(overrides)
+    return params
+
+
+def wait_finished(client, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.status(job_id)
+        if status['status'] in FINISHED_STATES:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"任务 {job_id} 未在 {timeout} 秒内结束")
+
+
+@pytest.fixture
+def mock_api():
+    # 每个接口请求有延迟，提交后任务会保持运行一段时间
+    with MockAPIServer(trade_count=300, start_date='20240101', end_date='20240331', latency_ms=400) as server:
+        yield server
+
+
+def start_service(mock_api, **kwargs):
+    return AnalysisService(port=0, cache_dir=None, api_base_url=mock_api.base_url, **kwargs)
+
+
+def test_concurrent_identical_requests_share_one_computation(mock_api):
+    with start_service(mock_api) as service:
+        client = ServiceClient(service.base_url)
+        first = client.submit(make_params())
+        second = client.submit(make_params())
+        assert second['job_id'] == first['job_id']
+        assert second['coalesced'] and not first['coalesced']
+        assert wait_finished(client, first['job_id'])['status'] == 'done'
+        assert service.service_stats()['computed'] == 1
+
+        # 保留时间内相同的请求直接复用已完成的结果
+        reused = client.submit(make_params())
+        assert reused['job_id'] == first['job_id']
+        assert reused['status'] == 'done'
+        frames = client.result(reused['job_id'])
+        assert not frames[1].empty
+        assert service.service_stats()['computed'] == 1
+
+
+def test_submit_is_rejected_when_queue_is_full(mock_api):
+    with start_service(mock_api, workers=1, max_pending=0) as service:
+        client = ServiceClient(service.base_url)
+        running = client.submit(make_params())
+        with pytest.raises(Exception, match='繁忙'):
+            client.submit(make_params(start_date='20240201'))
+        assert service.service_stats()['rejected'] == 1
+        client.cancel(running['job_id'])
+        wait_finished(client, running['job_id'])
+
+
+def test_job_stops_only_after_every_subscriber_cancels(mock_api):
+    with start_service(mock_api) as service:
+        client = ServiceClient(service.base_url)
+        job_id = client.submit(make_params())['job_id']
+        client.submit(make_params())
+
+        assert client.cancel(job_id)['subscribers'] == 1
+        assert client.cancel(job_id)['subscribers'] == 0
+        assert wait_finished(client, job_id)['status'] == 'cancelled'
+
+
+def test_resubmit_after_cancel_starts_a_new_computation(mock_api):
+    with start_service(mock_api) as service:
+        client = ServiceClient(service.base_url)
+        cancelled = client.submit(make_params())['job_id']
+        client.cancel(cancelled)
+
+        # 被取消的任务可能还没到检查点，新的相同请求不能合并到它上面
+        resubmitted = client.submit(make_params())
+        assert resubmitted['job_id'] != cancelled
+        assert not resubmitted['coalesced']
+        assert wait_finished(client, cancelled)['status'] == 'cancelled'
+        assert wait_finished(client, resubmitted['job_id'])['status'] == 'done'
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_client
+from api_client import APIClient, extract_trade_list
+from mock_api_server import MockAPIServer
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    # 替身服务器的 Retry-After 为 1 秒，测试中缩短等待
+    monkeypatch.setattr(api_client, 'RETRY_MAX_DELAY', 0.1)
+
+
+def make_client(server, start_date='20240101', end_date='20240114', **kwargs):
+    return APIClient('u1', 'f1', 'c1', start_date, end_date, base_url=server.base_url + '/', **kwargs)
+
+
+def test_base_url_points_the_client_at_the_server():
+    with MockAPIServer(trade_count=100, start_date='20240101', end_date='20240114') as server:
+        response = make_client(server).get_stock_history()
+        assert extract_trade_list(response.json()) == server.trades
+        assert make_client(server)._get_stock_position().json()['ex_data']['position']
+        assert server.stats['ok'] == 2
+
+
+def test_iter_stock_history_splits_windows_that_reach_the_page_cap():
+    with MockAPIServer(trade_count=300, start_date='20240101', end_date='20240114', page_cap=50) as server:
+        batches = list(make_client(server).iter_stock_history(window_days=14, page_cap=50))
+        trades = server.trades
+
+    assert len(batches) > 1
+    assert not any(batch.capped for batch in batches)
+    assert all(len(batch.records) < 50 for batch in batches)
+    # 拆分后的窗口按时间先后连续覆盖整个区间，记录不重不漏
+    assert batches[0].start_date.strftime('%Y%m%d') == '20240101'
+    assert batches[-1].end_date.strftime('%Y%m%d') == '20240114'
+    for previous, batch in zip(batches, batches[1:]):
+        assert (batch.start_date - previous.end_date).days == 1
+    assert [record for batch in batches for record in batch.records] == trades
+    assert batches[-1].remaining_windows == 0
+
+
+def test_server_errors_are_retried_and_then_raised():
+    with MockAPIServer(trade_count=10, error_rate=1.0) as server:
+        with pytest.raises(Exception, match='网络请求失败.*500'):
+            make_client(server, max_retries=2).get_stock_history()
+        assert server.stats['errors'] == 3
+
+
+def test_rate_limited_request_succeeds_after_retry():
+    with MockAPIServer(trade_count=10, rate_limit=20, burst=1) as server:
+        client = make_client(server)
+        client.get_stock_history()
+        client.get_stock_history()
+        assert server.stats['rate_limited'] >= 1
+        assert server.stats['ok'] == 2
+
+
+def test_errors_propagate_without_retries():
+    with MockAPIServer(trade_count=10, rate_limit=0.1, burst=1) as server:
+        client = make_client(server, max_retries=0)
+        client.get_stock_history()
+        with pytest.raises(Exception, match='429'):
+            list(client.iter_stock_history(window_days=7))
+        assert server.stats['rate_limited'] == 1
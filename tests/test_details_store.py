@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_job import JobCancelled
+from data_processor import analyze_trades_from_data
+from details_store import DetailsStore, DetailsWriter
+from partitioned_pipeline import analyze_trades_partitioned
+from stream_pipeline import analyze_trades_streaming
+
+from test_partition_export import make_trades
+
+
+class CancelAtGroup:
+    """在第 cancel_at 个匹配分组的检查点取消的任务替身"""
+
+    def __init__(self, cancel_at):
+        self.cancel_at = cancel_at
+        self.cancelled = False
+        self.rollup = None
+
+    def checkpoint(self, stage, done=0, total=0):
+        if stage == 'match' and done >= self.cancel_at:
+            self.cancelled = True
+            raise JobCancelled("分析已取消")
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return tmp_path
+
+
+def spill_dirs(path):
+    return [name for name in os.listdir(path) if name.startswith(('grid_details_', 'grid_partitions_'))]
+
+
+def test_spilled_details_are_kept_until_the_store_is_closed(temp_dir):
+    *frames, _ = analyze_trades_from_data(make_trades('账户A', [1, 2, 3]), [], details_writer=DetailsWriter())
+    details = frames[3]
+    assert isinstance(details, DetailsStore) and len(details) > 0
+    assert len(spill_dirs(temp_dir)) == 1
+    details.close()
+    assert spill_dirs(temp_dir) == []
+
+
+def test_cancelled_spilled_run_removes_the_details_directory(temp_dir):
+    with pytest.raises(JobCancelled):
+        analyze_trades_from_data(make_trades('账户A', [1, 2, 3, 4, 5]), [], job=CancelAtGroup(3),
+                                 details_writer=DetailsWriter())
+    assert spill_dirs(temp_dir) == []
+
+
+@pytest.mark.parametrize('trades', [[], 'error'])
+def test_spilled_run_without_results_removes_the_details_directory(temp_dir, trades):
+    if trades == 'error':
+        trades = [{'account_name': '账户A'}]
+    frames = analyze_trades_from_data(trades, [], details_writer=DetailsWriter())
+    assert frames[3].empty
+    assert spill_dirs(temp_dir) == []
+
+
+def test_failed_streaming_run_removes_the_details_directory(temp_dir):
+    def batches():
+        yield SimpleNamespace(records=make_trades('账户A', [1]), start_date=date(2024, 1, 1),
+                              end_date=date(2024, 1, 31), capped=False, remaining_windows=1)
+        raise ConnectionError("连接中断")
+
+    with pytest.raises(ConnectionError):
+        analyze_trades_streaming(batches(), [], date(2024, 1, 1), date(2024, 2, 29), details_writer=DetailsWriter())
+    assert spill_dirs(temp_dir) == []
+
+
+def test_cancelled_partitioned_run_removes_partitions_and_details(temp_dir):
+    trades = make_trades('账户A', [1, 2]) + make_trades('账户B', [1, 2]) + make_trades('账户C', [1, 2])
+    with pytest.raises(JobCancelled):
+        analyze_trades_partitioned(iter([trades]), [], job=CancelAtGroup(2))
+    assert spill_dirs(temp_dir) == []
+
+
+def test_abort_after_close_keeps_the_store(temp_dir):
+    writer = DetailsWriter()
+    writer.extend([])
+    store = writer.close()
+    writer.abort()
+    assert os.path.isdir(store.directory)
+    store.close()
+    assert not os.path.exists(store.directory)
@@ -0,0 +1,57 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import analyze_trades_from_data
+from intraday_watch import IntradayWatcher
+from stream_pipeline import check_completeness, count_duplicates
+
+from test_matching import make_trade
+
+
+def identical_fills():
+    """同一秒、同价同量的两笔真实买入，之后一笔卖出同时匹配两者"""
+    return [
+        make_trade('20240301100000', '1', 100, 10.0),
+        make_trade('20240301100000', '1', 100, 10.0),
+        make_trade('20240301140000', '2', 200, 11.0),
+    ]
+
+
+def test_seed_keeps_identical_fills_in_the_same_response():
+    trades = identical_fills()
+    frames, changed, rebuilt, new_count, rollup = IntradayWatcher(client=None).seed(trades)
+    expected = analyze_trades_from_data(trades, [])
+
+    assert new_count == 3
+    assert frames[0]['monthly_total_profit'].tolist() == expected[0]['monthly_total_profit'].tolist()
+    assert len(frames[3]) == len(expected[3]) == 2
+    assert frames[3]['profit'].sum() == pytest.approx(expected[3]['profit'].sum())
+
+
+def test_overlapping_polls_only_add_the_excess_fills():
+    watcher = IntradayWatcher(client=None)
+    watcher.seed(identical_fills())
+
+    # 下一次轮询的窗口与上次重叠，已处理的记录原样再次返回
+    assert watcher.ingest(identical_fills()) is None
+
+    # 又成交了一笔与之前完全相同的买入：本次响应中出现 3 次，之前最多 2 次，只有 1 笔是新的
+    _, _, _, new_count, _ = watcher.ingest(identical_fills() + [make_trade('20240301100000', '1', 100, 10.0)])
+    assert new_count == 1
+
+
+def test_identical_fills_within_one_window_are_not_duplicates():
+    first = identical_fills()
+    assert count_duplicates([first]) == 0
+    # 相同的记录在另一个窗口中再次返回才是重复
+    assert count_duplicates([first, first[:1]]) == 1
+
+    log_messages = []
+    meta = [(date(2024, 3, 1), date(2024, 3, 31), False)]
+    assert check_completeness(meta, date(2024, 3, 1), date(2024, 3, 31), [first], log_messages)
+    assert not any('重复' in message for message in log_messages)
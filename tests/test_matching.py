@@ -0,0 +1,209 @@
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import (
+    MatchingPolicy,
+    calculate_grid_profit_for_group,
+    preprocess_trades,
+)
+
+
+def make_trade(timestamp, op, quantity, price, stock_code='600000', account_name='账户A'):
+    """构造一条原始交易记录，op 为 '1' (买入) 或 '2' (卖出)"""
+    money = round(price * quantity, 2)
+    return {
+        'account_name': account_name,
+        'stock_code': stock_code,
+        'transDateTime': timestamp,
+        'moneychg': str(-money if op == '1' else money),
+        'trans_count': str(quantity if op == '1' else -quantity),
+        'op': op,
+    }
+
+
+def make_group(trades):
+    df, error_msg = preprocess_trades(trades)
+    assert error_msg is None
+    return df
+
+
+def baseline_lifo(group_df):
+    """
+    改为按策略匹配之前的原始算法（逐个卖出在 DataFrame 上查找时间在前且最近的买入），
+    作为 LIFO 策略的对照。
+    """
+    buys = group_df[group_df['trade_type'] == '买入'].sort_values('trans_datetime').reset_index(drop=True)
+    sells = group_df[group_df['trade_type'] == '卖出'].sort_values('trans_datetime').reset_index(drop=True)
+    buy_inventory = buys.copy()
+    buy_inventory['remaining_quantity'] = buy_inventory['quantity']
+
+    matched_trades = []
+    total_profit = 0.0
+    for _, sell_record in sells.iterrows():
+        sell_quantity = sell_record['quantity']
+        potential_buys = buy_inventory[
+            (buy_inventory['trans_datetime'] < sell_record['trans_datetime']) &
+            (buy_inventory['remaining_quantity'] > 0)
+        ].copy()
+        potential_buys = potential_buys.sort_values('trans_datetime', ascending=False)
+        while sell_quantity > 0 and not potential_buys.empty:
+            buy_record = potential_buys.iloc[0]
+            available = buy_record['remaining_quantity']
+            matched_quantity = min(sell_quantity, available)
+            buy_moneychg = (buy_record['moneychg'] / buy_record['quantity']) * matched_quantity
+            sell_moneychg = (sell_record['moneychg'] / sell_record['quantity']) * matched_quantity
+            matched_trades.append({
+                'sell_datetime': buy_record['trans_datetime'],
+                'buy_datetime': sell_record['trans_datetime'],
+                'matched_quantity': matched_quantity,
+                'profit': sell_moneychg + buy_moneychg,
+            })
+            total_profit += sell_moneychg + buy_moneychg
+            buy_inventory.at[buy_record.name, 'remaining_quantity'] = available - matched_quantity
+            sell_quantity -= matched_quantity
+            if available - matched_quantity <= 0:
+                potential_buys = potential_buys.iloc[1:]
+            else:
+                potential_buys.iloc[0, potential_buys.columns.get_loc('remaining_quantity')] = available - matched_quantity
+    return total_profit, matched_trades
+
+
+def random_trades(rng, count, unique_times=True):
+    """随机生成同一账户、同一股票、同一月份内的交易；unique_times 为 False 时大量交易共用时间"""
+    if unique_times:
+        seconds = rng.sample(range(28 * 6 * 3600), count)
+    else:
+        seconds = [rng.choice(range(0, 28 * 6 * 3600, 3600 * 24)) for _ in range(count)]
+    trades = []
+    for second in seconds:
+        day, rest = divmod(second, 6 * 3600)
+        timestamp = f"202403{day + 1:02d}{9 + rest // 3600:02d}{rest % 3600 // 60:02d}{rest % 60:02d}"
+        trades.append(make_trade(timestamp, rng.choice(['1', '2']), rng.choice([100, 200, 300]),
+                                 round(10 + rng.random(), 3)))
+    return trades
+
+
+def pairs(matched_trades):
+    return [(pd.Timestamp(trade['sell_datetime']), pd.Timestamp(trade['buy_datetime']), trade['matched_quantity'])
+            for trade in matched_trades]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_lifo_matches_baseline_when_timestamps_are_unique(seed):
+    group = make_group(random_trades(random.Random(seed), 40))
+    expected_profit, expected = baseline_lifo(group)
+    profit, matched = calculate_grid_profit_for_group(group, 'lifo')
+
+    assert pairs(matched) == pairs(expected)
+    assert [trade['profit'] for trade in matched] == pytest.approx([trade['profit'] for trade in expected])
+    assert profit == pytest.approx(expected_profit)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_lifo_matches_baseline_quantity_when_timestamps_tie(seed):
+    # 同一时间的多笔买入之间的先后顺序与旧算法不同，只有每笔卖出匹配的总数量保证一致
+    group = make_group(random_trades(random.Random(seed), 40, unique_times=False))
+    _, expected = baseline_lifo(group)
+    _, matched = calculate_grid_profit_for_group(group, 'lifo')
+
+    def matched_per_sell(trades):
+        totals = {}
+        for trade in trades:
+            key = pd.Timestamp(trade['buy_datetime'])
+            totals[key] = totals.get(key, 0) + trade['matched_quantity']
+        return totals
+
+    assert matched_per_sell(matched) == matched_per_sell(expected)
+
+
+def test_lifo_prefers_last_buy_in_input_order_when_timestamps_tie():
+    group = make_group([
+        make_trade('20240301100000', '1', 100, 10.0),
+        make_trade('20240301100000', '1', 100, 11.0),
+        make_trade('20240301110000', '2', 100, 12.0),
+    ])
+    profit, matched = calculate_grid_profit_for_group(group, 'lifo')
+
+    assert len(matched) == 1
+    assert matched[0]['buy_moneychg'] == pytest.approx(-1100.0)
+    assert profit == pytest.approx(100.0)
+
+
+def test_sell_does_not_match_buy_at_the_same_time():
+    group = make_group([
+        make_trade('20240301100000', '2', 100, 12.0),
+        make_trade('20240301100000', '1', 100, 10.0),
+    ])
+    for policy in ('lifo', 'fifo', 'grid'):
+        profit, matched = calculate_grid_profit_for_group(group, policy)
+        assert matched == []
+        assert profit == 0.0
+
+
+def test_fifo_matches_oldest_open_buy_first():
+    group = make_group([
+        make_trade('20240301100000', '1', 100, 10.0),
+        make_trade('20240302100000', '1', 200, 11.0),
+        make_trade('20240303100000', '2', 200, 12.0),
+        make_trade('20240304100000', '2', 100, 13.0),
+    ])
+    profit, matched = calculate_grid_profit_for_group(group, 'fifo')
+
+    assert [(trade['buy_moneychg'], trade['matched_quantity']) for trade in matched] == [
+        (pytest.approx(-1000.0), 100),
+        (pytest.approx(-1100.0), 100),
+        (pytest.approx(-1100.0), 100),
+    ]
+    assert profit == pytest.approx((1200 - 1000) + (1200 - 1100) + (1300 - 1100))
+
+
+def test_fifo_and_lifo_differ_only_in_buy_order():
+    group = make_group([
+        make_trade('20240301100000', '1', 100, 10.0),
+        make_trade('20240302100000', '1', 100, 11.0),
+        make_trade('20240303100000', '2', 100, 12.0),
+    ])
+    _, lifo = calculate_grid_profit_for_group(group, 'lifo')
+    _, fifo = calculate_grid_profit_for_group(group, 'fifo')
+
+    assert lifo[0]['buy_moneychg'] == pytest.approx(-1100.0)
+    assert fifo[0]['buy_moneychg'] == pytest.approx(-1000.0)
+
+
+def test_grid_level_matches_buy_closest_to_one_step_below_sell():
+    group = make_group([
+        make_trade('20240301100000', '1', 100, 9.0),
+        make_trade('20240302100000', '1', 100, 9.75),
+        make_trade('20240303100000', '1', 100, 9.95),
+        make_trade('20240304100000', '2', 100, 10.0),
+    ])
+    # 步长 3%：目标价 9.7，最接近的是 9.75
+    _, matched = calculate_grid_profit_for_group(group, 'grid', grid_step=3)
+    assert matched[0]['buy_moneychg'] == pytest.approx(-975.0)
+
+    # 步长 10%：目标价 9.0
+    _, matched = calculate_grid_profit_for_group(group, 'grid', grid_step=10)
+    assert matched[0]['buy_moneychg'] == pytest.approx(-900.0)
+
+
+def test_grid_level_continues_with_next_closest_buy_for_partial_fill():
+    group = make_group([
+        make_trade('20240301100000', '1', 100, 9.0),
+        make_trade('20240302100000', '1', 100, 9.7),
+        make_trade('20240303100000', '2', 200, 10.0),
+    ])
+    profit, matched = calculate_grid_profit_for_group(group, 'grid', grid_step=3)
+
+    assert [trade['buy_moneychg'] for trade in matched] == [pytest.approx(-970.0), pytest.approx(-900.0)]
+    assert profit == pytest.approx(2000 - 970 - 900)
+
+
+def test_matching_policy_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        MatchingPolicy()
@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import analyze_trades_from_data
+from details_store import DetailsWriter
+from excel_exporter import PARTITION_INDEX_FILE, save_results_partitioned
+
+
+def make_trades(account_name, months, price=10.0):
+    """每个月份一组买卖，卖出价逐月提高，使各月收益不同"""
+    trades = []
+    for offset, month in enumerate(months):
+        for day, op, quantity in ((3, '1', 100), (10, '2', 100)):
+            money = round((price + offset + (1 if op == '2' else 0)) * quantity, 2)
+            trades.append({
+                'account_name': account_name,
+                'stock_code': '600000',
+                'transDateTime': f"2024{month:02d}{day:02d}100000",
+                'moneychg': str(-money if op == '1' else money),
+                'trans_count': str(quantity if op == '1' else -quantity),
+                'op': op,
+            })
+    return trades
+
+
+def export(output_dir, trades, date_range, spill=False):
+    frames = analyze_trades_from_data(trades, [], {}, details_writer=DetailsWriter() if spill else None)[:4]
+    success, msg = save_results_partitioned(*frames, output_dir=output_dir, date_range=date_range)
+    assert success, msg
+    return msg
+
+
+def index_keys(output_dir):
+    with open(os.path.join(output_dir, PARTITION_INDEX_FILE), 'r', encoding='utf-8') as f:
+        return set(json.load(f)['partitions'])
+
+
+def xlsx_files(output_dir):
+    return sorted(name for name in os.listdir(output_dir) if name.startswith('网格交易收益_'))
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_narrower_run_keeps_months_outside_its_range(tmp_path, spill):
+    output_dir = str(tmp_path)
+    export(output_dir, make_trades('账户A', [1, 2, 3]), ('20240101', '20240331'), spill)
+    assert index_keys(output_dir) == {'账户A|2024-01', '账户A|2024-02', '账户A|2024-03'}
+
+    # 只刷新三月：一、二月的工作簿和索引条目都保留
+    msg = export(output_dir, make_trades('账户A', [3], price=20.0), ('20240301', '20240331'), spill)
+    assert '删除 0 个' in msg
+    assert index_keys(output_dir) == {'账户A|2024-01', '账户A|2024-02', '账户A|2024-03'}
+    assert xlsx_files(output_dir) == ['网格交易收益_账户A_2024-01.xlsx', '网格交易收益_账户A_2024-02.xlsx',
+                                      '网格交易收益_账户A_2024-03.xlsx']
+
+
+def test_other_account_does_not_overwrite_or_delete(tmp_path):
+    output_dir = str(tmp_path)
+    export(output_dir, make_trades('账户A', [1, 2]), ('20240101', '20240229'))
+    before = os.path.getmtime(os.path.join(output_dir, '网格交易收益_账户A_2024-02.xlsx'))
+
+    export(output_dir, make_trades('账户B', [2]), ('20240101', '20240229'))
+    assert index_keys(output_dir) == {'账户A|2024-01', '账户A|2024-02', '账户B|2024-02'}
+    assert os.path.getmtime(os.path.join(output_dir, '网格交易收益_账户A_2024-02.xlsx')) == before
+
+
+def test_month_without_results_inside_range_is_removed(tmp_path):
+    output_dir = str(tmp_path)
+    export(output_dir, make_trades('账户A', [1, 2]), ('20240101', '20240229'))
+
+    # 同一账户、同一区间内二月已没有结果，二月分区被删除
+    msg = export(output_dir, make_trades('账户A', [1]), ('20240101', '20240229'))
+    assert '删除 1 个' in msg
+    assert index_keys(output_dir) == {'账户A|2024-01'}
+    assert xlsx_files(output_dir) == ['网格交易收益_账户A_2024-01.xlsx']
+
+
+def test_without_date_range_nothing_is_deleted(tmp_path):
+    output_dir = str(tmp_path)
+    export(output_dir, make_trades('账户A', [1, 2]), ('20240101', '20240229'))
+    export(output_dir, make_trades('账户A', [1]), None)
+    assert index_keys(output_dir) == {'账户A|2024-01', '账户A|2024-02'}
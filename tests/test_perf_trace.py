@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf_trace import PerfTracer, rss_peak_kb, trace_stage
+
+pytestmark = pytest.mark.skipif(rss_peak_kb() is None, reason="无法读取进程内存峰值")
+
+
+def test_rss_peak_is_recorded_without_tracemalloc():
+    tracer = PerfTracer()
+    with trace_stage(tracer, 'allocate') as rec:
+        # 分配约 64MB 并逐页写入，使进程 RSS 峰值上升
+        block = bytearray(64 * 1024 * 1024)
+        for offset in range(0, len(block), 4096):
+            block[offset] = 1
+        rec['rows'] = len(block)
+        del block
+
+    record = tracer.stages[0]
+    assert record['peak_kb'] is None
+    assert record['rss_peak_kb'] >= record['rss_growth_kb'] >= 0
+    line = tracer.summary_lines()[1]
+    assert '内存峰值 -' not in line and 'MB (+' in line
+    assert '分配峰值' not in line
+
+
+def test_tracemalloc_peak_is_added_in_detailed_mode():
+    tracer = PerfTracer(trace_memory=True)
+    tracer.start()
+    with trace_stage(tracer, 'allocate'):
+        data = [str(i) for i in range(100000)]
+        del data
+    tracer.stop()
+
+    record = tracer.stages[0]
+    assert record['peak_kb'] > 0 and record['rss_peak_kb'] is not None
+    assert '分配峰值' in tracer.summary_lines()[1]
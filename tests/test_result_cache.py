@@ -0,0 +1,54 @@
+import os
+import pickle
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import analyze_trades_from_data
+from result_cache import AnalysisCache, CACHE_EXTENSION
+
+from test_partition_export import make_trades
+
+
+class _Exploit:
+    """反序列化时会执行代码的对象"""
+
+    def __reduce__(self):
+        return (os.system, ('echo pwned > pwned.txt',))
+
+
+def test_cache_round_trip_without_pickle(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    frames = analyze_trades_from_data(make_trades('账户A', [1, 2]), [], {'600000': '浦发银行'})[:4]
+    key = cache.make_key([], {}, {})
+    cache.put(key, (*frames, frames[2]))
+
+    cached = cache.get(key)
+    assert len(cached) == 5
+    for expected, loaded in zip((*frames, frames[2]), cached):
+        pd.testing.assert_frame_equal(loaded, expected.reset_index(drop=True))
+    assert all(name.endswith(CACHE_EXTENSION) for name in os.listdir(tmp_path))
+
+
+def test_cache_round_trip_of_empty_results(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    key = cache.make_key([], {}, {'empty': True})
+    cache.put(key, (pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), None))
+    cached = cache.get(key)
+    assert all(df.empty for df in cached[:4])
+    assert cached[4] is None
+
+
+def test_planted_pickle_is_never_loaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = AnalysisCache(str(tmp_path / 'cache'))
+    key = cache.make_key([], {}, {})
+    # 共享缓存目录中被放入的 pickle 文件（无论扩展名）都不会被反序列化
+    for name in (f"{key}{CACHE_EXTENSION}", f"{key}.pkl"):
+        with open(os.path.join(cache.cache_dir, name), 'wb') as f:
+            pickle.dump(_Exploit(), f)
+
+    assert cache.get(key) is None
+    assert not (tmp_path / 'pwned.txt').exists()
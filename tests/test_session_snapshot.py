@@ -0,0 +1,49 @@
+import json
+import os
+import struct
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import analyze_trades_from_data
+from session_snapshot import load_snapshot, save_snapshot
+
+from test_partition_export import make_trades
+
+
+def test_snapshot_round_trip(tmp_path):
+    trades = make_trades('账户A', [1, 2])
+    frames = analyze_trades_from_data(trades, [], {'600000': '浦发银行'})[:4]
+    path = str(tmp_path / 'session.gridsnap')
+    success, msg = save_snapshot(path, frames, {'600000': '浦发银行'}, {'start_date': '20240101'})
+    assert success, msg
+
+    snapshot = load_snapshot(path)
+    for expected, loaded in zip(frames[:3], snapshot.summary_frames()):
+        pd.testing.assert_frame_equal(loaded, expected.reset_index(drop=True))
+    pd.testing.assert_frame_equal(snapshot.load_details(), frames[3].reset_index(drop=True))
+    assert snapshot.params == {'start_date': '20240101'}
+
+
+def test_snapshot_rejects_non_columnar_segments(tmp_path):
+    path = str(tmp_path / 'session.gridsnap')
+    frames = analyze_trades_from_data(make_trades('账户A', [1]), [], {})[:4]
+    assert save_snapshot(path, frames)[0]
+
+    # 把清单中的数据段格式改为 pickle：打开时必须拒绝，而不是反序列化
+    with open(path, 'rb') as f:
+        data = f.read()
+    footer = struct.Struct('<Q8s')
+    manifest_offset, magic = footer.unpack(data[-footer.size:])
+    manifest = json.loads(data[manifest_offset:-footer.size].decode('utf-8'))
+    manifest['segments']['account_month']['encoding'] = 'pickle'
+    with open(path, 'wb') as f:
+        f.write(data[:manifest_offset])
+        f.write(json.dumps(manifest).encode('utf-8'))
+        f.write(footer.pack(manifest_offset, magic))
+
+    with pytest.raises(Exception, match='不支持'):
+        load_snapshot(path).summary_frames()
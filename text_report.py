@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from details_store import DetailsStore
+
+# 东亚宽字符（中日韩文字、全角符号等）在等宽字体中占两列
+_WIDE_CHARS = ('[\u1100-\u115F\u2E80-\u303E\u3041-\u33FF\u3400-\u4DBF\u4E00-\u9FFF\uA000-\uA4CF'
+               '\uAC00-\uD7A3\uF900-\uFAFF\uFE30-\uFE4F\uFF00-\uFF60\uFFE0-\uFFE6\U00020000-\U0003FFFD]')
+
+# 明细报表的列：(字段, 表头, 显示宽度, 数值格式)。卖出/买入时间沿用明细中交换后的含义
+REPORT_COLUMNS = [
+    ('account_name', '账户名称', 25, None),
+    ('month', '月份', 10, None),
+    ('stock_name', '股票名称', 15, None),
+    ('stock_code', '股票代码', 10, None),
+    ('sell_datetime', '卖出时间', 20, None),
+    ('buy_datetime', '买入时间', 20, None),
+    ('matched_quantity', '匹配数量', 8, None),
+    ('buy_moneychg', '买入金额变化', 15, '%.2f'),
+    ('sell_moneychg', '卖出金额变化', 15, '%.2f'),
+    ('profit', '收益', 12, '%.2f'),
+]
+REPORT_SORT_COLUMNS = ['account_name', 'month', 'stock_name', 'stock_code']
+DEFAULT_REPORT_CHUNK_ROWS = 5000
+
+
+def display_widths(values):
+    """按列计算字符串的显示宽度：宽字符计 2，其余计 1"""
+    values = pd.Series(values, dtype=object).astype(str)
+    return (values.str.len() + values.str.count(_WIDE_CHARS)).to_numpy()
+
+
+def pad_column(values, width):
+    """把一列字符串按显示宽度左对齐补齐到 width（超出时不截断）"""
+    values = np.asarray(pd.Series(values, dtype=object).astype(str), dtype=str)
+    padding = np.maximum(width - display_widths(values), 0)
+    return np.char.add(values, np.char.multiply(' ', padding))
+
+
+def _report_columns(details):
+    return [spec for spec in REPORT_COLUMNS if spec[0] in details.columns]
+
+
+def report_sort_order(details):
+    """返回报表的行顺序（行号数组），只对排序键排序，不复制整张明细表"""
+    sort_cols = [col for col in REPORT_SORT_COLUMNS if col in details.columns]
+    if isinstance(details, DetailsStore):
+        return details.sort_order(sort_cols)
+    keys = details[sort_cols].reset_index(drop=True)
+    return keys.sort_values(sort_cols, kind='stable').index.to_numpy()
+
+
+def _take(details, positions):
+    if isinstance(details, DetailsStore):
+        return details.take(positions)
+    return details.iloc[positions]
+
+
+def format_rows(chunk, columns):
+    """整列格式化一块明细，返回该块的文本（每行以换行结尾）"""
+    if chunk.empty:
+        return ''
+    line = None
+    for col, _, width, number_format in columns:
+        values = chunk[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+        elif number_format is not None:
+            values = np.char.mod(number_format, values.to_numpy(dtype=float))
+        cells = pad_column(values, width)
+        line = cells if line is None else np.char.add(np.char.add(line, ' '), cells)
+    return '\n'.join(line.tolist()) + '\n'
+
+
+def render_details_report(details, chunk_rows=DEFAULT_REPORT_CHUNK_ROWS, order=None, header=True):
+    """
+    逐块产出交易匹配明细的文本报表。details 为 DataFrame 或 DetailsStore。
+    order 为行顺序（默认按 账户/月份/股票 排序），每次只读取并格式化 chunk_rows 行。
+    """
+    columns = _report_columns(details) if details is not None else REPORT_COLUMNS
+    total_width = sum(width for _, _, width, _ in columns) + len(columns) - 1
+    if header:
+        yield ("=" * 150 + "\n" + "详细的交易匹配记录 (收益 = 卖出moneychg + 买入moneychg)\n" + "=" * 150 + "\n")
+    if details is None or details.empty:
+        yield "无匹配记录。\n"
+        return
+
+    if header:
+        titles = [pad_column([title], width)[0] for _, title, width, _ in columns]
+        yield ' '.join(titles) + "\n" + "-" * total_width + "\n"
+    if order is None:
+        order = report_sort_order(details)
+    for start in range(0, len(order), chunk_rows):
+        yield format_rows(_take(details, order[start:start + chunk_rows]), columns)
+
+
+def write_details_report(details, output_file, chunk_rows=DEFAULT_REPORT_CHUNK_ROWS):
+    """把明细报表逐块写入文本文件，返回 (是否成功, 消息)"""
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for text in render_details_report(details, chunk_rows):
+                f.write(text)
+        return True, f"明细报表已保存到 '{output_file}'"
+    except Exception as e:
+        return False, f"保存明细报表时出错: {e}"